@@ -0,0 +1,79 @@
+"""
+Measures how much Pencil and AsyncPencil stall an asyncio event loop. A task
+that should wake up every millisecond runs next to a loop that refreshes a
+large plot and pushes points, and the benchmark reports the time spent in the
+calls to Pencil and the longest delay of the ticking task.
+
+Run with:
+    python benchmarks/async_client.py
+"""
+import asyncio
+import time
+
+import numpy as np
+
+from pncl import AsyncPencil, Pencil
+
+PORT = 8183
+SIZE = 200000
+N_REFRESHES = 20
+N_PUSHES = 2000
+TICK = 0.001
+
+
+async def ticker(lags, done):
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def producer(p):
+    elapsed = 0
+    x = np.arange(SIZE)
+    for _ in range(N_REFRESHES):
+        y = np.random.randn(SIZE)
+        start = time.perf_counter()
+        p.refresh(0, x, y)
+        elapsed += time.perf_counter() - start
+        await asyncio.sleep(0)
+    for i in range(N_PUSHES):
+        start = time.perf_counter()
+        p.push(1, i, float(i))
+        elapsed += time.perf_counter() - start
+        await asyncio.sleep(0)
+    return elapsed
+
+
+async def run(p):
+    lags = []
+    done = asyncio.Event()
+    tick = asyncio.ensure_future(ticker(lags, done))
+    elapsed = await producer(p)
+    done.set()
+    await tick
+    start = time.perf_counter()
+    p.flush()
+    flush = time.perf_counter() - start
+    return elapsed, max(lags), flush
+
+
+def bench(cls, port):
+    p = cls(port=port, sticky=False)
+    p.line(np.arange(SIZE), np.zeros(SIZE))
+    p.line([0], [0.0])
+    p.flush()
+    time.sleep(1)
+    result = asyncio.run(run(p))
+    p.stop()
+    return result
+
+
+if __name__ == '__main__':
+    print('{} refreshes of {} points, {} pushes'.format(N_REFRESHES, SIZE, N_PUSHES))
+    print('{:>12}  {:>14}  {:>14}  {:>10}'.format('client', 'in calls (ms)', 'max stall (ms)', 'flush (ms)'))
+    for i, cls in enumerate([Pencil, AsyncPencil]):
+        elapsed, stall, flush = bench(cls, PORT + i)
+        print('{:>12}  {:>14.1f}  {:>14.1f}  {:>10.1f}'.format(
+            cls.__name__, elapsed * 1e3, stall * 1e3, flush * 1e3
+        ))
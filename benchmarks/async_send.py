@@ -0,0 +1,37 @@
+"""
+Compares the cost of a push for the caller with and without the background
+sender (`async_send=True`), and the total time until all points reached the
+server.
+
+Run with:
+    python benchmarks/async_send.py
+"""
+import time
+
+from pncl import Pencil
+
+PORT = 8185
+N_PUSHES = 50000
+
+
+def bench(async_send, port):
+    p = Pencil(port=port, sticky=False, async_send=async_send)
+    p.line([0], [0.0])
+    p.flush()
+    time.sleep(1)
+    start = time.perf_counter()
+    for i in range(1, N_PUSHES + 1):
+        p.push(0, i, float(i))
+    elapsed = time.perf_counter() - start
+    p.flush()
+    total = time.perf_counter() - start
+    p.stop()
+    return elapsed / N_PUSHES, total
+
+
+if __name__ == '__main__':
+    print('{} pushes'.format(N_PUSHES))
+    print('{:>12}  {:>12}  {:>12}'.format('async_send', 'us / push', 'total (s)'))
+    for i, async_send in enumerate([False, True]):
+        per_push, total = bench(async_send, PORT + i)
+        print('{:>12}  {:>12.2f}  {:>12.3f}'.format(str(async_send), per_push * 1e6, total))
@@ -0,0 +1,96 @@
+"""
+Load test for the broadcast of events to many browser clients. Connects N SSE
+clients to a Pencil server (one of which reads very slowly), pushes a burst of
+points, and counts the clients that received every point and those that were
+resynced.
+
+Run with:
+    python benchmarks/clients.py
+"""
+import asyncio
+import json
+import threading
+import time
+
+import aiohttp
+
+from pncl import Pencil
+
+PORT = 8181
+N_CLIENTS = [2, 10, 50]
+N_PUSHES = 2000
+PUSH_INTERVAL = 0.0005
+
+
+async def client(url, stats, ready, slow=False):
+    received = 0
+    last_x = None
+    resyncs = 0
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+        async with session.get(url) as resp:
+            ready.release()
+            async for line in resp.content:
+                if not line.startswith(b'data:'):
+                    continue
+                event = json.loads(line[5:])
+                # The server merges pushes that arrive together into one event,
+                # and with the refresh that precedes them, so points are counted
+                # instead of events
+                points = []
+                if event['type'] == 'push':
+                    points = event['data']['datasets'][0]['data']
+                    received += len(points)
+                elif event['type'] == 'refresh':
+                    points = event['data']['data']['datasets'][0]['data']
+                    received = len(points) - 1  # Without the point at x=0
+                elif event['type'] == 'new_grid':
+                    resyncs += 1
+                if points:
+                    last_x = points[-1]['x']
+                if slow:
+                    await asyncio.sleep(0.01)
+                if last_x == N_PUSHES or resyncs:
+                    break
+    stats.append((received, resyncs, time.perf_counter(), slow))
+
+
+async def run_clients(n_clients, stats, ready):
+    url = 'http://127.0.0.1:{}/event'.format(PORT)
+    tasks = [
+        asyncio.ensure_future(client(url, stats, ready, slow=(i == 0)))
+        for i in range(n_clients)
+    ]
+    await asyncio.wait(tasks, timeout=30)
+
+
+def bench(p, n_clients):
+    stats = []
+    ready = threading.Semaphore(0)
+    thread = threading.Thread(
+        target=lambda: asyncio.run(run_clients(n_clients, stats, ready)), daemon=True
+    )
+    thread.start()
+    for _ in range(n_clients):
+        ready.acquire(timeout=10)
+    p.refresh(0, [0], [0])
+    start = time.perf_counter()
+    for i in range(N_PUSHES):
+        p.push(0, i + 1, i)
+        time.sleep(PUSH_INTERVAL)
+    thread.join()
+    complete = [s for s in stats if s[0] == N_PUSHES]
+    resynced = [s for s in stats if s[1]]
+    # Time until all the fast clients received everything
+    elapsed = max(s[2] for s in complete if not s[3]) - start
+    return len(complete), len(resynced), elapsed
+
+
+if __name__ == '__main__':
+    print('Pushing {} points at ~{:.0f} points/s'.format(N_PUSHES, 1 / PUSH_INTERVAL))
+    p = Pencil(port=PORT, sticky=False)
+    p.line([0], [0])
+    time.sleep(1)
+    print('{:>8}  {:>14}  {:>14}  {:>10}'.format('clients', 'all points', 'resynced', 'time (s)'))
+    for n in N_CLIENTS:
+        complete, resynced, elapsed = bench(p, n)
+        print('{:>8}  {:>14}  {:>14}  {:>10.3f}'.format(n, complete, resynced, elapsed))
@@ -0,0 +1,51 @@
+"""
+Compares the serialization time and payload size of a line plot with and
+without decimation, and the cost of streaming points to a decimated plot.
+
+Run with:
+    python benchmarks/decimation.py
+"""
+import time
+
+import numpy as np
+
+from pncl.plots import Line
+from pncl.utils import to_json
+
+SIZES = [10000, 100000, 1000000]
+DECIMATE = 2000
+N_PUSHES = 10000
+
+
+def bench_serialize(size, decimate):
+    x = np.arange(size)
+    y = np.random.randn(size).cumsum()
+    start = time.perf_counter()
+    plot = Line(x, y, decimate=decimate)
+    payload = to_json(plot.to_dict())
+    return time.perf_counter() - start, len(payload)
+
+
+def bench_stream(size):
+    plot = Line(np.arange(size), np.random.randn(size), decimate=DECIMATE)
+    plot.to_dict()
+    start = time.perf_counter()
+    for i in range(size, size + N_PUSHES):
+        plot.push(i, 0.5)
+        to_json(plot.last_pushed())
+    return (time.perf_counter() - start) / N_PUSHES
+
+
+if __name__ == '__main__':
+    print('{:>10}  {:>10}  {:>12}  {:>14}'.format('points', 'decimate', 'time (ms)', 'payload (kB)'))
+    for size in SIZES:
+        for decimate in [None, DECIMATE]:
+            elapsed, n_bytes = bench_serialize(size, decimate)
+            print('{:>10}  {:>10}  {:>12.1f}  {:>14.1f}'.format(
+                size, str(decimate), elapsed * 1e3, n_bytes / 1e3
+            ))
+
+    print()
+    print('{:>10}  {:>14}'.format('points', 'us / push'))
+    for size in SIZES:
+        print('{:>10}  {:>14.2f}'.format(size, bench_stream(size) * 1e6))
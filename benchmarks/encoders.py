@@ -0,0 +1,58 @@
+"""
+Compares the JSON encoders that are installed (see pncl.encoders) on the
+events sent by Pencil: a single push, a push of many points, the refresh of a
+large plot, and a grid of plots.
+
+Run with:
+    python benchmarks/encoders.py
+"""
+import time
+
+import numpy as np
+
+from pncl.encoders import ENCODERS
+from pncl.plots import Line, Bar
+from pncl.utils import to_json
+
+N_REPEATS = 20
+WIRE_FORMATS = ['points', 'columns']
+
+
+def make_events():
+    line = Line(np.arange(100000), np.random.randn(100000).cumsum())
+    bar = Bar(['a', 'b', 'c'], [1, 2, 3])
+    line.to_dict()
+    line.push_many(np.arange(100000, 104096), np.random.rand(4096))
+    many = line.last_pushed(4096)
+    line.push(104096, np.cos(1.0))
+    return {
+        'push': {'type': 'push', 'idx': 0, 'data': line.last_pushed()},
+        'push_many': {'type': 'push', 'idx': 0, 'data': many},
+        'refresh': {'type': 'refresh', 'idx': 0, 'data': line.to_dict()},
+        'new_grid': {'type': 'new_grid', 'data': {
+            'grid': [2, 2], 'height': 300,
+            'plots': [line.to_dict(), bar.to_dict(), line.to_dict(), bar.to_dict()]
+        }}
+    }
+
+
+def bench(event, wire_format, encoder):
+    # Cheap events are repeated more to get a stable measure
+    payload = to_json(event, wire_format, encoder)
+    n = max(N_REPEATS, 100000 // len(payload))
+    start = time.perf_counter()
+    for _ in range(n):
+        to_json(event, wire_format, encoder)
+    return (time.perf_counter() - start) / n
+
+
+if __name__ == '__main__':
+    encoders = [cls() for cls in ENCODERS if cls.available]
+    events = make_events()
+    for wire_format in WIRE_FORMATS:
+        print('Wire format: {} (us / event)'.format(wire_format))
+        print('{:>10}'.format('event') + ''.join('  {:>10}'.format(e.name) for e in encoders))
+        for name, event in events.items():
+            times = [bench(event, wire_format, e) for e in encoders]
+            print('{:>10}'.format(name) + ''.join('  {:>10.1f}'.format(t * 1e6) for t in times))
+        print()
@@ -0,0 +1,34 @@
+"""
+Measures the bytes sent to the browser to build a dashboard plot by plot, by
+encoding the add_plot events that Pencil creates, and compares them with
+broadcasting the whole grid every time a plot is added.
+
+Run with:
+    python benchmarks/grid.py
+"""
+import numpy as np
+
+from pncl.plots import Line
+from pncl.utils import to_json
+
+N_PLOTS = [10, 50, 100]
+N_POINTS = 1000
+
+
+def bench(n_plots):
+    plots = []
+    incremental = full = 0
+    for i in range(n_plots):
+        plots.append(Line(np.arange(N_POINTS), np.random.randn(N_POINTS)))
+        event = {'type': 'add_plot', 'idx': i, 'data': plots[-1].to_dict(), 'grid': [2] * (i // 2 + 1)}
+        incremental += len(to_json(event))
+        config = {'grid': [2] * (i // 2 + 1), 'height': 300, 'plots': [p.to_dict() for p in plots]}
+        full += len(to_json({'type': 'new_grid', 'data': config}))
+    return incremental, full
+
+
+if __name__ == '__main__':
+    print('{:>8}  {:>16}  {:>16}'.format('plots', 'add_plot (MB)', 'new_grid (MB)'))
+    for n in N_PLOTS:
+        incremental, full = bench(n)
+        print('{:>8}  {:>16.2f}  {:>16.2f}'.format(n, incremental / 1e6, full / 1e6))
@@ -0,0 +1,52 @@
+"""
+Measures the overhead of recording metrics (`metrics=True`) on the cost of a
+push for the caller, with and without the background sender, and prints the
+metrics collected in the run.
+
+Run with:
+    python benchmarks/metrics.py
+"""
+import time
+
+from pncl import Pencil
+
+PORT = 8187
+N_PUSHES = 50000
+
+
+def bench(metrics, async_send, port):
+    p = Pencil(port=port, sticky=False, async_send=async_send, metrics=metrics)
+    p.line([0], [0.0])
+    p.flush()
+    time.sleep(1)
+    start = time.perf_counter()
+    for i in range(1, N_PUSHES + 1):
+        p.push(0, i, float(i))
+    elapsed = time.perf_counter() - start
+    p.flush()
+    time.sleep(0.5)
+    stats = p.stats()
+    p.stop()
+    return elapsed / N_PUSHES, stats
+
+
+if __name__ == '__main__':
+    print('{} pushes'.format(N_PUSHES))
+    print('{:>12}  {:>8}  {:>12}'.format('async_send', 'metrics', 'us / push'))
+    port = PORT
+    for async_send in [False, True]:
+        for metrics in [False, True]:
+            per_push, stats = bench(metrics, async_send, port)
+            port += 1
+            print('{:>12}  {:>8}  {:>12.2f}'.format(str(async_send), str(metrics), per_push * 1e6))
+
+    print()
+    print('Metrics of the last run (times in us):')
+    for name, timer in sorted(stats['timers'].items()):
+        print('  client {:<28} count {:>8}  mean {:>10.2f}  max {:>10.2f}'.format(
+            name, timer['count'], timer['mean'] * 1e6, timer['max'] * 1e6))
+    for name, timer in sorted(stats['server']['timers'].items()):
+        print('  server {:<28} count {:>8}  mean {:>10.2f}  max {:>10.2f}'.format(
+            name, timer['count'], timer['mean'] * 1e6, timer['max'] * 1e6))
+    for name, value in sorted(stats['server']['counters'].items()):
+        print('  server {:<28} {:>8}'.format(name, value))
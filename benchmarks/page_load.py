@@ -0,0 +1,77 @@
+"""
+Measures the bytes and latency of loading a dashboard page (the page, its
+static files and the config), without compression and with each content
+coding, and of reloading it with a warm browser cache (versioned static files
+are not requested again, and the page and the config are revalidated with
+their ETag). The latency includes the time to transfer the bytes over a slow
+link of LINK_MBPS.
+
+Run with:
+    python benchmarks/page_load.py
+"""
+import re
+import time
+
+import numpy as np
+import requests
+
+from pncl import Pencil
+from pncl.compression import CODINGS
+
+PORT = 8183
+N_PLOTS = 4
+SIZE = 100000
+LINK_MBPS = 10
+
+
+def get(session, path, coding, etag=None):
+    headers = {'Accept-Encoding': coding or 'identity'}
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    start = time.perf_counter()
+    resp = session.get('http://127.0.0.1:{}{}'.format(PORT, path), headers=headers, stream=True)
+    n_bytes = len(resp.raw.read())
+    return resp, n_bytes, time.perf_counter() - start
+
+
+def load(session, links, coding, cache=None):
+    # Loads the page like a browser, and returns the bytes, the latency and
+    # the cache (the ETags of the responses)
+    cache = dict(cache or {})
+    total_bytes, total_time = 0, 0
+    resp, n_bytes, elapsed = get(session, '/', coding, cache.get('/'))
+    total_bytes, total_time = total_bytes + n_bytes, total_time + elapsed
+    cache['/'] = resp.headers['ETag']
+    for path in links:
+        if path in cache:
+            # Cached forever
+            continue
+        resp, n_bytes, elapsed = get(session, path, coding)
+        total_bytes, total_time = total_bytes + n_bytes, total_time + elapsed
+        cache[path] = resp.headers['ETag']
+    resp, n_bytes, elapsed = get(session, '/config', coding, cache.get('/config'))
+    total_bytes, total_time = total_bytes + n_bytes, total_time + elapsed
+    cache['/config'] = resp.headers['ETag']
+    return total_bytes, total_time + total_bytes * 8 / (LINK_MBPS * 1e6), cache
+
+
+if __name__ == '__main__':
+    p = Pencil(port=PORT)
+    for _ in range(N_PLOTS):
+        p.line(np.arange(SIZE), np.random.randn(SIZE).cumsum())
+    p.flush()
+    time.sleep(2)
+
+    session = requests.Session()
+    # The static files that the page links to
+    page = session.get('http://127.0.0.1:{}/'.format(PORT)).text
+    links = ['/' + path for path in re.findall(r'(?:src|href)="\.?/?([\w.-]+\?v=\w+)"', page)]
+    print('{:>10}  {:>8}  {:>14}  {:>14}'.format('coding', 'load', 'bytes', 'latency (ms)'))
+    for coding in [None] + CODINGS:
+        # The first load with each coding also compresses the config
+        for name in ('first', 'cold'):
+            n_bytes, latency, cache = load(session, links, coding)
+            print('{:>10}  {:>8}  {:>14}  {:>14.1f}'.format(str(coding), name, n_bytes, latency * 1e3))
+        n_bytes, latency, _ = load(session, links, coding, cache)
+        print('{:>10}  {:>8}  {:>14}  {:>14.1f}'.format(str(coding), 'warm', n_bytes, latency * 1e3))
+    p.stop()
@@ -0,0 +1,43 @@
+"""
+Compares the size and encoding time of the event sent by refresh() when a few
+bars of a histogram change, with and without patches.
+
+Run with:
+    python benchmarks/patch.py
+"""
+import time
+
+import numpy as np
+
+from pncl.plots import Bar
+from pncl.utils import to_json
+
+SIZES = [100, 1000, 10000]
+N_CHANGED = 5
+N_REFRESHES = 100
+
+
+def bench(size, patch):
+    counts = np.zeros(size)
+    plot = Bar(np.arange(size), counts)
+    plot.to_dict()
+    elapsed = n_bytes = 0
+    for _ in range(N_REFRESHES):
+        counts[np.random.randint(0, size, N_CHANGED)] += 1
+        start = time.perf_counter()
+        plot.refresh(np.arange(size), counts)
+        data = plot.last_patch() if patch else plot.to_dict()
+        payload = to_json({'type': 'patch' if patch else 'refresh', 'idx': 0, 'data': data})
+        elapsed += time.perf_counter() - start
+        n_bytes += len(payload)
+    return elapsed / N_REFRESHES, n_bytes / N_REFRESHES
+
+
+if __name__ == '__main__':
+    print('{:>10}  {:>8}  {:>14}  {:>14}'.format('bars', 'event', 'us / refresh', 'payload (kB)'))
+    for size in SIZES:
+        for patch in [False, True]:
+            elapsed, n_bytes = bench(size, patch)
+            print('{:>10}  {:>8}  {:>14.1f}  {:>14.2f}'.format(
+                size, 'patch' if patch else 'refresh', elapsed * 1e6, n_bytes / 1e3
+            ))
@@ -0,0 +1,434 @@
+"""
+End-to-end benchmark of the plotting pipeline. The script pushes points with
+Pencil, the server broadcasts them, and SSE clients running in another process
+take the place of the browser. The suites measure:
+- throughput: points per second pushed by the script, and received by the
+client;
+- latency: percentiles of the time from a push to the arrival of the point at
+the client, when pushing at a fixed rate;
+- config: size and latency of /config as the plot grows, for each content
+coding;
+- memory: resident memory of the script, the server and the client while
+points are pushed;
+- clients: latency of one client while more SSE clients are connected.
+
+The results are printed as tables. With --json, they are also written to a
+file, which can be passed to --compare in a later run (e.g., on another
+commit) to print the change of every measurement.
+
+Run with:
+    python benchmarks/pipeline.py [--json FILE] [--compare FILE] [SUITE ...]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import time
+
+import aiohttp
+import numpy as np
+import requests
+
+from pncl import Pencil
+from pncl.compression import CODINGS
+from pncl.encoders import get_encoder
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+PORT = 8191
+N_THROUGHPUT = 20000
+N_BATCHES = 200
+BATCH_SIZE = 1000
+N_LATENCY = 2000
+RATE = 1000  # Points per second in the latency and clients suites
+CONFIG_SIZES = [1000, 10000, 100000, 1000000]
+N_REQUESTS = 5
+MEMORY_ROUNDS = 5
+MEMORY_POINTS = 200000  # Points pushed in each round
+N_CLIENTS = [1, 4, 16, 64]
+TIMEOUT = 60  # Seconds after which a client stops waiting for points
+
+# Fields that identify the rows of each suite, to match them with --compare
+KEYS = {
+    'throughput': ['mode'],
+    'latency': ['rate'],
+    'config': ['points', 'coding'],
+    'memory': ['process'],
+    'clients': ['clients'],
+}
+
+
+def sse_client(url, x0, n, n_readers, record, conn):
+    """
+    Runs in its own process, in place of the browser. Connects to `url` and
+    records the time at which the points with x in (x0, x0 + n] of the first
+    plot arrive (only the last one if not `record`, so that the memory of the
+    client does not grow). The other `n_readers` connections only read the
+    stream, like browsers that nobody measures. Sends 'ready' through `conn` once all the
+    connections are open, and the results when the last point arrives.
+    """
+    result = asyncio.run(run_client(url, x0, n, n_readers, record, conn))
+    conn.send(result)
+
+
+async def run_client(url, x0, n, n_readers, record, conn):
+    result = {'arrivals': {}, 'resyncs': 0, 'bytes': 0, 'read': [0] * n_readers}
+    connected = []
+
+    def on_connect():
+        connected.append(True)
+        if len(connected) == n_readers + 1:
+            conn.send('ready')
+
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=0)) as session:
+        readers = [asyncio.ensure_future(read(session, url, result['read'], i, on_connect))
+                   for i in range(n_readers)]
+        try:
+            await asyncio.wait_for(measure(session, url, x0, n, record, result, on_connect), TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+    return result
+
+
+async def get(session, url):
+    # The server may still be starting
+    for _ in range(100):
+        try:
+            return await session.get(url)
+        except aiohttp.ClientConnectionError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError('Cannot connect to {}'.format(url))
+
+
+async def measure(session, url, x0, n, record, result, on_connect):
+    arrivals = result['arrivals']
+    async with await get(session, url) as resp:
+        on_connect()
+        async for line in lines(resp):
+            if not line.startswith(b'data:'):
+                continue
+            now = time.perf_counter()  # System-wide clock, as in the script
+            result['bytes'] += len(line)
+            event = json.loads(line[5:])
+            if event['type'] == 'new_grid':
+                # The client fell behind and was sent the whole grid
+                result['resyncs'] += 1
+            elif event['type'] == 'push' and event['idx'] == 0:
+                for point in event['data']['datasets'][0]['data']:
+                    if point['x'] > x0 and (record or point['x'] == x0 + n):
+                        arrivals[point['x']] = now
+                if x0 + n in arrivals:
+                    break
+
+
+async def lines(resp):
+    # Events can be longer than the lines that aiohttp reads (e.g., a resync)
+    buffer = b''
+    async for chunk in resp.content.iter_any():
+        *complete, buffer = (buffer + chunk).split(b'\n')
+        for line in complete:
+            yield line
+
+
+async def read(session, url, n_bytes, i, on_connect):
+    async with await get(session, url) as resp:
+        on_connect()
+        async for chunk in resp.content.iter_any():
+            n_bytes[i] += len(chunk)
+
+
+class Client:
+    def __init__(self, port, x0, n, n_readers=0, record=True):
+        """
+        Starts a client process (see `sse_client`) and waits until it is connected.
+        """
+        url = 'http://127.0.0.1:{}/event'.format(port)
+        self._conn, child = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=sse_client, args=(url, x0, n, n_readers, record, child),
+                                               daemon=True)
+        self.process.start()
+        child.close()
+        if not self._conn.poll(TIMEOUT) or self._conn.recv() != 'ready':
+            raise RuntimeError('The SSE client could not connect')
+
+    def result(self):
+        """
+        Waits for the client to receive the last point, and returns a
+        dictionary with the `arrivals` time of each x, the number of `resyncs`,
+        the `bytes` received, and the bytes `read` by each of the other
+        connections.
+        """
+        result = self._conn.recv()
+        self.process.join()
+        return result
+
+
+def start(port, **kwargs):
+    # Starts a Pencil with a line plot, and returns it with the PID of the server
+    p = Pencil(port=port, sticky=False, **kwargs)
+    p.line([0], [0.0])
+    p.flush()
+    return p, p._server.pid
+
+
+def percentiles(seconds):
+    p50, p90, p99 = np.percentile(seconds, [50, 90, 99]) * 1e3
+    return {'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99, 'max_ms': np.max(seconds) * 1e3}
+
+
+def rss(pid):
+    # Resident memory of a process, in MB
+    if psutil is not None:
+        return psutil.Process(pid).memory_info().rss / 2 ** 20
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 2 ** 10
+    raise RuntimeError('Cannot read the memory of process {}'.format(pid))
+
+
+def print_table(rows, columns):
+    print('  '.join('{:>18}'.format(c) for c in columns))
+    for row in rows:
+        print('  '.join('{:>18}'.format('{:.4g}'.format(v) if isinstance(v, float) else v)
+                        for v in (row[c] for c in columns)))
+    print()
+
+
+def bench_throughput(p, port, x0, batch_size):
+    n = N_THROUGHPUT if batch_size == 1 else N_BATCHES * batch_size
+    client = Client(port, x0, n)
+    start_time = time.perf_counter()
+    if batch_size == 1:
+        for x in range(x0 + 1, x0 + n + 1):
+            p.push(0, x, 1.0)
+    else:
+        for x in range(x0 + 1, x0 + n + 1, batch_size):
+            p.push_many(0, np.arange(x, x + batch_size), np.ones(batch_size))
+    pushed = time.perf_counter() - start_time
+    result = client.result()
+    delivered = max(result['arrivals'].values()) - start_time
+    return {
+        'points': n,
+        'pushed_per_s': n / pushed,
+        'delivered_per_s': len(result['arrivals']) / delivered,
+        'received': len(result['arrivals']) / n,
+        'resyncs': result['resyncs'],
+    }
+
+
+def bench_latency(p, port, x0, n_readers=0):
+    client = Client(port, x0, N_LATENCY, n_readers)
+    sent = np.empty(N_LATENCY)
+    start_time = time.perf_counter()
+    for i in range(N_LATENCY):
+        delay = start_time + i / RATE - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sent[i] = time.perf_counter()
+        p.push(0, x0 + i + 1, 1.0)
+    result = client.result()
+    arrivals = result['arrivals']
+    latency = [arrivals[x0 + i + 1] - sent[i] for i in range(N_LATENCY) if x0 + i + 1 in arrivals]
+    row = percentiles(latency)
+    row['received'] = len(latency) / N_LATENCY
+    row['resyncs'] = result['resyncs']
+    # Share of the stream read by the slowest of the other clients
+    row['others_read'] = min(result['read']) / result['bytes'] if n_readers else 1.0
+    return row
+
+
+def bench_config(p, port, size):
+    url = 'http://127.0.0.1:{}/config'.format(port)
+
+    def fetch(coding, etag=None):
+        headers = {'Accept-Encoding': coding or 'identity'}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        start_time = time.perf_counter()
+        resp = requests.get(url, headers=headers, stream=True)
+        body = resp.raw.read(decode_content=False)
+        return resp, len(body), time.perf_counter() - start_time
+
+    etag = fetch(None)[0].headers['ETag']
+    p.refresh(0, np.arange(size), np.random.randn(size).cumsum())
+    # The ETag changes when the server applies the refresh, and the first
+    # response with the new config includes encoding it
+    while True:
+        resp, n_bytes, first = fetch(None, etag)
+        if resp.status_code == 200:
+            break
+        time.sleep(0.01)
+    rows = []
+    for coding in [None] + CODINGS:
+        if coding is not None:
+            _, n_bytes, first = fetch(coding)
+        cached = [fetch(coding)[2] for _ in range(N_REQUESTS)]
+        rows.append({
+            'points': size,
+            'coding': coding or 'identity',
+            'bytes': n_bytes,
+            'first_ms': first * 1e3,
+            'cached_ms': np.median(cached) * 1e3,
+        })
+    return rows
+
+
+def run_throughput():
+    rows = []
+    for i, async_send in enumerate([False, True]):
+        p, _ = start(PORT + i, async_send=async_send)
+        x0 = 0
+        suffix = ' (async)' if async_send else ''
+        for mode, batch_size in [('push' + suffix, 1), ('push_many' + suffix, BATCH_SIZE)]:
+            rows.append(dict(mode=mode, **bench_throughput(p, PORT + i, x0, batch_size)))
+            x0 += rows[-1]['points']
+        p.stop()
+    print_table(rows, ['mode', 'points', 'pushed_per_s', 'delivered_per_s', 'received', 'resyncs'])
+    return rows
+
+
+def run_latency():
+    p, _ = start(PORT + 2)
+    rows = [dict(rate=RATE, **bench_latency(p, PORT + 2, 0))]
+    p.stop()
+    print_table(rows, ['rate', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'received'])
+    return rows
+
+
+def run_config():
+    p, _ = start(PORT + 3)
+    rows = []
+    for size in CONFIG_SIZES:
+        rows.extend(bench_config(p, PORT + 3, size))
+    p.stop()
+    print_table(rows, ['points', 'coding', 'bytes', 'first_ms', 'cached_ms'])
+    return rows
+
+
+def run_memory():
+    p, server = start(PORT + 4)
+    n = MEMORY_ROUNDS * MEMORY_POINTS
+    # The client exits when it receives point n + 1, pushed after measuring
+    client = Client(PORT + 4, 0, n + 1, record=False)
+    pids = {'script': os.getpid(), 'server': server, 'client': client.process.pid}
+    memory = {name: [rss(pid)] for name, pid in pids.items()}
+    for i in range(MEMORY_ROUNDS):
+        for x in range(i * MEMORY_POINTS + 1, (i + 1) * MEMORY_POINTS + 1, BATCH_SIZE):
+            p.push_many(0, np.arange(x, x + BATCH_SIZE), np.random.rand(BATCH_SIZE))
+        p.flush()
+        time.sleep(1)
+        for name, pid in pids.items():
+            memory[name].append(rss(pid))
+    p.push(0, n + 1, 0.0)
+    client.result()
+    p.stop()
+    rows = [{
+        'process': name,
+        'start_mb': mb[0],
+        'end_mb': mb[-1],
+        'bytes_per_point': (mb[-1] - mb[0]) * 2 ** 20 / n,
+        'rounds_mb': mb,
+    } for name, mb in memory.items()]
+    print('Pushing {} rounds of {} points'.format(MEMORY_ROUNDS, MEMORY_POINTS))
+    print_table(rows, ['process', 'start_mb', 'end_mb', 'bytes_per_point'])
+    return rows
+
+
+def run_clients():
+    p, _ = start(PORT + 5)
+    rows = []
+    for i, n_clients in enumerate(N_CLIENTS):
+        row = bench_latency(p, PORT + 5, i * N_LATENCY, n_readers=n_clients - 1)
+        rows.append(dict(clients=n_clients, **row))
+    p.stop()
+    print('Pushing {} points at {} points/s'.format(N_LATENCY, RATE))
+    print_table(rows, ['clients', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'received', 'resyncs', 'others_read'])
+    return rows
+
+
+SUITES = {
+    'throughput': run_throughput,
+    'latency': run_latency,
+    'config': run_config,
+    'memory': run_memory,
+    'clients': run_clients,
+}
+
+
+def describe():
+    # Where the results come from, to tell runs apart
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'encoder': get_encoder().name,
+        'codings': CODINGS,
+    }
+
+
+def compare(baseline, results):
+    """
+    Prints the change of every measurement with respect to the results of an
+    earlier run.
+    """
+    print('Compared with {} ({})'.format(baseline['meta'].get('commit'), baseline['meta'].get('date')))
+    print('{:>12}  {:>24}  {:>16}  {:>12}  {:>12}  {:>8}'.format(
+        'suite', 'row', 'measurement', 'baseline', 'current', 'change'))
+    for suite, rows in results.items():
+        if suite == 'meta' or suite not in baseline:
+            continue
+        old_rows = {tuple(row[k] for k in KEYS[suite]): row for row in baseline[suite]}
+        for row in rows:
+            key = tuple(row[k] for k in KEYS[suite])
+            old = old_rows.get(key)
+            if old is None:
+                continue
+            for name, value in row.items():
+                if name in KEYS[suite] or not isinstance(value, (int, float)) or not old.get(name):
+                    continue
+                print('{:>12}  {:>24}  {:>16}  {:>12.4g}  {:>12.4g}  {:>+7.1f}%'.format(
+                    suite, ' '.join(str(k) for k in key), name, old[name], value,
+                    (value / old[name] - 1) * 100))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of Pencil.')
+    parser.add_argument('suites', nargs='*', metavar='SUITE',
+                        help='suites to run, among: {} (default: all)'.format(', '.join(SUITES)))
+    parser.add_argument('--json', metavar='FILE', help='write the results to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='compare with the results in FILE')
+    args = parser.parse_args()
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error('unknown suite: {}'.format(suite))
+
+    results = {'meta': describe()}
+    for suite in args.suites or SUITES:
+        print('# {}'.format(suite))
+        results[suite] = SUITES[suite]()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, default=float)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
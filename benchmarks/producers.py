@@ -0,0 +1,70 @@
+"""
+Load test for many producers writing to one dashboard. Starts a Pencil that
+listens for other processes, and N worker processes that connect to it with
+Pencil.connect() and push points to their own plot in batches. Reports the
+total throughput and checks that every point of every worker reached the
+server.
+
+Run with:
+    python benchmarks/producers.py
+"""
+import json
+import multiprocessing
+import time
+import urllib.request
+
+import numpy as np
+
+from pncl import Pencil
+
+PORT = 8187
+ADDRESS = ('127.0.0.1', 8188)
+AUTHKEY = b'benchmark'
+N_PRODUCERS = [1, 2, 4, 8]
+N_BATCHES = 500
+BATCH_SIZE = 100
+
+
+def producer(rank, n_producers):
+    p = Pencil.connect(ADDRESS, name='run{}-rank{}'.format(n_producers, rank), authkey=AUTHKEY,
+                       async_send=True)
+    p.line([0], [0.0])
+    x = np.arange(1, BATCH_SIZE + 1)
+    for _ in range(N_BATCHES):
+        p.push_many(0, x, np.random.rand(BATCH_SIZE))
+        x += BATCH_SIZE
+    p.stop()
+
+
+def n_points():
+    url = 'http://127.0.0.1:{}/config'.format(PORT)
+    config = json.loads(urllib.request.urlopen(url).read())
+    return [len(plot['data']['datasets'][0]['data']) for plot in config['plots']]
+
+
+def bench(n_producers):
+    before = len(n_points())
+    start = time.perf_counter()
+    workers = [
+        multiprocessing.Process(target=producer, args=(rank, n_producers))
+        for rank in range(n_producers)
+    ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    expected = N_BATCHES * BATCH_SIZE + 1
+    while True:
+        counts = n_points()[before:]
+        if len(counts) == n_producers and all(c == expected for c in counts):
+            break
+        time.sleep(0.1)
+    return n_producers * N_BATCHES * BATCH_SIZE / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    p = Pencil(port=PORT, sticky=False, listen=ADDRESS, authkey=AUTHKEY, grid=4)
+    print('{} batches of {} points per producer'.format(N_BATCHES, BATCH_SIZE))
+    print('{:>10}  {:>14}'.format('producers', 'points / s'))
+    for n in N_PRODUCERS:
+        print('{:>10}  {:>14.0f}'.format(n, bench(n)))
@@ -0,0 +1,53 @@
+"""
+Measures the cost of a single push as the series grows (with incremental
+updates the per-push latency should stay flat), and the throughput of
+push_many() as a function of the batch size.
+
+Run with:
+    python benchmarks/push.py
+"""
+import time
+
+import numpy as np
+
+from pncl.plots import Line
+from pncl.utils import to_json
+
+SIZES = [1000, 10000, 100000]
+N_PUSHES = 1000
+BATCH_SIZES = [1, 64, 512, 4096]
+N_POINTS = 100000
+
+
+def bench_push(size):
+    plot = Line(list(range(size)), [0.0] * size)
+    plot.to_dict()  # Send the plot once, as Pencil does when adding it
+    start = time.perf_counter()
+    for i in range(size, size + N_PUSHES):
+        plot.push(i, float(i))
+        to_json({'type': 'push', 'idx': 0, 'data': plot.last_pushed()})
+    return (time.perf_counter() - start) / N_PUSHES
+
+
+def bench_push_many(batch_size):
+    plot = Line([0], [0.0])
+    plot.to_dict()
+    x = np.arange(1, batch_size + 1)
+    y = np.random.rand(batch_size)
+    start = time.perf_counter()
+    for _ in range(N_POINTS // batch_size):
+        plot.push_many(x, y)
+        to_json({'type': 'push', 'idx': 0, 'data': plot.last_pushed(batch_size)})
+        x += batch_size
+    return N_POINTS / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    print('{:>10}  {:>14}'.format('points', 'us / push'))
+    for size in SIZES:
+        print('{:>10}  {:>14.2f}'.format(size, bench_push(size) * 1e6))
+
+    print()
+    print('{:>10}  {:>14}'.format('batch', 'points / s'))
+    for batch_size in BATCH_SIZES:
+        print('{:>10}  {:>14.0f}'.format(batch_size, bench_push_many(batch_size)))
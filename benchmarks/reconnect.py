@@ -0,0 +1,70 @@
+"""
+Measures what a browser downloads to catch up after its SSE connection drops:
+replaying the events that it missed with Last-Event-ID, against reloading the
+whole config (which is what a page reload does). The dashboard has a line plot
+of a million points, and a few points are pushed while the client is away.
+
+Run with:
+    python benchmarks/reconnect.py
+"""
+import asyncio
+import time
+
+import aiohttp
+import numpy as np
+
+from pncl import Pencil
+
+PORT = 8182
+SIZE = 1000000
+MISSED = [10, 100, 1000]
+IDLE = 0.5
+
+
+async def read_events(session, url, last_id):
+    # Reads events until none arrives for a while, and returns the ID of the
+    # last one, the time at which it arrived and the bytes read
+    n_bytes, end = 0, time.perf_counter()
+    async with session.get(url, headers={'Last-Event-ID': last_id}) as resp:
+        while True:
+            try:
+                line = await asyncio.wait_for(resp.content.readline(), IDLE)
+            except asyncio.TimeoutError:
+                break
+            n_bytes += len(line)
+            end = time.perf_counter()
+            if line.startswith(b'id:'):
+                last_id = line[3:].strip().decode()
+    return last_id, end, n_bytes
+
+
+async def main(p):
+    url = 'http://127.0.0.1:{}/'.format(PORT)
+    async with aiohttp.ClientSession() as session:
+        start = time.perf_counter()
+        async with session.get(url + 'config') as resp:
+            config = await resp.read()
+            last_id = resp.headers['X-Pncl-Event-Id']
+        config_time = time.perf_counter() - start
+        print('{:>8}  {:>14}  {:>14}'.format('missed', 'time (ms)', 'bytes'))
+        print('{:>8}  {:>14.1f}  {:>14}'.format('config', config_time * 1e3, len(config)))
+        x = SIZE
+        for n in MISSED:
+            # The client is disconnected while the points are pushed
+            for _ in range(n):
+                p.push(0, x, np.random.randn())
+                p.flush()
+                x += 1
+            await asyncio.sleep(0.5)
+            start = time.perf_counter()
+            last_id, end, n_bytes = await read_events(session, url + 'event', last_id)
+            print('{:>8}  {:>14.1f}  {:>14}'.format(n, (end - start) * 1e3, n_bytes))
+
+
+if __name__ == '__main__':
+    p = Pencil(port=PORT)
+    p.line(np.arange(SIZE), np.random.randn(SIZE).cumsum())
+    p.flush()
+    time.sleep(2)
+    asyncio.get_event_loop().run_until_complete(main(p))
+    p.stop()
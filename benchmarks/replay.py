@@ -0,0 +1,72 @@
+"""
+Measures how fast the server restores its state from the persistent event log
+(see pncl.log): writes a log of a million push events to 10 plots, replays it,
+and then replays the snapshot taken after the replay, whose columns are
+memory-mapped. Also compares reading a range of 1000 points of a restored
+plot with encoding the whole plot.
+
+Run with:
+    python benchmarks/replay.py
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from pncl.log import EventLog
+from pncl.plots import Line
+from pncl.server import Server
+from pncl.utils import to_json
+
+N_EVENTS = 1000000
+N_PLOTS = 10
+
+
+def write_log(path):
+    log = EventLog(path)
+    plots = [Line([0], [0.0]) for _ in range(N_PLOTS)]
+    log.append((None, None, [
+        {'type': 'add_plot', 'idx': i, 'data': plot.to_dict(), 'grid': [2] * (N_PLOTS // 2)}
+        for i, plot in enumerate(plots)
+    ]))
+    for i in range(N_EVENTS):
+        plot = plots[i % N_PLOTS]
+        plot.push(i // N_PLOTS + 1, float(i))
+        log.append((None, None, [{'type': 'push', 'idx': i % N_PLOTS, 'data': plot.last_pushed()}]))
+    log.close()
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def replay(path):
+    server = Server(log_dir=path)
+    start = time.perf_counter()
+    server._restore()
+    elapsed = time.perf_counter() - start
+    server._log.close()
+    return elapsed, server._state
+
+
+if __name__ == '__main__':
+    path = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        size = write_log(path)
+        print('Wrote {} events ({:.1f} MB) in {:.2f} s'.format(
+            N_EVENTS, size / 1e6, time.perf_counter() - start
+        ))
+        elapsed, _ = replay(path)
+        print('Replayed the log in {:.2f} s ({:.0f} events / s)'.format(elapsed, N_EVENTS / elapsed))
+        elapsed, state = replay(path)
+        print('Restored the snapshot in {:.3f} s'.format(elapsed))
+
+        start = time.perf_counter()
+        to_json(state.get_plot(0, -1000), 'columns')
+        elapsed_range = time.perf_counter() - start
+        start = time.perf_counter()
+        to_json(state.get_plot(0), 'columns')
+        elapsed_full = time.perf_counter() - start
+        print('Last 1000 points of a plot: {:.2f} ms, whole plot: {:.2f} ms'.format(
+            elapsed_range * 1e3, elapsed_full * 1e3
+        ))
+    finally:
+        shutil.rmtree(path)
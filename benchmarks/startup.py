@@ -0,0 +1,70 @@
+"""
+Measures how long a script takes to import pncl, to create a Pencil, to add
+its first plot, and until the page is served, each in a new interpreter. Also
+measures the total run time of a script that creates a Pencil and never plots
+(e.g., a worker that only plots on some runs).
+
+Run with:
+    python benchmarks/startup.py
+"""
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+PORT = 8189
+N_RUNS = 10
+
+SCRIPT = '''
+import json, time, urllib.request
+start = time.perf_counter()
+from pncl import Pencil
+imported = time.perf_counter()
+p = Pencil(port={port}, sticky=False)
+created = time.perf_counter()
+p.line([0, 1, 2], [0.0, 1.0, 4.0])
+plotted = time.perf_counter()
+while True:
+    try:
+        urllib.request.urlopen('http://127.0.0.1:{port}/config').read()
+        break
+    except OSError:
+        time.sleep(0.001)
+served = time.perf_counter()
+p.stop()
+print('result', json.dumps([imported - start, created - imported, plotted - created, served - plotted]))
+'''
+
+IDLE_SCRIPT = '''
+from pncl import Pencil
+p = Pencil(port={port}, sticky=False)
+'''
+
+
+def run(script, port):
+    # Returns what the script printed after 'result'
+    out = subprocess.run([sys.executable, '-c', script.format(port=port)],
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    for line in out.stdout.decode().splitlines():
+        if line.startswith('result '):
+            return line[len('result '):]
+
+
+def time_idle(port):
+    # Wall time of a whole interpreter that creates a Pencil and exits
+    out = run('import time; start = time.perf_counter()\n' + IDLE_SCRIPT +
+              'p.stop()\nprint(\'result\', time.perf_counter() - start)', port)
+    return float(out)
+
+
+if __name__ == '__main__':
+    times = np.array([json.loads(run(SCRIPT, PORT + i % 2)) for i in range(N_RUNS)])
+    print('Median of {} runs'.format(N_RUNS))
+    print('{:>24}  {:>10}'.format('stage', 'ms'))
+    stages = ['import pncl', 'Pencil()', 'first plot', 'page served']
+    for stage, seconds in zip(stages, np.median(times, axis=0)):
+        print('{:>24}  {:>10.1f}'.format(stage, seconds * 1e3))
+    print('{:>24}  {:>10.1f}'.format('total to first plot', np.median(times[:, :3].sum(1)) * 1e3))
+    idle = np.median([time_idle(PORT + i % 2) for i in range(N_RUNS)])
+    print('{:>24}  {:>10.1f}'.format('script without plots', idle * 1e3))
@@ -0,0 +1,43 @@
+"""
+Compares how many events per second each transport can move from the main
+process to a consumer process, with and without batching.
+
+Run with:
+    python benchmarks/transport.py
+"""
+import time
+from multiprocessing import Process
+
+from pncl.transport import ManagerTransport, PipeTransport
+
+N_EVENTS = 20000
+BATCH_SIZE = 100
+EVENT = {'type': 'push', 'idx': 0, 'data': {'label': None, 'datasets': [{'data': {'x': 1, 'y': 0.5}}]}}
+
+
+def consume(transport, n_events):
+    received = 0
+    while received < n_events:
+        received += len(transport.recv_many())
+
+
+def bench(transport, batch_size):
+    consumer = Process(target=consume, args=(transport, N_EVENTS))
+    consumer.start()
+    start = time.perf_counter()
+    if batch_size == 1:
+        for _ in range(N_EVENTS):
+            transport.send(EVENT)
+    else:
+        for _ in range(N_EVENTS // batch_size):
+            transport.send_many([EVENT] * batch_size)
+    consumer.join()
+    return N_EVENTS / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    print('{:>18}  {:>6}  {:>14}'.format('transport', 'batch', 'events / s'))
+    for cls in [ManagerTransport, PipeTransport]:
+        for batch_size in [1, BATCH_SIZE]:
+            rate = bench(cls(), batch_size)
+            print('{:>18}  {:>6}  {:>14.0f}'.format(cls.__name__, batch_size, rate))
@@ -0,0 +1,119 @@
+"""
+Load generator that compares the rate at which the browser can receive points
+through server-sent events (/event) and through the binary WebSocket (/ws).
+A client process connects to one of the endpoints while Pencil pushes batches
+of points as fast as it can, and the benchmark reports the points per second
+received by the client, the number of times that the client fell behind and
+was resynced, and the CPU time used by the server process (Linux
+only, read from /proc) for each million points.
+
+SSE uses the 'base64' wire format, the most compact one for text messages.
+The WebSocket is tested with and without permessage-deflate.
+
+Run with:
+    python benchmarks/websocket.py
+"""
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import struct
+import time
+
+import aiohttp
+import numpy as np
+
+from pncl import Pencil
+
+PORT = 8182
+BATCH_SIZE = 1000
+DURATION = 5
+
+
+def count_sse(data):
+    # Returns the number of points pushed by the message (0 for resyncs)
+    event = json.loads(data)
+    if event['type'] != 'push':
+        return 0
+    column = event['data']['datasets'][0]['data']['y']
+    return len(base64.b64decode(column['base64'])) // 8
+
+
+def count_ws(data):
+    length = struct.unpack('<I', data[:4])[0]
+    event = json.loads(data[4:4 + length])
+    if event['type'] != 'push':
+        return 0
+    return event['data']['datasets'][0]['data']['y']['length']
+
+
+async def client(endpoint, results, compress):
+    url = 'http://127.0.0.1:{}/{}'.format(PORT, endpoint)
+    received = resyncs = 0
+    first = last = None
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=2)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        try:
+            if endpoint == 'ws':
+                async with session.ws_connect(url, compress=compress, receive_timeout=2) as ws:
+                    results.put('ready')
+                    async for msg in ws:
+                        n = count_ws(msg.data)
+                        received, resyncs = received + n, resyncs + (n == 0)
+                        await ws.send_str('ack')
+                        first, last = first or time.perf_counter(), time.perf_counter()
+            else:
+                async with session.get(url) as resp:
+                    results.put('ready')
+                    async for line in resp.content:
+                        if line.startswith(b'data:'):
+                            n = count_sse(line[5:])
+                            received, resyncs = received + n, resyncs + (n == 0)
+                            first, last = first or time.perf_counter(), time.perf_counter()
+        except asyncio.TimeoutError:
+            # The producer has stopped
+            pass
+    results.put((received, resyncs, last - first))
+
+
+def run_client(endpoint, results, compress):
+    asyncio.run(client(endpoint, results, compress))
+
+
+def cpu_time(pid):
+    with open('/proc/{}/stat'.format(pid)) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def bench(p, endpoint, compress=0):
+    results = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=run_client, args=(endpoint, results, compress))
+    proc.start()
+    results.get(timeout=10)
+    time.sleep(0.5)
+    cpu_start = cpu_time(p._server.pid)
+    x = np.arange(BATCH_SIZE, dtype=np.float64)
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        p.push_many(0, x, np.random.rand(BATCH_SIZE))
+        x += BATCH_SIZE
+    received, resyncs, elapsed = results.get(timeout=60)
+    cpu = cpu_time(p._server.pid) - cpu_start
+    proc.join()
+    return received / elapsed, resyncs, cpu / received * 1e6
+
+
+if __name__ == '__main__':
+    p = Pencil(port=PORT, sticky=False, wire_format='base64', websocket='deflate')
+    p.line([0.0], [0.0], max_points=10000)
+    time.sleep(1)
+    print('{:>14}  {:>14}  {:>10}  {:>26}'.format(
+        'endpoint', 'points / s', 'resyncs', 'server CPU s / 1M points'
+    ))
+    for name, endpoint, compress in [('/event', 'event', 0),
+                                     ('/ws', 'ws', 0),
+                                     ('/ws (deflate)', 'ws', 15)]:
+        rate, resyncs, cpu = bench(p, endpoint, compress)
+        print('{:>14}  {:>14.0f}  {:>10}  {:>26.2f}'.format(name, rate, resyncs, cpu))
@@ -0,0 +1,34 @@
+"""
+Compares the payload size and encoding time of a line plot with the different
+wire formats ('points', 'columns' and 'base64').
+
+Run with:
+    python benchmarks/wire_format.py
+"""
+import time
+
+import numpy as np
+
+from pncl.plots import Line
+from pncl.utils import to_json
+
+SIZES = [10000, 100000, 1000000]
+WIRE_FORMATS = ['points', 'columns', 'base64']
+
+
+def bench(size, wire_format):
+    plot = Line(np.arange(size), np.random.randn(size).cumsum())
+    config = plot.to_dict()
+    start = time.perf_counter()
+    payload = to_json(config, wire_format)
+    return time.perf_counter() - start, len(payload)
+
+
+if __name__ == '__main__':
+    print('{:>10}  {:>10}  {:>12}  {:>14}'.format('points', 'format', 'time (ms)', 'payload (kB)'))
+    for size in SIZES:
+        for wire_format in WIRE_FORMATS:
+            elapsed, n_bytes = bench(size, wire_format)
+            print('{:>10}  {:>10}  {:>12.1f}  {:>14.1f}'.format(
+                size, wire_format, elapsed * 1e3, n_bytes / 1e3
+            ))
@@ -0,0 +1,73 @@
+"""
+Compares the time and payload size of the views that the browser requests
+when zooming into a long line plot (/data, see pncl.state.State.get_range)
+with encoding the whole plot, and measures the cost of keeping the min/max
+pyramid up to date while points are pushed.
+
+Run with:
+    python benchmarks/zoom.py
+"""
+import time
+
+import numpy as np
+
+from pncl.plots import Line
+from pncl.state import State
+from pncl.utils import to_json
+
+SIZES = [100000, 1000000, 10000000]
+POINTS = 2000
+N_QUERIES = 100
+N_PUSHES = 1000
+
+
+def make_state(size):
+    state = State(wire_format='base64')
+    plot = Line(np.arange(size), np.random.randn(size).cumsum())
+    state.apply({'type': 'add_plot', 'idx': 0, 'data': plot.to_dict(), 'grid': [1]})
+    return state
+
+
+def bench_full(state):
+    start = time.perf_counter()
+    payload = to_json(state.get_plot(0), 'base64')
+    return time.perf_counter() - start, len(payload)
+
+
+def bench_range(state, size):
+    # The first query builds the pyramid
+    start = time.perf_counter()
+    state.get_range(0, n=POINTS)
+    build = time.perf_counter() - start
+    windows = np.random.uniform(0, size, (N_QUERIES, 2))
+    windows.sort(axis=1)
+    start = time.perf_counter()
+    for x_min, x_max in windows:
+        payload = to_json(state.get_range(0, x_min, x_max, POINTS), 'base64')
+    return build, (time.perf_counter() - start) / N_QUERIES, len(payload)
+
+
+def bench_push(state, size):
+    # Push one point at a time, and query the last window after each push
+    start = time.perf_counter()
+    for i in range(size, size + N_PUSHES):
+        state.apply({'type': 'push', 'idx': 0, 'data': {
+            'labels': None,
+            'datasets': [{'data': Line([i], [0.0]).get_datasets()[0]['data']}]
+        }})
+        state.get_range(0, i - 10000, i, POINTS)
+    return (time.perf_counter() - start) / N_PUSHES
+
+
+if __name__ == '__main__':
+    print('{:>10}  {:>12}  {:>12}  {:>12}  {:>12}  {:>12}  {:>14}'.format(
+        'points', 'full (ms)', 'full (kB)', 'build (ms)', 'range (ms)', 'range (kB)', 'push+range (us)'
+    ))
+    for size in SIZES:
+        state = make_state(size)
+        full, full_bytes = bench_full(state)
+        build, query, query_bytes = bench_range(state, size)
+        push = bench_push(state, size)
+        print('{:>10}  {:>12.1f}  {:>12.1f}  {:>12.1f}  {:>12.2f}  {:>12.1f}  {:>14.1f}'.format(
+            size, full * 1e3, full_bytes / 1e3, build * 1e3, query * 1e3, query_bytes / 1e3, push * 1e6
+        ))
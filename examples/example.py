@@ -31,6 +31,12 @@ p.push(4, "Aardvarks", 6)
 p.push(5, "Aardvarks", 6)
 p.push(6, x, np.random.random())
 
+# Push many points at once
+input('Press Enter to push many points')
+x = np.arange(11, 20)
+p.push_many(0, x, x ** 2)
+p.push_plots({1: (x, np.cos(x)), 6: (x, np.random.rand(x.shape[0]))})
+
 # Refresh the plots with some new data
 input('Press Enter to refresh plots')
 p.refresh(0, np.arange(10), np.random.rand(10), np.random.rand(10))
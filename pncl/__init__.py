@@ -2,4 +2,4 @@ import os
 ROOT_DIR = os.path.dirname(__file__)
 STATIC_DIR = os.path.join(ROOT_DIR, 'static')
 
-from pncl.plotter import Pencil
+from pncl.plotter import AsyncPencil, Pencil
@@ -0,0 +1,84 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content codings that the server can send, in order of preference
+CODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress(data, coding, level=1):
+    """
+    Compresses bytes with an HTTP content coding.
+    :param data: bytes.
+    :param coding: 'br' (requires the `brotli` package) or 'gzip'.
+    :param level: compression level, from 1 to 9 (for brotli, the quality
+    goes up to 11). Numeric data compresses little better at higher levels,
+    which are several times slower on large configs.
+    :return: bytes.
+    """
+    if coding == 'br':
+        return brotli.compress(data, quality=level)
+    if coding == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    raise ValueError('Unknown content coding: {}'.format(coding))
+
+
+def negotiate(accept_encoding):
+    """
+    Chooses the content coding of a response.
+    :param accept_encoding: value of the Accept-Encoding header of the request.
+    :return: one of `CODINGS`, or None if the client accepts none of them.
+    """
+    accepted = set()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    for coding in CODINGS:
+        if coding in accepted or '*' in accepted:
+            return coding
+    return None
+
+
+class CompressedBody:
+    def __init__(self, data, min_size=1024, level=1):
+        """
+        The body of a response, which is compressed at most once for each
+        content coding (e.g., the config of a given version of the state, which
+        is sent to every browser that loads the page).
+        :param data: bytes.
+        :param min_size: bodies shorter than this are never compressed.
+        :param level: compression level (see `compress`).
+        """
+        self.data = data
+        self.min_size = min_size
+        self.level = level
+        self._compressed = {}
+
+    def get(self, coding):
+        """
+        Returns the body compressed with the given content coding, as a tuple
+        `(coding, bytes)`. The coding is None if the body is not compressed.
+        :param coding: one of `CODINGS`, or None.
+        """
+        if coding is None or len(self.data) < self.min_size:
+            return None, self.data
+        if coding not in self._compressed:
+            self._compressed[coding] = compress(self.data, coding, self.level)
+        return coding, self._compressed[coding]
+
+    def is_cached(self, coding):
+        """
+        Returns True if `get(coding)` does not need to compress anything.
+        """
+        return coding is None or len(self.data) < self.min_size or coding in self._compressed
@@ -0,0 +1,275 @@
+import numpy as np
+
+
+class MinMaxDecimator:
+    def __init__(self, max_points):
+        """
+        Incremental min/max decimation of a series. Points are grouped in
+        consecutive buckets of `bucket_size` points, and each bucket is
+        represented by its minimum and maximum (so peaks are never lost).
+        When there are too many buckets, adjacent buckets are merged and
+        `bucket_size` doubles. Only the last bucket changes when new points are
+        added, so streaming plots can update just the tail of the series.
+        :param max_points: maximum number of points returned by `points()`
+        (must be at least 2).
+        """
+        if max_points < 2:
+            raise ValueError('max_points must be at least 2.')
+        self.max_buckets = max_points // 2
+        self.bucket_size = 1
+        self.size = 0
+        # Each bucket is [count, i_min, x_min, y_min, i_max, x_max, y_max]
+        self._buckets = []
+        # Number of buckets at the last call to tail(), and index of the first
+        # bucket changed since then
+        self._n_read = 0
+        self._dirty = 0
+        self._rebuilt = False
+
+    def extend(self, x, y):
+        """
+        Adds new points to the series.
+        :param x: list or np.array of x values.
+        :param y: list or np.array of y values.
+        """
+        x = np.asarray(x)
+        y = np.asarray(y, dtype=np.float64)
+        offset = 0
+        while offset < len(y):
+            k = self.bucket_size
+            if self._buckets and self._buckets[-1][0] < k:
+                # Fill the last bucket
+                stop = min(offset + k - self._buckets[-1][0], len(y))
+                self._buckets[-1] = _merge(self._buckets[-1], self._bucket(x, y, offset, stop))
+                self._dirty = min(self._dirty, len(self._buckets) - 1)
+            elif len(self._buckets) == self.max_buckets:
+                self._halve()
+                continue
+            else:
+                # Add as many new buckets as possible, with vectorized min/max
+                stop = min(offset + (self.max_buckets - len(self._buckets)) * k, len(y))
+                self._buckets.extend(self._buckets_from(x, y, offset, stop))
+            offset = stop
+        self.size += len(y)
+
+    def points(self):
+        """
+        Returns the decimated series as two lists, x and y. The following call
+        to `tail()` will only return the points that changed after this call.
+        """
+        self._dirty = self._n_read = len(self._buckets)
+        self._rebuilt = False
+        return self._points(self._buckets)
+
+    def tail(self):
+        """
+        Returns the points that changed since the last call, as a tuple
+        `(replace, x, y)`: the last `replace` points returned previously must
+        be replaced by the points in `x` and `y`. Returns `None` if all buckets
+        have changed since the last call, in which case `points()` should be
+        used instead.
+        """
+        if self._rebuilt:
+            output = None
+        else:
+            replace = 2 * (self._n_read - self._dirty)
+            output = (replace,) + self._points(self._buckets[self._dirty:])
+        self._dirty = self._n_read = len(self._buckets)
+        self._rebuilt = False
+        return output
+
+    def _bucket(self, x, y, start, stop):
+        i_min = start + int(np.argmin(y[start:stop]))
+        i_max = start + int(np.argmax(y[start:stop]))
+        return [stop - start,
+                self.size + i_min, x[i_min].item(), y[i_min].item(),
+                self.size + i_max, x[i_max].item(), y[i_max].item()]
+
+    def _buckets_from(self, x, y, start, stop):
+        k = self.bucket_size
+        n_full = (stop - start) // k
+        buckets = []
+        if n_full:
+            y_full = y[start:start + n_full * k].reshape(n_full, k)
+            base = start + np.arange(n_full) * k
+            i_min = (base + np.argmin(y_full, axis=1)).tolist()
+            i_max = (base + np.argmax(y_full, axis=1)).tolist()
+            x_min, y_min = x[i_min].tolist(), y[i_min].tolist()
+            x_max, y_max = x[i_max].tolist(), y[i_max].tolist()
+            buckets = [
+                [k, self.size + i_min[b], x_min[b], y_min[b],
+                 self.size + i_max[b], x_max[b], y_max[b]]
+                for b in range(n_full)
+            ]
+        if start + n_full * k < stop:
+            buckets.append(self._bucket(x, y, start + n_full * k, stop))
+        return buckets
+
+    def _halve(self):
+        # Merge adjacent buckets
+        buckets = self._buckets
+        merged = [_merge(buckets[i], buckets[i + 1]) for i in range(0, len(buckets) - 1, 2)]
+        if len(buckets) % 2:
+            merged.append(buckets[-1])
+        self._buckets = merged
+        self.bucket_size *= 2
+        self._rebuilt = True
+
+    @staticmethod
+    def _points(buckets):
+        x, y = [], []
+        for b in buckets:
+            # Emit min and max in the order in which they appear in the series
+            first, second = (b[1:4], b[4:7]) if b[1] <= b[4] else (b[4:7], b[1:4])
+            x.extend((first[1], second[1]))
+            y.extend((first[2], second[2]))
+        return x, y
+
+
+def _merge(a, b):
+    output = [a[0] + b[0]]
+    output += a[1:4] if a[3] <= b[3] else b[1:4]
+    output += a[4:7] if a[6] >= b[6] else b[4:7]
+    return output
+
+
+class MinMaxPyramid:
+    def __init__(self, base=16, factor=2):
+        """
+        Multi-resolution min/max summary of a series, used to return about `n`
+        representative points for any range of the series in O(log(size) + n).
+        Level k groups the series in buckets of `base * factor ** k` points,
+        and keeps the indices of the minimum and maximum of each bucket. The
+        levels are updated incrementally as points are appended: only the last
+        bucket of each level changes. The series itself is not stored, and is
+        passed to `update()` and `query()`.
+        :param base: number of points in the buckets of the first level.
+        :param factor: number of buckets of each level merged in the next one.
+        """
+        self.base = base
+        self.factor = factor
+        self.size = 0
+        # Whether x is non-decreasing, so ranges can be found by bisection
+        self.sorted = True
+        # Each level is [i_min, i_max, count], with spare capacity in the arrays
+        self._levels = []
+
+    def update(self, x, y):
+        """
+        Adds the points of the series after the last update to the levels.
+        :param x: np.array with all the x values of the series.
+        :param y: np.array with all the y values of the series.
+        """
+        start, stop = self.size, len(y)
+        if stop == start:
+            return
+        if self.sorted:
+            tail = x[max(start - 1, 0):stop]
+            self.sorted = x.dtype.kind in 'biuf' and bool(np.all(tail[1:] >= tail[:-1]))
+        # The first bucket of each level that changed
+        bucket = start // self.base
+        idx = np.arange(bucket * self.base, stop)
+        i_min, i_max = _reduce(y, idx, idx, self.base)
+        self._store(0, bucket, i_min, i_max)
+        level = 0
+        while self._levels[level][2] > 1:
+            i_min, i_max, count = self._levels[level]
+            bucket //= self.factor
+            start = bucket * self.factor
+            i_min, i_max = _reduce(y, i_min[start:count], i_max[start:count], self.factor)
+            level += 1
+            self._store(level, bucket, i_min, i_max)
+        self.size = stop
+
+    def query(self, x, y, x_min=None, x_max=None, n=1000):
+        """
+        Returns the indices of about `n` points (at most `n + 2`, and at least
+        `n / (2 * factor)`) that represent the points of the series with x
+        between `x_min` and `x_max`: the minimum and maximum of consecutive
+        buckets of points, sorted. The closest point outside of the range on
+        each side is also included, so that lines reach the borders. The
+        buckets are aligned on multiples of their size, so a range can overlap
+        one more bucket than `n / 2`, hence the extra 2 points.
+        :param x: np.array with all the x values of the series.
+        :param y: np.array with all the y values of the series.
+        :param x_min: lower bound of the range (None for no bound).
+        :param x_max: upper bound of the range (None for no bound).
+        :param n: number of points to return (at least 2).
+        :return: np.array of indices.
+        """
+        self.update(x, y)
+        n_buckets = max(n // 2, 1)
+        if not self.sorted:
+            # Scatter plots, look at every point
+            mask = np.ones(len(y), dtype=bool)
+            if x_min is not None:
+                mask &= x >= x_min
+            if x_max is not None:
+                mask &= x <= x_max
+            idx = np.flatnonzero(mask)
+            if len(idx) <= n:
+                return idx
+            i_min, i_max = _reduce(y, idx, idx, -(-len(idx) // n_buckets))
+            return np.unique(np.concatenate([i_min, i_max]))
+
+        start = 0 if x_min is None else max(int(np.searchsorted(x, _cast(x_min, x.dtype), 'left')) - 1, 0)
+        stop = len(y) if x_max is None else min(int(np.searchsorted(x, _cast(x_max, x.dtype), 'right')) + 1, len(y))
+        if stop - start <= n:
+            return np.arange(start, stop)
+        size = -(-(stop - start) // n_buckets)
+        if size < self.base:
+            # Few enough points to reduce them directly
+            idx = np.arange(start, stop)
+            i_min, i_max = _reduce(y, idx, idx, size)
+        else:
+            # Finest level with buckets of at least `size` points
+            level, bucket_size = 0, self.base
+            while bucket_size < size and level < len(self._levels) - 1:
+                level += 1
+                bucket_size *= self.factor
+            i_min, i_max, _ = self._levels[level]
+            first, last = start // bucket_size, (stop - 1) // bucket_size + 1
+            i_min, i_max = i_min[first:last], i_max[first:last]
+        return np.unique(np.concatenate([i_min, i_max]))
+
+    def _store(self, level, start, i_min, i_max):
+        # Writes the buckets of a level from `start` on
+        if level == len(self._levels):
+            self._levels.append([np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), 0])
+        arrays = self._levels[level]
+        stop = start + len(i_min)
+        if stop > len(arrays[0]):
+            for i in range(2):
+                array = np.empty(max(2 * len(arrays[i]), stop, 16), dtype=np.int64)
+                array[:start] = arrays[i][:start]
+                arrays[i] = array
+        arrays[0][start:stop] = i_min
+        arrays[1][start:stop] = i_max
+        arrays[2] = stop
+
+
+def _cast(value, dtype):
+    # Searching an array for a value of another type converts the whole array
+    if dtype.kind in 'iu':
+        info = np.iinfo(dtype)
+        return dtype.type(min(max(np.floor(value), info.min), info.max))
+    return dtype.type(value)
+
+
+def _reduce(y, i_min, i_max, k):
+    """
+    Groups the given indices in buckets of `k` (the last one may be smaller),
+    and returns the indices of the minimum and maximum of `y` in each bucket.
+    :param y: np.array of values.
+    :param i_min: np.array of indices, candidates for the minimum.
+    :param i_max: np.array of indices, candidates for the maximum.
+    """
+    pad = -len(i_min) % k
+    if pad:
+        # Repeat the last candidate to fill the last bucket
+        i_min = np.concatenate([i_min, np.repeat(i_min[-1:], pad)])
+        i_max = np.concatenate([i_max, np.repeat(i_max[-1:], pad)])
+    i_min, i_max = i_min.reshape(-1, k), i_max.reshape(-1, k)
+    rows = np.arange(len(i_min))
+    return (i_min[rows, np.argmin(y[i_min], axis=1)],
+            i_max[rows, np.argmax(y[i_max], axis=1)])
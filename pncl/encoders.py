@@ -0,0 +1,192 @@
+import json
+import re
+import uuid
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class Fragment:
+    def __init__(self, text):
+        """
+        A piece of JSON that has already been encoded, and that encoders insert
+        as it is in their output. This is used to avoid encoding the same
+        static content (e.g., the options of a plot) over and over.
+        :param text: JSON string.
+        """
+        self.text = text
+
+    def __eq__(self, other):
+        return isinstance(other, Fragment) and self.text == other.text
+
+    def __repr__(self):
+        return 'Fragment({!r})'.format(self.text)
+
+
+class Binary:
+    def __init__(self, array):
+        """
+        A column of numbers that binary messages carry as raw bytes instead of
+        JSON (see `pncl.utils.to_binary`).
+        :param array: np.array.
+        """
+        self.array = array
+
+    def write(self, buffers):
+        """
+        Appends the bytes of the array to `buffers`, padded to a multiple of 8
+        bytes, and returns the reference that replaces the array in the JSON
+        header: a dictionary with the `dtype`, the `offset` of the bytes from
+        the first buffer, and the `length` of the array.
+        Non-numeric arrays are returned as lists.
+        :param buffers: list of bytes.
+        """
+        if self.array.dtype.kind not in 'biuf':
+            return self.array.tolist()
+        dtype, data = to_bytes(self.array)
+        offset = sum(len(b) for b in buffers)
+        buffers.append(data + bytes(-len(data) % 8))
+        return {'dtype': dtype, 'offset': offset, 'length': len(self.array)}
+
+
+def to_bytes(array):
+    """
+    Converts a numeric np.array to little-endian floats. Float32 arrays are
+    kept as they are, and any other numeric type is converted to float64.
+    :return: tuple with the name of the dtype ('float32' or 'float64') and the
+    bytes.
+    """
+    dtype = '<f4' if array.dtype == np.float32 else '<f8'
+    data = np.ascontiguousarray(array, dtype=dtype).tobytes()
+    return 'float32' if dtype == '<f4' else 'float64', data
+
+
+class Encoder:
+    # Name used to select the encoder in get_encoder(), and whether the
+    # library that it uses is installed
+    name = None
+    available = True
+
+    def __init__(self):
+        """
+        Base class for the JSON encoders used to serialize events and configs.
+        Besides the types supported by JSON, encoders support Numpy arrays and
+        scalars, `Fragment` objects, and objects with an `encode(wire_format)`
+        method (e.g., `pncl.plots.Points`).
+        """
+        # Placeholder for fragments, which are spliced in after encoding
+        self._placeholder = '__pncl_fragment_{}_'.format(uuid.uuid4().hex)
+        self._fragment_re = re.compile('"{}(\\d+)"'.format(self._placeholder))
+
+    def dumps(self, obj, wire_format='points', buffers=None):
+        """
+        Serializes the given object to a JSON string.
+        :param obj: object to serialize.
+        :param wire_format: format used for objects with an `encode()` method.
+        :param buffers: list to which the bytes of `Binary` objects are
+        appended (see `Binary.write`). Required if `obj` contains `Binary`
+        objects.
+        """
+        fragments = []
+
+        def default(o):
+            if isinstance(o, Fragment):
+                fragments.append(o.text)
+                return '{}{}'.format(self._placeholder, len(fragments) - 1)
+            if isinstance(o, Binary) and buffers is not None:
+                return o.write(buffers)
+            return self.default(o, wire_format)
+
+        output = self._dumps(obj, default)
+        if fragments:
+            output = self._fragment_re.sub(lambda m: fragments[int(m.group(1))], output)
+        return output
+
+    def default(self, obj, wire_format):
+        """
+        Converts objects that the JSON library cannot serialize natively.
+        """
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if hasattr(obj, 'encode'):
+            return obj.encode(wire_format)
+        raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+    def _dumps(self, obj, default):
+        raise NotImplementedError
+
+
+class JSONEncoder(Encoder):
+    name = 'json'
+
+    def __init__(self):
+        """
+        Encoder based on the `json` module of the standard library. Always
+        available, but the slowest.
+        """
+        super().__init__()
+
+    def _dumps(self, obj, default):
+        return json.dumps(obj, default=default)
+
+
+class UJSONEncoder(Encoder):
+    name = 'ujson'
+    available = ujson is not None
+
+    def __init__(self):
+        """
+        Encoder based on `ujson`, if installed.
+        """
+        if not self.available:
+            raise ImportError('ujson is not installed.')
+        super().__init__()
+
+    def _dumps(self, obj, default):
+        return ujson.dumps(obj, default=default)
+
+
+class OrjsonEncoder(Encoder):
+    name = 'orjson'
+    available = orjson is not None
+
+    def __init__(self):
+        """
+        Encoder based on `orjson`, if installed. This is the fastest encoder,
+        and it serializes numeric Numpy arrays and scalars natively, without
+        converting them to lists first.
+        """
+        if not self.available:
+            raise ImportError('orjson is not installed.')
+        super().__init__()
+        self._option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def _dumps(self, obj, default):
+        return orjson.dumps(obj, default=default, option=self._option).decode('utf-8')
+
+
+ENCODERS = [OrjsonEncoder, UJSONEncoder, JSONEncoder]
+
+
+def get_encoder(name=None):
+    """
+    Returns a JSON encoder.
+    :param name: one of 'orjson', 'ujson' or 'json'. If None, the fastest
+    encoder that is installed is used.
+    :return: Encoder object.
+    """
+    for cls in ENCODERS:
+        if (name is None and cls.available) or cls.name == name:
+            return cls()
+    raise ValueError('Unknown encoder: {}'.format(name))
@@ -0,0 +1,185 @@
+import glob
+import os
+import pickle
+import shutil
+import struct
+
+import numpy as np
+
+from pncl.plots import Buffer
+
+# Header of each record of the log: length of the pickled message
+_HEADER = struct.Struct('<I')
+
+
+class EventLog:
+    # Numeric arrays with at least this many values are stored in their own
+    # .npy file in snapshots, and memory-mapped when loading
+    min_array_size = 1024
+
+    def __init__(self, path, snapshot_every=100000):
+        """
+        Persistent, append-only log of the messages received by the server,
+        stored in the directory `path`. The directory contains:
+        - `snapshot/`: the state of the server when the last snapshot was
+        taken, as a pickle in which every large numeric column (e.g., the x or
+        y values of a dataset) is stored in its own .npy file;
+        - `events-<n>.log`: the messages received after the snapshot, as
+        records of a 4-byte length followed by the pickled message.
+        When the log is replayed, the columns are memory-mapped instead of
+        being read, so history that is not updated is only read from disk when
+        it is sent.
+        :param path: directory of the log (created if it does not exist).
+        :param snapshot_every: number of messages after which `full()` returns
+        True, i.e., a new snapshot should be taken to keep replays short.
+        """
+        self.path = path
+        self.snapshot_every = snapshot_every
+        # Number of messages in the log since the last snapshot
+        self.size = 0
+        os.makedirs(path, exist_ok=True)
+        self._file = None
+        self._generation = 0
+
+    def load(self):
+        """
+        Reads the log.
+        :return: tuple `(snapshot, messages)`, where `snapshot` is the object
+        passed to `snapshot()` the last time (None if there is none), and
+        `messages` is an iterator over the messages appended after it.
+        """
+        snapshot, self._generation = None, 0
+        for name in ('snapshot', 'snapshot.old'):
+            directory = os.path.join(self.path, name)
+            if os.path.exists(os.path.join(directory, 'state.pkl')):
+                with open(os.path.join(directory, 'state.pkl'), 'rb') as f:
+                    snapshot, self._generation = _Unpickler(f, directory).load()
+                break
+        return snapshot, self._read()
+
+    def append(self, message):
+        """
+        Appends a message to the log.
+        :param message: any picklable object.
+        """
+        if self._file is None:
+            self._file = open(self._log_path(self._generation), 'ab')
+        data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.write(_HEADER.pack(len(data)))
+        self._file.write(data)
+        self.size += 1
+
+    def flush(self):
+        """
+        Writes the buffered messages to the file.
+        """
+        if self._file is not None:
+            self._file.flush()
+
+    def full(self):
+        """
+        Returns True if a snapshot should be taken.
+        """
+        return self.size >= self.snapshot_every
+
+    def snapshot(self, obj):
+        """
+        Stores a snapshot of the state and starts a new log, so that the
+        messages received so far do not need to be replayed anymore.
+        :param obj: picklable object with the state.
+        """
+        # The messages after the snapshot go in a new file, so a crash while
+        # writing the snapshot leaves the previous snapshot and logs usable
+        self.close()
+        self._generation += 1
+        tmp = os.path.join(self.path, 'snapshot.tmp')
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        with open(os.path.join(tmp, 'state.pkl'), 'wb') as f:
+            _Pickler(f, tmp, self.min_array_size).dump((obj, self._generation))
+        current = os.path.join(self.path, 'snapshot')
+        old = os.path.join(self.path, 'snapshot.old')
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(current):
+            os.rename(current, old)
+        os.rename(tmp, current)
+        shutil.rmtree(old, ignore_errors=True)
+        for path in self._log_paths():
+            if _generation(path) < self._generation:
+                os.remove(path)
+        self.size = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read(self):
+        for path in self._log_paths():
+            if _generation(path) < self._generation:
+                continue
+            offset = 0
+            with open(path, 'rb') as f:
+                while True:
+                    header = f.read(_HEADER.size)
+                    if len(header) < _HEADER.size:
+                        break
+                    length, = _HEADER.unpack(header)
+                    data = f.read(length)
+                    if len(data) < length:
+                        break
+                    yield pickle.loads(data)
+                    self.size += 1
+                    offset += _HEADER.size + length
+                partial = f.tell() > offset
+            if partial:
+                # The last record was only partially written (e.g., the server
+                # was killed), drop it so that new records can be appended
+                with open(path, 'r+b') as f:
+                    f.truncate(offset)
+            self._generation = _generation(path)
+
+    def _log_path(self, generation):
+        return os.path.join(self.path, 'events-{}.log'.format(generation))
+
+    def _log_paths(self):
+        return sorted(glob.glob(os.path.join(self.path, 'events-*.log')), key=_generation)
+
+
+def _generation(path):
+    return int(os.path.basename(path)[len('events-'):-len('.log')])
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, file, directory, min_array_size):
+        # Stores large numeric arrays in .npy files next to the pickle
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.directory = directory
+        self.min_array_size = min_array_size
+        self.n_arrays = 0
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Buffer):
+            array = obj.array()
+        elif isinstance(obj, np.ndarray):
+            array = obj
+        else:
+            return None
+        if array.dtype.kind not in 'biuf' or array.size < self.min_array_size:
+            return None
+        name = '{}.npy'.format(self.n_arrays)
+        np.save(os.path.join(self.directory, name), array)
+        self.n_arrays += 1
+        return isinstance(obj, Buffer), name
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, directory):
+        # Memory-maps the arrays stored by _Pickler (read-only)
+        super().__init__(file)
+        self.directory = directory
+
+    def persistent_load(self, pid):
+        is_buffer, name = pid
+        array = np.load(os.path.join(self.directory, name), mmap_mode='r')
+        return Buffer(array, copy=False) if is_buffer else array
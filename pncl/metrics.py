@@ -0,0 +1,122 @@
+import time
+
+
+class Metrics:
+    def __init__(self, enabled=True):
+        """
+        Counters, gauges and timers of the stages of Pencil and of the server.
+        Timers keep the number of measurements, and the total and maximum time
+        of a stage. When disabled, nothing is recorded, and measuring a stage
+        only costs a function call.
+        Each metric can have labels, given as a string in the Prometheus
+        format (e.g., `'client="3"'`), which are part of its key.
+        :param enabled: whether to record anything.
+        """
+        self.enabled = enabled
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+
+    def count(self, name, value=1, labels=''):
+        """
+        Increments a counter.
+        """
+        if self.enabled:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, labels=''):
+        """
+        Sets the value of a gauge.
+        """
+        if self.enabled:
+            self.gauges[(name, labels)] = value
+
+    def start(self):
+        """
+        Starts timing a stage.
+        :return: the start time, to pass to `stop()` (None if disabled).
+        """
+        return time.perf_counter() if self.enabled else None
+
+    def stop(self, name, start, labels=''):
+        """
+        Records the time elapsed since `start()`.
+        """
+        if start is not None:
+            self.observe(name, time.perf_counter() - start, labels)
+
+    def observe(self, name, seconds, labels=''):
+        """
+        Records the time taken by a stage.
+        """
+        if self.enabled:
+            timer = self.timers.get((name, labels))
+            if timer is None:
+                self.timers[(name, labels)] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    def remove(self, labels):
+        """
+        Removes all the metrics with the given labels (e.g., of a client that
+        disconnected).
+        """
+        for metrics in (self.counters, self.gauges, self.timers):
+            for key in [key for key in metrics if key[1] == labels]:
+                del metrics[key]
+
+    def to_dict(self):
+        """
+        Returns the metrics as a dictionary, with the keys `counters`,
+        `gauges` and `timers`. Labeled metrics are keyed by `name{labels}`,
+        and each timer is a dictionary with the `count`, `total`, `mean` and
+        `max` time in seconds.
+        """
+        return {
+            'counters': {_key(k): v for k, v in self.counters.items()},
+            'gauges': {_key(k): v for k, v in self.gauges.items()},
+            'timers': {
+                _key(k): {'count': c, 'total': t, 'mean': t / c, 'max': m}
+                for k, (c, t, m) in self.timers.items()
+            }
+        }
+
+    def to_prometheus(self, prefix='pncl'):
+        """
+        Returns the metrics in the Prometheus text format: counters are named
+        `<prefix>_<name>_total`, gauges `<prefix>_<name>`, and timers are
+        summaries named `<prefix>_<name>_seconds` (with `_count` and `_sum`),
+        with their maximum in the gauge `<prefix>_<name>_seconds_max`.
+        """
+        lines = []
+        for metrics, kind, suffix in ((self.counters, 'counter', '_total'),
+                                      (self.gauges, 'gauge', '')):
+            for name in sorted({key[0] for key in metrics}):
+                metric = '{}_{}{}'.format(prefix, name, suffix)
+                lines.append('# TYPE {} {}'.format(metric, kind))
+                for (n, labels), value in sorted(metrics.items()):
+                    if n == name:
+                        lines.append('{}{} {}'.format(metric, _labels(labels), value))
+        for name in sorted({key[0] for key in self.timers}):
+            metric = '{}_{}_seconds'.format(prefix, name)
+            timers = sorted((labels, timer) for (n, labels), timer in self.timers.items() if n == name)
+            lines.append('# TYPE {} summary'.format(metric))
+            for labels, (count, total, _) in timers:
+                lines.append('{}_count{} {}'.format(metric, _labels(labels), count))
+                lines.append('{}_sum{} {}'.format(metric, _labels(labels), total))
+            lines.append('# TYPE {}_max gauge'.format(metric))
+            for labels, (_, _, maximum) in timers:
+                lines.append('{}_max{} {}'.format(metric, _labels(labels), maximum))
+        return '\n'.join(lines) + '\n'
+
+
+def _key(key):
+    name, labels = key
+    return '{}{}'.format(name, _labels(labels))
+
+
+def _labels(labels):
+    return '{{{}}}'.format(labels) if labels else ''
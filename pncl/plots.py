@@ -1,9 +1,336 @@
-from copy import deepcopy
-
-from pncl.utils import check_args, Color, lists_to_points
+import numpy as np
+
+from pncl.decimation import MinMaxDecimator
+from pncl.encoders import Binary, Fragment
+from pncl.utils import check_args, Color, lists_to_points, pack, to_json
+
+
+class Buffer:
+    def __init__(self, values=(), copy=True):
+        """
+        Growable buffer backed by a contiguous Numpy array, with amortized
+        constant-time appends. Numeric data is stored with a numeric dtype
+        (which is upcast if needed, e.g., when pushing a float to an integer
+        buffer), and any other data as Python objects. Supports the subset of
+        the list interface used by plots (len, indexing, slicing, append,
+        extend), and always returns Python types.
+        :param values: list or np.array of initial values.
+        :param copy: if False and `values` is a np.array, the buffer uses the
+        array directly instead of copying it. The array is never modified by
+        the buffer (it is copied the first time that new values are added), but
+        changes made to it by the caller will affect the buffer.
+        """
+        self._data = as_array(values, copy=copy)
+        self._size = len(self._data)
+        # Whether the array can be modified in place
+        self._owned = copy
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getstate__(self):
+        # Only pickle the values, not the spare capacity. Numeric values are
+        # pickled as bytes, which is much faster than pickling a small array.
+        array = self.array()
+        if array.dtype.kind in 'biuf':
+            return {'bytes': array.tobytes(), 'dtype': array.dtype.str}
+        return {'array': array}
+
+    def __setstate__(self, state):
+        if 'bytes' in state:
+            self._data = np.frombuffer(state['bytes'], dtype=state['dtype'])
+        else:
+            self._data = state['array']
+        self._size = len(self._data)
+        # Arrays that wrap bytes are read-only, and copied on the first write
+        self._owned = self._data.flags.writeable
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.array()[key].tolist()
+        value = self.array()[key]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def __setitem__(self, key, values):
+        values = as_array(values, copy=False)
+        dtype = _common_dtype(self._data.dtype, values.dtype)
+        if not self._owned or dtype != self._data.dtype:
+            self._data = self.array().astype(dtype)
+            self._owned = True
+        self._data[:self._size][key] = values
+
+    def __delitem__(self, key):
+        start, stop, _ = key.indices(self._size)
+        if stop == self._size:
+            # Dropping the last values is free
+            self._size = start
+        else:
+            array = self.array()
+            self._data = np.concatenate([array[:start], array[stop:]])
+            self._size = len(self._data)
+            self._owned = True
+
+    def array(self):
+        """
+        Returns a Numpy view of the values in the buffer.
+        """
+        return self._data[:self._size]
+
+    def take(self, idx):
+        """
+        Returns a Numpy array with the values at the given indices.
+        :param idx: slice or np.array of indices.
+        """
+        return self.array()[idx]
+
+    def append(self, value):
+        if self._size == len(self._data) or not self._owned \
+                or not _fits(value, self._data.dtype):
+            self.extend([value])
+            return
+        self._data[self._size] = value
+        self._size += 1
+
+    def extend(self, values):
+        values = as_array(values, copy=False)
+        n = len(values)
+        dtype = _common_dtype(self._data.dtype, values.dtype)
+        if self._size + n > len(self._data) or dtype != self._data.dtype or not self._owned:
+            # Reallocate, doubling the capacity (arrays that the buffer does
+            # not own may be shared, e.g., after deleting the last values)
+            data = np.empty(max(2 * len(self._data), self._size + n, 16), dtype=dtype)
+            data[:self._size] = self.array()
+            self._data = data
+            self._owned = True
+        self._data[self._size:self._size + n] = values
+        self._size += n
+
+
+class RingBuffer:
+    def __init__(self, capacity, values=()):
+        """
+        Fixed-capacity buffer backed by a Numpy array. When the buffer is full,
+        appending new values overwrites the oldest ones. Supports the same
+        interface as `Buffer`.
+        :param capacity: maximum number of values kept in the buffer.
+        :param values: list or np.array of initial values (only the last
+        `capacity` are kept).
+        """
+        values = as_array(values, copy=False)
+        self._data = np.empty(capacity, dtype=values.dtype)
+        self._start = 0
+        self._size = 0
+        self.extend(values)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, key):
+        capacity = len(self._data)
+        if isinstance(key, slice):
+            idx = np.arange(*key.indices(self._size))
+            return self._data[(self._start + idx) % capacity].tolist()
+        if key < 0:
+            key += self._size
+        if not 0 <= key < self._size:
+            raise IndexError('RingBuffer index out of range')
+        value = self._data[(self._start + key) % capacity]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def __setitem__(self, key, values):
+        if isinstance(key, slice):
+            key = np.arange(*key.indices(self._size))
+        values = as_array(values, copy=False)
+        dtype = _common_dtype(self._data.dtype, values.dtype)
+        if dtype != self._data.dtype:
+            self._data = self._data.astype(dtype)
+        self._data[(self._start + np.asarray(key)) % max(len(self._data), 1)] = values
+
+    def __delitem__(self, key):
+        start, stop, _ = key.indices(self._size)
+        stop = max(start, stop)
+        if stop == self._size:
+            # Dropping the newest or the oldest values is free
+            self._size = start
+        elif start == 0:
+            self._start = (self._start + stop) % max(len(self._data), 1)
+            self._size -= stop
+        else:
+            values = np.concatenate([self.take(slice(None, start)), self.take(slice(stop, None))])
+            self._start = self._size = 0
+            self.extend(values)
+
+    def array(self):
+        """
+        Returns a Numpy array with the values in the buffer, from the oldest to
+        the newest (this is a copy).
+        """
+        return self.take(slice(None))
+
+    def take(self, idx):
+        """
+        Returns a Numpy array with the values at the given indices, counted
+        from the oldest value (this is a copy).
+        :param idx: slice or np.array of indices.
+        """
+        if isinstance(idx, slice):
+            idx = np.arange(*idx.indices(self._size))
+        return self._data[(self._start + idx) % len(self._data)]
+
+    def append(self, value):
+        self.extend([value])
+
+    def extend(self, values):
+        values = as_array(values, copy=False)
+        capacity = len(self._data)
+        values = values[-capacity:] if capacity else values[:0]
+        dtype = _common_dtype(self._data.dtype, values.dtype)
+        if dtype != self._data.dtype:
+            self._data = self._data.astype(dtype)
+        n = len(values)
+        end = (self._start + self._size) % max(capacity, 1)
+        self._data[(end + np.arange(n)) % max(capacity, 1)] = values
+        overflow = max(self._size + n - capacity, 0)
+        self._start = (self._start + overflow) % max(capacity, 1)
+        self._size = min(self._size + n, capacity)
+
+    def encode(self, wire_format):
+        """
+        Returns the values in a form that the JSON encoders support (e.g., when
+        the server keeps the labels of a plot in a ring buffer).
+        """
+        array = self.array()
+        return array if array.dtype.kind in 'biuf' else array.tolist()
+
+
+class Points:
+    def __init__(self, x, y, capacity=None):
+        """
+        Columnar storage for the data of a dataset with x and y coordinates.
+        Chart.js expects a list of {'x': ..., 'y': ...} points, but Pencil and
+        the server keep the two columns as Numpy arrays and only convert them
+        when encoding to JSON, according to the wire format (see `encode()`).
+        Supports the same list operations as the Chart.js data (len, extend,
+        assigning and deleting items), so that it can be used in their place.
+        :param x: list or np.array.
+        :param y: list or np.array.
+        :param capacity: if given, the columns are `RingBuffer`s that only keep
+        the last `capacity` points.
+        """
+        if capacity is None:
+            self.x = Buffer(x, copy=False)
+            self.y = Buffer(y, copy=False)
+        else:
+            self.x = RingBuffer(capacity, x)
+            self.y = RingBuffer(capacity, y)
+
+    def __len__(self):
+        return len(self.y)
+
+    def __setitem__(self, key, other):
+        self.x[key] = other.x.array()
+        self.y[key] = other.y.array()
+
+    def __delitem__(self, key):
+        del self.x[key]
+        del self.y[key]
+
+    def take(self, idx):
+        """
+        Returns the points at the given indices, as a new `Points` object.
+        :param idx: slice or np.array of indices.
+        """
+        return Points(self.x.take(idx), self.y.take(idx))
+
+    def extend(self, other):
+        self.x.extend(other.x.array())
+        self.y.extend(other.y.array())
+
+    def encode(self, wire_format):
+        """
+        Returns a JSON-serializable representation of the points.
+        :param wire_format: one of:
+        - `'points'`: list of {'x': ..., 'y': ...} dictionaries, as expected by
+        Chart.js;
+        - `'columns'`: dictionary with two lists, x and y;
+        - `'base64'`: dictionary with the x and y columns packed as base64
+        strings of little-endian floats (see `pncl.utils.pack`);
+        - `'binary'`: dictionary with the x and y columns as
+        `pncl.encoders.Binary` objects, for binary messages (see
+        `pncl.utils.to_binary`).
+        """
+        if wire_format == 'points':
+            return lists_to_points(self.x[:], self.y[:])
+        if wire_format == 'columns':
+            return {'x': self.x.array(), 'y': self.y.array()}
+        if wire_format == 'base64':
+            return {'x': pack(self.x.array()), 'y': pack(self.y.array())}
+        if wire_format == 'binary':
+            return {'x': Binary(self.x.array()), 'y': Binary(self.y.array())}
+        raise ValueError('Unknown wire format: {}'.format(wire_format))
+
+
+def as_array(values, copy=True):
+    """
+    Converts a list or np.array to a 1D np.array. Numeric data keeps a numeric
+    dtype, while anything else (e.g., strings) is stored as Python objects.
+    """
+    if isinstance(values, np.ndarray):
+        array = np.array(values, copy=True) if copy else values
+    else:
+        array = np.asarray(values)
+        if array.dtype.kind not in 'biuf':
+            # Avoid coercing mixed lists to strings
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+    if array.dtype.kind not in 'biufO':
+        array = array.astype(object)
+    return array
+
+
+def _common_dtype(a, b):
+    if a == b:
+        return a
+    if a == object or b == object:
+        return np.dtype(object)
+    return np.result_type(a, b)
+
+
+def _fits(value, dtype):
+    # Whether a scalar can be stored with the given dtype without losing data
+    if dtype.kind == 'O':
+        return True
+    if isinstance(value, (bool, np.bool_)):
+        return dtype.kind in 'biuf'
+    if isinstance(value, (int, np.integer)):
+        return dtype.kind in 'iuf'
+    if isinstance(value, (float, np.floating)):
+        return dtype.kind == 'f'
+    return False
+
+
+def _changed(old, new):
+    """
+    Returns a boolean np.array that is True where the values of two arrays of
+    the same length differ.
+    """
+    if old.dtype.kind in 'biuf' and new.dtype.kind in 'biuf':
+        return old != new
+    return np.array([a != b for a, b in zip(old.tolist(), new.tolist())], dtype=bool)
 
 
 class Plot:
+    # Whether the plot can be decimated with the `decimate` keyword
+    supports_decimation = False
+    # Maximum fraction of changed values for which a refresh is sent as a patch
+    patch_threshold = 0.5
+
     def __init__(self, *args, **kwargs):
         self.type = None
         self.x = None
@@ -11,10 +338,31 @@ class Plot:
         self.datasets_labels = None
         self.x_label = None
         self.y_label = None
+        self.max_points = kwargs.get('max_points', None)
+        self.decimate = kwargs.get('decimate', None)
+        self.decimators = None
+        self._options = None
+        self._previous = None
+        # Whether the server may be out of sync with the plot
+        self._invalid = False
+        if self.decimate is not None:
+            if not self.supports_decimation:
+                raise ValueError('decimate is only supported by line and scatter plots.')
+            if self.max_points is not None:
+                raise ValueError('decimate and max_points cannot be used together.')
 
     def get_datasets(self):
         pass
 
+    def get_points(self, dataset, idx):
+        """
+        Returns the values of the points at the given indices in each list of
+        the given dataset, as a dictionary of lists keyed like the dataset
+        returned by `get_datasets()`.
+        :param idx: slice or np.array of indices.
+        """
+        pass
+
     def get_x_labels(self):
         pass
 
@@ -71,20 +419,33 @@ class Plot:
         }
 
     def refresh(self, *args, **kwargs):
+        # Keep the current data, to compute the changes in last_patch()
+        if self.x is not None:
+            self._previous = (self.x, self.y, self.get_datasets_labels(), self._options)
+        self._options = None
         self.datasets_labels = kwargs.get('labels', None)
         self.x_label = kwargs.get('x_label', None)
         self.y_label = kwargs.get('y_label', None)
 
-        args = deepcopy(args)
         args = check_args(*args)
         if len(args) == 1:
             # Only one y
-            self.x = list(range(len(args[0])))
-            self.y = args
+            args = [np.arange(len(args[0]))] + args
+
+        # One x and at least one y
+        if self.max_points is not None:
+            # Keep only the most recent points
+            self.x = RingBuffer(self.max_points, args[0])
+            self.y = [RingBuffer(self.max_points, y) for y in args[1:]]
         else:
-            # One x and at least one y
-            self.x = args[0]
-            self.y = args[1:]
+            copy = kwargs.get('copy', True)
+            self.x = Buffer(args[0], copy=copy)
+            self.y = [Buffer(y, copy=copy) for y in args[1:]]
+
+        if self.decimate is not None:
+            self.decimators = [MinMaxDecimator(self.decimate) for _ in self.y]
+            for decimator, y in zip(self.decimators, self.y):
+                decimator.extend(self.x.array(), y.array())
 
     def push(self, *args):
         if len(args) == 1:
@@ -94,42 +455,164 @@ class Plot:
                     'or a single value if there is only one line.'
                 )
             # Only one y
-            self.x.append(self.x[-1] + 1)
-            self.y[0].append(args[0])
-        else:
-            if len(args) != len(self.y) + 1:
+            args = (self.x[-1] + 1,) + args
+        elif len(args) != len(self.y) + 1:
+            raise ValueError(
+                'add() requires a value for x and a value for each line, '
+                'or a single value if there is only one line.'
+            )
+
+        # One x and at least one y
+        self.x.append(args[0])
+        for i in range(len(self.y)):
+            self.y[i].append(args[i + 1])
+
+        if self.decimators is not None:
+            for decimator, y in zip(self.decimators, args[1:]):
+                decimator.extend([args[0]], [y])
+
+    def push_many(self, *args):
+        args = check_args(*args)
+        if len(args) == 1:
+            if len(self.y) > 1:
                 raise ValueError(
-                    'add() requires a value for x and a value for each line, '
-                    'or a single value if there is only one line.'
+                    'push_many() requires an array for x and an array for each '
+                    'line, or a single array if there is only one line.'
                 )
-            # One x and at least one y
-            self.x.append(args[0])
-            for i in range(len(self.y)):
-                self.y[i].append(args[i + 1])
+            # Only one y
+            args = [self.x[-1] + 1 + np.arange(len(args[0]))] + args
+        elif len(args) != len(self.y) + 1:
+            raise ValueError(
+                'push_many() requires an array for x and an array for each '
+                'line, or a single array if there is only one line.'
+            )
+        if any(len(a) != len(args[0]) for a in args):
+            raise ValueError('All arrays passed to push_many() must have the same length.')
+
+        # One x and at least one y
+        self.x.extend(args[0])
+        for i in range(len(self.y)):
+            self.y[i].extend(args[i + 1])
+
+        if self.decimators is not None:
+            for decimator, y in zip(self.decimators, args[1:]):
+                decimator.extend(args[0], y)
+
+    def last_pushed(self, n=1):
+        """
+        Returns the last `n` points pushed to the plot, in the format expected
+        by the browser for push events.
+        For decimated plots, returns the decimated points that changed since
+        the plot was last sent to the browser, and the number of points that
+        they `replace` at the end of each dataset. Returns None if the whole
+        decimated series changed, in which case the plot should be refreshed.
+        Also returns None after `invalidate()`.
+        """
+        if self._invalid:
+            self._invalid = False
+            return None
+        if self.decimators is not None:
+            tails = [decimator.tail() for decimator in self.decimators]
+            if tails[0] is None:
+                return None
+            return {
+                'labels': None,
+                'replace': tails[0][0],
+                'datasets': [{'data': Points(x, y)} for _, x, y in tails]
+            }
 
-    def last_pushed(self):
+        start = max(len(self.x) - n, 0)
         output = {
-            'label': None,
-            'datasets': None
+            'labels': None,
+            'datasets': [self.get_points(i, slice(start, None)) for i in range(len(self.y))]
         }
         labels = self.get_x_labels()
         if labels:
-            output['label'] = labels[-1]
+            output['labels'] = labels[start:]
+
+        return output
 
-        datasets = self.get_datasets()
-        datasets = [
-            {key: value[-1] for key, value in d.items() if isinstance(value, list)}
-            for d in datasets
-        ]
-        output['datasets'] = datasets
+    def invalidate(self):
+        """
+        Marks the plot as out of sync with the server (e.g., after one of its
+        updates was dropped), so that the next update sends the whole plot.
+        """
+        self._invalid = True
+
+    def last_patch(self):
+        """
+        Returns the changes made to the plot by the last refresh, in the format
+        expected by the browser for patch events:
+        - `labels`: the indices (`idx`) and new `values` of the x labels that
+        changed, or None;
+        - `datasets`: for each dataset, the indices (`idx`) of the points that
+        changed, and their new values (as in `get_points()`);
+        - `options`: the new options, if they changed.
+        Returns None if the plot should be refreshed in full instead, i.e., if
+        the number of datasets or points changed, if the legend changed, if
+        the plot is decimated, or if more than `patch_threshold` of the values
+        changed, or after `invalidate()`.
+        """
+        previous, self._previous = self._previous, None
+        if previous is None or self._invalid:
+            self._invalid = False
+            return None
+        x, y, datasets_labels, options = previous
+        if self.decimators is not None or len(y) != len(self.y) \
+                or len(x) != len(self.x) or datasets_labels != self.get_datasets_labels():
+            return None
+
+        changed_x = _changed(x.array(), self.x.array())
+        changed = [changed_x | _changed(old.array(), new.array()) for old, new in zip(y, self.y)]
+        n_changed = sum(int(c.sum()) for c in changed)
+        if n_changed > self.patch_threshold * len(self.x) * len(self.y):
+            return None
+
+        output = {
+            'labels': None,
+            'datasets': []
+        }
+        for i, c in enumerate(changed):
+            idx = np.flatnonzero(c)
+            points = self.get_points(i, idx)
+            points['idx'] = idx
+            output['datasets'].append(points)
+        if self.get_x_labels() is not None and changed_x.any():
+            idx = np.flatnonzero(changed_x)
+            output['labels'] = {'idx': idx, 'values': self.x.take(idx)}
+        if self._get_options() != options:
+            output['options'] = self._get_options()
 
         return output
 
     def to_dict(self):
-        pass
+        """
+        Returns the Chart.js config of the plot. If the plot has a maximum
+        number of points, it is stored in the `max_points` key.
+        """
+        plot = {
+            'type': self.type,
+            'data': {
+                'labels': self.get_x_labels(),
+                'datasets': self.get_datasets()
+            },
+            'options': self._get_options()
+        }
+        if self.max_points is not None:
+            plot['max_points'] = self.max_points
+        return plot
+
+    def _get_options(self):
+        # The options only change when the plot is refreshed, so they are
+        # encoded once and stored as a Fragment
+        if self._options is None:
+            self._options = Fragment(to_json(self.get_options()))
+        return self._options
 
 
 class Line(Plot):
+    supports_decimation = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.refresh(*args, **kwargs)
@@ -140,15 +623,22 @@ class Line(Plot):
         datasets = []
         datasets_labels = self.get_datasets_labels()
         for i, y in enumerate(self.y):
+            if self.decimators is not None:
+                data = Points(*self.decimators[i].points())
+            else:
+                data = Points(self.x.array(), y.array())
             dataset = {
                 'label': datasets_labels[i],
-                'data': lists_to_points(self.x, y)
+                'data': data
             }
             dataset.update(self.get_style(i))
             datasets.append(dataset)
 
         return datasets
 
+    def get_points(self, dataset, idx):
+        return {'data': Points(self.x.take(idx), self.y[dataset].take(idx))}
+
     def get_x_labels(self):
         return None
 
@@ -157,19 +647,10 @@ class Line(Plot):
         options['scales']['xAxes'][0]['type'] = 'linear'
         return options
 
-    def to_dict(self):
-        plot = {
-            'type': self.type,
-            'data': {
-                'labels': self.get_x_labels(),
-                'datasets': self.get_datasets()
-            },
-            'options': self.get_options()
-        }
-        return plot
-
 
 class Bar(Line):
+    supports_decimation = False
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -177,7 +658,7 @@ class Bar(Line):
         self.has_labels = True
 
     def get_x_labels(self):
-        return self.x
+        return self.x[:]
 
     def get_options(self):
         options = super().get_options()
@@ -197,13 +678,16 @@ class Radar(Bar):
         for i, y in enumerate(self.y):
             dataset = {
                 'label': datasets_labels[i],
-                'data': y,
+                'data': y[:],
             }
             dataset.update(self.get_style(i))
             datasets.append(dataset)
 
         return datasets
 
+    def get_points(self, dataset, idx):
+        return {'data': self.y[dataset].take(idx)}
+
     def get_options(self):
         options = super().get_options()
         options['scales'] = None
@@ -222,20 +706,28 @@ class Pie(Plot):
         datasets = []
         for i, y in enumerate(self.y):
             dataset = {
-                'data': y,
+                'data': y[:],
             }
             dataset.update(self.get_style(i))
             datasets.append(dataset)
 
         return datasets
 
+    def get_points(self, dataset, idx):
+        colors = [Color.get(i) for i in np.arange(len(self.x))[idx]]
+        return {
+            'data': self.y[dataset].take(idx),
+            'borderColor': ['rgba({}, {}, {}, 1)'.format(*c) for c in colors],
+            'backgroundColor': ['rgba({}, {}, {}, 0.2)'.format(*c) for c in colors]
+        }
+
     def get_options(self):
         options = super().get_options()
         options['scales'] = None
         return options
 
     def get_x_labels(self):
-        return self.x
+        return self.x[:]
 
     def get_style(self, subplot):
         colors = [Color.get(i) for i in range(len(self.x))]
@@ -244,17 +736,6 @@ class Pie(Plot):
             'backgroundColor': ['rgba({}, {}, {}, 0.2)'.format(*c) for c in colors]
         }
 
-    def to_dict(self):
-        plot = {
-            'type': self.type,
-            'data': {
-                'labels': self.get_x_labels(),
-                'datasets': self.get_datasets()
-            },
-            'options': self.get_options()
-        }
-        return plot
-
 
 class Doughnut(Pie):
     def __init__(self, *args, **kwargs):
@@ -1,16 +1,29 @@
-import atexit
+import functools
 import json
-import multiprocessing
-import webbrowser
 from math import ceil
+from multiprocessing import Event, Process
+from multiprocessing.util import Finalize
 
-from pncl.plots import Line, Bar, Pie, Scatter, Radar, Doughnut, PolarArea
-from pncl.server import Server
+from pncl.metrics import Metrics
+from pncl.transport import BackgroundTransport, PipeTransport, SocketTransport
+
+# Numpy (for the plots), aiohttp (for the server) and the other heavy modules
+# are only imported when they are first needed, so that importing pncl and
+# creating a Pencil that never plots are fast
 
 
 class Pencil:
+    # Whether updates are always sent by a background thread, and size of the
+    # buffer and policy of the background sender, if used
+    _async_send = False
+    _max_buffer = None
+    _policy = 'block'
+
     def __init__(self, grid=2, col_height=300, sticky=True, host='0.0.0.0',
-                 port=8080, events_per_second=1):
+                 port=8080, events_per_second=None, transport=None,
+                 wire_format='points', encoder=None, websocket=False,
+                 async_send=False, listen=None, authkey=None, log_dir=None,
+                 metrics=False):
         """
         This is the main class of the package, and the only one you'll be using.
         Arguments:
@@ -29,30 +42,126 @@ class Pencil:
         Do not change it if you don't know what you are doing. This is the host
         for the `aiohttp` instance that serves the content.
         - `port` (default: `8080`): port on which the server listens.
-        - `events_per_second` (default: `1`): how many times per second should
-        the content be refreshed. Setting a high value may cause performance
-        issues.
-        """
-        self._event_manager = multiprocessing.Manager()
-        self._event_queue = self._event_manager.Queue()
-        self._config_queue = self._event_manager.Queue()
-        self.global_lock = self._event_manager.Lock()
-        self._server = Server(host=host, port=port, events_per_second=events_per_second)
-        self._server.start(self._event_queue, self._config_queue)
+        - `events_per_second` (default: `None`): maximum number of times per
+        second that the content is refreshed. Updates that arrive in between
+        are held back and merged, so that the browser receives at most one
+        update per plot each time. If `None`, updates are sent to the browser as
+        soon as they are created.
+        - `transport` (default: `None`): a `pncl.transport.Transport` used to
+        send events to the server. By default, a `PipeTransport` is used.
+        - `wire_format` (default: `'points'`): how data points are sent to the
+        browser. `'points'` sends a list of `{x, y}` objects for each data set,
+        `'columns'` sends two lists of x and y values, and `'base64'` packs the
+        values as binary floats, which is the most compact and fastest to
+        encode for large plots.
+        - `encoder` (default: `None`): JSON library used to encode the plots,
+        one of `'orjson'`, `'ujson'` or `'json'` (the standard library). If
+        None, the fastest library that is installed is used.
+        - `websocket` (default: `False`): if `True`, the browser receives the
+        plots through a WebSocket with binary messages, in which the data
+        points are sent as raw floats. This sustains higher update rates than
+        the default server-sent events. If `'deflate'`, messages are also
+        compressed (this saves bandwidth for labels and evenly spaced x values,
+        but costs CPU). Browsers that cannot connect to the WebSocket fall back
+        to server-sent events.
+        - `async_send` (default: `False`): if `True`, updates are added to a
+        buffer and sent to the server by a background thread, so that calls to
+        Pencil return without waiting for the updates to be encoded and sent.
+        Points pushed to a plot while the previous ones are still waiting in
+        the buffer are merged with them and sent together. Call `flush()` to
+        wait until all updates were sent (this is done automatically when
+        the script terminates).
+        - `listen` (default: `None`): address on which the server accepts
+        updates from other processes, which connect to it with
+        `Pencil.connect()`. Either a `(host, port)` tuple for TCP, or the path
+        of a Unix socket. Updates are sent with `pickle`, so only accept
+        connections from trusted networks. Pencil returns once the server
+        accepts connections.
+        - `authkey` (default: `None`): bytes, secret key that other processes
+        must use to connect to `listen`. It is required for TCP addresses. If
+        `None`, connections to a Unix socket are not authenticated (only the
+        permissions of the file protect it).
+        - `log_dir` (default: `None`): directory in which the server keeps a
+        log of all updates on disk. If the directory already contains a log
+        (e.g., from a previous run of the script, or from a server that
+        crashed), the plots are restored from it and shown after the new
+        ones. Only the new plots can be updated. If `None`, the plots are only
+        kept in memory.
+        - `metrics` (default: `False`): if `True`, Pencil and the server time
+        each stage of sending updates to the browser, and count the updates and
+        bytes sent. The metrics are returned by `stats()`, and the server
+        serves them at `/metrics` in the Prometheus format. When `False`, only
+        the sizes of the buffers and queues are available.
+        The server is started when the first plot is added (or when the page is
+        opened with `browser()`), unless `listen` or `log_dir` are given. Pencil
+        waits until the server serves the page, and raises `RuntimeError` if it
+        cannot start.
+        """
+        if isinstance(listen, tuple) and authkey is None:
+            # Anyone who can connect could run code in the server
+            raise ValueError('An authkey is required to listen on a TCP address.')
+        self._server = None
+        self._server_args = dict(host=host, port=port, events_per_second=events_per_second,
+                                 wire_format=wire_format, encoder=encoder,
+                                 websocket=websocket, listen=listen, authkey=authkey,
+                                 log_dir=log_dir, metrics=metrics)
+        self._server_transport = transport
+        self._setup(grid, col_height, sticky, async_send, metrics)
+        if listen is not None or log_dir is not None:
+            # Other processes and the restored plots need the server right away
+            self._start()
+
+    @classmethod
+    def connect(cls, address, name=None, authkey=None, grid=2, async_send=False,
+                metrics=False):
+        """
+        Creates a Pencil that sends its plots to the server of another Pencil,
+        created with the `listen` argument (e.g., to plot from several worker
+        processes or machines on the same page).
+        Each connected Pencil numbers its plots from zero and arranges them in
+        its own grid, as if it were alone: its plots are shown after those of
+        the Pencil that owns the server and of the Pencils that connected
+        before it, and its rows after their rows.
+        Arguments:
+        - `address`: the `listen` address of the server, either a
+        `(host, port)` tuple or the path of a Unix socket.
+        - `name` (default: `None`): string, name of this producer. A new
+        connection with the same name as a previous one replaces its plots
+        (e.g., when a worker is restarted). If `None`, the host name and the
+        process id are used, so that every process has its own plots.
+        - `authkey` (default: `None`): bytes, the `authkey` of the server.
+        - `grid` (default: `2`): structure of the grid of this Pencil, as in
+        `Pencil()`.
+        - `async_send` (default: `False`): send updates with a background
+        thread, as in `Pencil()`.
+        - `metrics` (default: `False`): record the metrics of this Pencil, as
+        in `Pencil()`.
+        Plots stay on the server when the connected Pencil terminates.
+        """
+        self = cls.__new__(cls)
+        self._server = None
+        self._server_args = None
+        self._setup(grid, 300, True, async_send, metrics)
+        self._open(SocketTransport(address, name=name, authkey=authkey))
+        return self
+
+    def _setup(self, grid, col_height, sticky, async_send, metrics):
+        self._metrics = Metrics(metrics)
+        # Opened when the first update is sent (see _open)
+        self._transport = None
+        self._background = async_send or self._async_send
         self.sticky = sticky
-        if not self.sticky:
-            atexit.register(self.stop)
-        else:
-            atexit.register(self._event_queue.join)
+        # Registered when the transport is opened (see _open)
+        self._finalizer = None
 
         self.grid = grid
         self.plots = []
         self._config = {
             'grid': grid if grid else [],
-            'height': int(col_height),
-            'plots': []
+            'height': int(col_height)
         }
-        
+        self._check_grid()
+
     def line(self, *args, **kwargs):
         """
         Adds a line plot to the grid.
@@ -66,11 +175,20 @@ class Pencil:
         - `y_label`: string, the custom label for the y-axis.
         - `labels`: list of strings, one for each `y1, ..., yn`. The custom
         labels for the legend.
+        - `copy` (default: `True`): if `False`, Numpy arrays are stored without
+        being copied, so they must not be modified afterwards.
+        - `max_points`: integer, if given, only the most recent `max_points`
+        points are kept and shown, and the oldest ones are dropped as new points
+        are pushed.
+        - `decimate`: integer, if given, the plot shows at most this many points.
+        Consecutive points are grouped in buckets, and only the minimum and
+        maximum of each bucket are sent to the browser. Useful for very long
+        series.
         """
+        from pncl.plots import Line
         plot = Line(*args, **kwargs)
         self.plots.append(plot)
-        self._config['plots'].append(plot.to_dict())
-        self._new_grid()
+        self._add_plot()
 
     def bar(self, *args, **kwargs):
         """
@@ -87,11 +205,16 @@ class Pencil:
         - `y_label`: string, the custom label for the y-axis.
         - `labels`: list of strings, one for each `y1, ..., yn`. The custom
         labels for the legend.
+        - `copy` (default: `True`): if `False`, Numpy arrays are stored without
+        being copied, so they must not be modified afterwards.
+        - `max_points`: integer, if given, only the most recent `max_points`
+        points are kept and shown, and the oldest ones are dropped as new points
+        are pushed.
         """
+        from pncl.plots import Bar
         plot = Bar(*args, **kwargs)
         self.plots.append(plot)
-        self._config['plots'].append(plot.to_dict())
-        self._new_grid()
+        self._add_plot()
 
     def radar(self, *args, **kwargs):
         """
@@ -106,11 +229,16 @@ class Pencil:
         be displayed accordingly.
         - `labels`: list of strings, one for each `y1, ..., yn`. The custom
         labels for the legend.
+        - `copy` (default: `True`): if `False`, Numpy arrays are stored without
+        being copied, so they must not be modified afterwards.
+        - `max_points`: integer, if given, only the most recent `max_points`
+        points are kept and shown, and the oldest ones are dropped as new points
+        are pushed.
         """
+        from pncl.plots import Radar
         plot = Radar(*args, **kwargs)
         self.plots.append(plot)
-        self._config['plots'].append(plot.to_dict())
-        self._new_grid()
+        self._add_plot()
 
     def pie(self, *args, **kwargs):
         """
@@ -125,11 +253,16 @@ class Pencil:
         be displayed accordingly.
         - `labels`: list of strings, one for each `y1, ..., yn`. The custom
         labels for the legend.
+        - `copy` (default: `True`): if `False`, Numpy arrays are stored without
+        being copied, so they must not be modified afterwards.
+        - `max_points`: integer, if given, only the most recent `max_points`
+        points are kept and shown, and the oldest ones are dropped as new points
+        are pushed.
         """
+        from pncl.plots import Pie
         plot = Pie(*args, **kwargs)
         self.plots.append(plot)
-        self._config['plots'].append(plot.to_dict())
-        self._new_grid()
+        self._add_plot()
 
     def doughnut(self, *args, **kwargs):
         """
@@ -144,11 +277,16 @@ class Pencil:
         be displayed accordingly.
         - `labels`: list of strings, one for each `y1, ..., yn`. The custom
         labels for the legend.
+        - `copy` (default: `True`): if `False`, Numpy arrays are stored without
+        being copied, so they must not be modified afterwards.
+        - `max_points`: integer, if given, only the most recent `max_points`
+        points are kept and shown, and the oldest ones are dropped as new points
+        are pushed.
         """
+        from pncl.plots import Doughnut
         plot = Doughnut(*args, **kwargs)
         self.plots.append(plot)
-        self._config['plots'].append(plot.to_dict())
-        self._new_grid()
+        self._add_plot()
 
     def polar_area(self, *args, **kwargs):
         """
@@ -163,11 +301,16 @@ class Pencil:
         be displayed accordingly.
         - `labels`: list of strings, one for each `y1, ..., yn`. The custom
         labels for the legend.
+        - `copy` (default: `True`): if `False`, Numpy arrays are stored without
+        being copied, so they must not be modified afterwards.
+        - `max_points`: integer, if given, only the most recent `max_points`
+        points are kept and shown, and the oldest ones are dropped as new points
+        are pushed.
         """
+        from pncl.plots import PolarArea
         plot = PolarArea(*args, **kwargs)
         self.plots.append(plot)
-        self._config['plots'].append(plot.to_dict())
-        self._new_grid()
+        self._add_plot()
 
     def scatter(self, *args, **kwargs):
         """
@@ -182,11 +325,20 @@ class Pencil:
         - `y_label`: string, the custom label for the y-axis.
         - `labels`: list of strings, one for each `y1, ..., yn`. The custom
         labels for the legend.
+        - `copy` (default: `True`): if `False`, Numpy arrays are stored without
+        being copied, so they must not be modified afterwards.
+        - `max_points`: integer, if given, only the most recent `max_points`
+        points are kept and shown, and the oldest ones are dropped as new points
+        are pushed.
+        - `decimate`: integer, if given, the plot shows at most this many points.
+        Consecutive points are grouped in buckets, and only the minimum and
+        maximum of each bucket are sent to the browser. Useful for very long
+        series.
         """
+        from pncl.plots import Scatter
         plot = Scatter(*args, **kwargs)
         self.plots.append(plot)
-        self._config['plots'].append(plot.to_dict())
-        self._new_grid()
+        self._add_plot()
         
     def refresh(self, plot_idx, *args, **kwargs):
         """
@@ -201,17 +353,30 @@ class Pencil:
         on `line`, `bar`, and `scatter` plots).
         - `labels`: list of strings, one for each `y1, ..., yn`. The custom
         labels for the legend.
+        - `copy` (default: `True`): if `False`, Numpy arrays are stored without
+        being copied, so they must not be modified afterwards.
+        If the plot keeps the same number of points and data sets, only the
+        values that changed are sent to the browser (unless most of them did).
         """
-        self.plots[plot_idx].refresh(*args, **kwargs)
-        self._config['plots'][plot_idx] = self.plots[plot_idx].to_dict()
-        event = {
-            'type': 'refresh',
-            'idx': plot_idx,
-            'data': self._config['plots'][plot_idx],
-        }
-        event = json.dumps(event)
-        self._event_queue.put(event)
-        self._update_config()
+        plot = self.plots[plot_idx]
+        plot.refresh(*args, **kwargs)
+        start = self._metrics.start()
+        data = plot.last_patch()
+        if data is None:
+            event = {
+                'type': 'refresh',
+                'idx': plot_idx,
+                'data': plot.to_dict(),
+            }
+        else:
+            # Only send the values that changed
+            event = {
+                'type': 'patch',
+                'idx': plot_idx,
+                'data': data
+            }
+        self._metrics.stop('serialize', start)
+        self._send([event])
 
     def push(self, plot_idx, *args):
         """
@@ -225,15 +390,37 @@ class Pencil:
 
         """
         self.plots[plot_idx].push(*args)
-        self._config['plots'][plot_idx] = self.plots[plot_idx].to_dict()
-        event = {
-            'type': 'push',
-            'idx': plot_idx,
-            'data': self.plots[plot_idx].last_pushed()
-        }
-        event = json.dumps(event)
-        self._event_queue.put(event)
-        self._update_config()
+        self._send([self._push_event(plot_idx, 1)])
+
+    def push_many(self, plot_idx, *args):
+        """
+        Appends many data points to a plot at once. This is much faster than
+        calling `push` for each point, because all points are sent to the
+        browser with a single event.
+        Arguments:
+        - `index`: integer, zero-based index to select the plot to refresh (in
+        order of creation).
+        - `x, y1, ..., yn`: 1D lists or Numpy arrays of the same length, passed
+        as non-keyword arguments. You must pass an array for each data set in
+        the plot. If the plot has a single data set, `x` can be omitted and
+        will continue the integer sequence of the plot.
+        """
+        self.plots[plot_idx].push_many(*args)
+        self._send([self._push_event(plot_idx, len(args[0]))])
+
+    def push_plots(self, data):
+        """
+        Appends many data points to several plots at once, with a single
+        message to the server.
+        Arguments:
+        - `data`: dictionary that maps the index of each plot to a tuple
+        `(x, y1, ..., yn)` of 1D lists or Numpy arrays, as in `push_many`.
+        """
+        events = []
+        for plot_idx, args in data.items():
+            self.plots[plot_idx].push_many(*args)
+            events.append(self._push_event(plot_idx, len(args[0])))
+        self._send(events)
 
     def set_grid(self, grid=2):
         """
@@ -247,36 +434,201 @@ class Pencil:
         plots).
         """
         self.grid = grid
-        self._new_grid()
+        self._check_grid()
+        self._layout()
+
+    def remove(self, plot_idx):
+        """
+        Removes a plot from the grid. The plots that follow it move back by one
+        position in the grid, and their index decreases by one.
+        Arguments:
+        - `index`: integer, zero-based index to select the plot to remove (in
+        order of creation).
+        """
+        del self.plots[plot_idx]
+        self._check_grid()
+        event = {
+            'type': 'remove_plot',
+            'idx': plot_idx,
+            'grid': self._config['grid']
+        }
+        self._send([event])
 
     def browser(self):
         """
         Opens a new tab in the default browser at `host:port` as specified when
         creating the `Pencil` instance (default `0.0.0.0:8080`).
         """
-        webbrowser.open(self._server.get_endpoint(), new=0, autoraise=True)
+        import webbrowser
+        if self._server_args is None:
+            raise ValueError('Pencils created with connect() have no server to open.')
+        if self._server is None:
+            self._start()
+        url = 'http://{}:{}/'.format(self._server_args['host'], self._server_args['port'])
+        webbrowser.open(url, new=0, autoraise=True)
+
+    def flush(self, timeout=None):
+        """
+        Waits until all the updates have been sent to the server. This is only
+        needed with `async_send=True` or `AsyncPencil`, which buffer updates.
+        Arguments:
+        - `timeout` (default: `None`): maximum number of seconds to wait. If
+        `None`, waits until everything has been sent.
+        Returns `True` if everything was sent, `False` if the timeout expired.
+        """
+        if self._transport is None:
+            # Nothing was sent yet
+            return True
+        return self._transport.flush(timeout)
+
+    def stats(self):
+        """
+        Returns the metrics of this Pencil and of its server, as a dictionary:
+        - `counters`, `gauges` and `timers`: the metrics of this Pencil (see
+        `pncl.metrics.Metrics.to_dict`). The timers `serialize` (building the
+        updates from the plots) and `send` (handing them over to the transport,
+        including waiting for space in the buffer) and the counter
+        `events_sent` are only recorded with `metrics=True`. The gauges
+        `buffered`, `dropped` and `merged` are the number of updates in the
+        buffer of the background sender, dropped because it was full, and
+        merged with the previous push to the same plot.
+        - `server`: the metrics of the server (as served on
+        `/metrics?format=json`), or `None` if the Pencil was created with
+        `connect()`, the server was not started yet (there are no plots), or it
+        does not answer.
+        """
+        output = self._metrics.to_dict()
+        if isinstance(self._transport, BackgroundTransport):
+            output['gauges'].update({
+                'buffered': len(self._transport),
+                'dropped': self._transport.dropped,
+                'merged': self._transport.merged
+            })
+        output['server'] = None
+        if self._server is not None:
+            import urllib.request
+            host = self._server_args['host']
+            host = host if host not in ('0.0.0.0', '') else '127.0.0.1'
+            url = 'http://{}:{}/metrics?format=json'.format(host, self._server_args['port'])
+            try:
+                with urllib.request.urlopen(url, timeout=5) as response:
+                    output['server'] = json.loads(response.read().decode('utf-8'))
+            except OSError:
+                # The server is not running
+                pass
+        return output
 
     def stop(self):
         """
         Kills the Pencil backend server. After stopping Pencil, all plots will be lost
         if you close or refresh the page. This method is called automatically at
         the end of your script if setting `sticky=False` when creating the `Pencil`
-        instance.
+        instance. If the Pencil was created with `connect()`, only closes the
+        connection to the server, which keeps the plots. Calling it again does
+        nothing.
         """
-        self._server.stop()
+        if self._finalizer is None or not self._finalizer.still_active():
+            # Nothing was sent yet, or the Pencil was already stopped
+            return
+        self._finalizer.cancel()
+        self.flush()
+        if self._server is None:
+            # Connected to the server of another Pencil, which keeps the plots
+            self._transport.close()
+        else:
+            _terminate(self._server)
+            self._server = None
+
+    def _start(self):
+        """
+        Starts the server process, and opens the transport to it.
+        """
+        from pncl.encoders import get_encoder
+        # Invalid arguments raise here rather than in the server process
+        get_encoder(self._server_args['encoder'])
+        transport = self._server_transport
+        transport = transport if transport is not None else PipeTransport()
+        ready = Event()
+        self._server = Process(target=_serve, args=(transport, self._server_args, ready))
+        self._server.start()
+        transport.close_receiver()
+        # The page and the listen address can be used as soon as this returns
+        while not ready.wait(0.1):
+            if not self._server.is_alive():
+                self._server = None
+                raise RuntimeError('The Pencil server could not start (e.g., port {} or '
+                                   'the listen address is in use).'.format(self._server_args['port']))
+        self._open(transport)
+
+    def _open(self, transport):
+        """
+        Starts sending the updates through the given transport, beginning with
+        the layout of the grid.
+        """
+        if self._background:
+            transport = BackgroundTransport(transport, max_size=self._max_buffer,
+                                            policy=self._policy,
+                                            on_drop=functools.partial(_invalidate, self.plots))
+        self._transport = transport
+        # Unlike atexit, finalizers also run when a process started with
+        # multiprocessing terminates (e.g., a worker that called connect()).
+        # The finalizer must not hold the Pencil, so that it can be collected.
+        self._finalizer = Finalize(self, _exit, args=(self._server, transport, self.sticky),
+                                   exitpriority=10)
+        self._layout()
 
-    def _new_grid(self):
+    def _add_plot(self):
         self._check_grid()
+        plot_idx = len(self.plots) - 1
+        start = self._metrics.start()
+        event = {
+            'type': 'add_plot',
+            'idx': plot_idx,
+            'data': self.plots[plot_idx].to_dict(),
+            'grid': self._config['grid']
+        }
+        self._metrics.stop('serialize', start)
+        self._send([event])
+
+    def _layout(self):
+        if self._transport is None:
+            # Sent when the transport is opened
+            return
         event = {
-            'type': 'new_grid',
-            'data': self._config
+            'type': 'layout',
+            'data': dict(self._config)
         }
-        event = json.dumps(event)
-        self._event_queue.put(event)
-        self._update_config()
+        self._send([event])
+
+    def _push_event(self, plot_idx, n):
+        start = self._metrics.start()
+        data = self.plots[plot_idx].last_pushed(n)
+        if data is None:
+            # The points cannot be sent incrementally
+            event = {
+                'type': 'refresh',
+                'idx': plot_idx,
+                'data': self.plots[plot_idx].to_dict()
+            }
+        else:
+            event = {
+                'type': 'push',
+                'idx': plot_idx,
+                'data': data
+            }
+        self._metrics.stop('serialize', start)
+        return event
+
+    def _send(self, events):
+        if self._transport is None:
+            self._start()
+        start = self._metrics.start()
+        self._transport.send_many(events)
+        self._metrics.stop('send', start)
+        self._metrics.count('events_sent', len(events))
 
     def _check_grid(self):
-        n_plots = len(self._config['plots'])
+        n_plots = len(self.plots)
 
         if isinstance(self.grid, list):
             if sum(self.grid) < n_plots:
@@ -289,11 +641,122 @@ class Pencil:
                 self.grid for _ in range(ceil(n_plots / self.grid))
             ]
 
-    def _update_config(self):
-        # Empty the queue
-        while True:
-            try:
-                self._config_queue.get(block=False)
-            except:
-                break
-        self._config_queue.put(json.dumps(self._config))
+
+class AsyncPencil(Pencil):
+    _async_send = True
+    _max_buffer = 10000
+
+    def __init__(self, *args, max_buffer=10000, policy='block', **kwargs):
+        """
+        Version of `Pencil` for programs that run in an `asyncio` event loop
+        (e.g., training or serving loops). Updates are always sent by a
+        background thread, as with `async_send=True`, so all the methods of
+        `Pencil` can be used, and return without waiting for the server.
+        The coroutines `apush`, `apush_many`, `apush_plots` and `arefresh` do
+        the same as the corresponding methods, but if the buffer is full they
+        wait for space without blocking the event loop. Call `flush()` (or
+        `await aflush()`) before shutting down to make sure that all updates
+        were sent.
+        Arguments:
+        - `max_buffer` (default: `10000`): maximum number of updates in the
+        buffer. If `None`, the buffer is unbounded.
+        - `policy` (default: `'block'`): what to do when the buffer is full. If
+        `'block'`, new updates wait until there is space in the buffer. If
+        `'drop'`, new points pushed to the plots are dropped (the number of
+        dropped updates is available in `dropped`), while all other updates
+        are always sent. The next update of a plot that lost points sends the
+        whole plot.
+        All other arguments are the same as for `Pencil`. `AsyncPencil.connect()`
+        also creates an `AsyncPencil`, with the default buffer.
+        """
+        self._max_buffer = max_buffer
+        self._policy = policy
+        super().__init__(*args, **kwargs)
+
+    @property
+    def dropped(self):
+        """
+        Number of updates that were dropped because the buffer was full.
+        """
+        return self._transport.dropped if self._transport is not None else 0
+
+    async def apush(self, plot_idx, *args):
+        """
+        Same as `push`, but waits for space in the buffer without blocking the
+        event loop.
+        """
+        await self._wait_for_space()
+        self.push(plot_idx, *args)
+
+    async def apush_many(self, plot_idx, *args):
+        """
+        Same as `push_many`, but waits for space in the buffer without blocking
+        the event loop.
+        """
+        await self._wait_for_space()
+        self.push_many(plot_idx, *args)
+
+    async def apush_plots(self, data):
+        """
+        Same as `push_plots`, but waits for space in the buffer without
+        blocking the event loop.
+        """
+        await self._wait_for_space()
+        self.push_plots(data)
+
+    async def arefresh(self, plot_idx, *args, **kwargs):
+        """
+        Same as `refresh`, but waits for space in the buffer without blocking
+        the event loop.
+        """
+        await self._wait_for_space()
+        self.refresh(plot_idx, *args, **kwargs)
+
+    async def aflush(self, timeout=None):
+        """
+        Same as `flush`, without blocking the event loop.
+        """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.flush, timeout)
+
+    async def _wait_for_space(self):
+        if self._transport is None:
+            # Nothing was sent yet
+            return
+        if self._transport.policy == 'block' and self._transport.full():
+            import asyncio
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._transport.wait_for_space)
+
+
+def _invalidate(plots, event):
+    # The server is missing points of the plot, so its next update must send
+    # the whole plot
+    plots[event['idx']].invalidate()
+
+
+def _exit(server, transport, sticky):
+    """
+    Finalizer of a Pencil, called when the script terminates or the Pencil is
+    collected: stops the server (if it has one and is not sticky), or closes
+    the transport.
+    """
+    if server is not None and not sticky:
+        transport.flush()
+        _terminate(server)
+    else:
+        transport.close()
+
+
+def _terminate(server):
+    print("Shutting down Pencil backend")
+    server.terminate()
+
+
+def _serve(transport, kwargs, ready):
+    """
+    Target of the server process, which is the only one that imports aiohttp.
+    """
+    from pncl.server import Server
+    Server(**kwargs).run(transport, ready)
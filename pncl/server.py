@@ -1,106 +1,854 @@
 import asyncio
-import json
+import collections
+import gc
+import hashlib
+import mimetypes
 import os
-from multiprocessing import Process
+import re
+import threading
+import uuid
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
 
-from aiohttp import web
-from aiohttp_sse import sse_response
+from aiohttp import web, WSCloseCode, WSMsgType
+from aiohttp_sse import EventSourceResponse
 
 from pncl import STATIC_DIR
+from pncl.compression import CompressedBody, negotiate
+from pncl.encoders import get_encoder
+from pncl.log import EventLog
+from pncl.metrics import Metrics
+from pncl.state import Namespaces, State, merge_patches, merge_push
+from pncl.utils import to_binary, to_json
+
+
+class Hub:
+    def __init__(self, snapshot, max_size=256, replay_size=4096, replay_bytes=2 ** 24):
+        """
+        Broadcasts messages to all connected clients. Each client gets its own
+        bounded queue of batches, so that a slow client cannot block the others.
+        When the queue of a client is full, its pending batches are dropped and
+        replaced by a snapshot of the whole state, from which the client can
+        resync.
+        Clients receive either text (SSE) or binary (WebSocket) messages, and
+        each batch is only encoded for the kinds of clients that are connected.
+        Messages are numbered, and the last text messages are kept in a replay
+        buffer, so that a client that reconnects only receives the messages
+        that it missed (or a snapshot, if they are not in the buffer anymore).
+        The buffer is only filled while text clients are connected, and for a
+        while after the last one left or a client asked for the current ID
+        (see `event_id()`), until the messages that these clients may ask for
+        would be out of the buffer anyway. The rest of the time, no text is
+        encoded.
+        :param snapshot: function that takes `binary` and returns the snapshot
+        message.
+        :param max_size: maximum number of batches queued for each client.
+        :param replay_size: maximum number of messages in the replay buffer.
+        :param replay_bytes: maximum total length of the messages in the replay
+        buffer.
+        """
+        self.snapshot = snapshot
+        self.max_size = max_size
+        self.replay_size = replay_size
+        self.replay_bytes = replay_bytes
+        self.clients = {}  # Maps each queue to whether the client is binary
+        # Number of times that a slow client was resynced with a snapshot
+        self.resyncs = 0
+        # IDs are only valid for this instance, so a client that reconnects to
+        # a new server gets a snapshot
+        self._epoch = uuid.uuid4().hex[:8]
+        self._last_id = 0
+        self._replay = collections.deque()  # (id, message) tuples
+        self._replay_length = 0
+        # ID after which a text client that is not connected may ask for the
+        # messages, or None
+        self._keep_from = None
+
+    def event_id(self):
+        """
+        Returns the ID of the last message, and starts filling the replay
+        buffer (e.g., for a client that loaded the state, and will ask for
+        the messages after it).
+        """
+        self._keep_from = self._last_id
+        return self._format_id(self._last_id)
+
+    def subscribe(self, binary=False, last_id=None, resync=False):
+        """
+        Registers a new client and returns its queue. Each item of the queue is
+        a list of messages, and a `None` means that the client should
+        disconnect. Text messages are `(id, message)` tuples.
+        :param binary: whether the client receives binary messages.
+        :param last_id: the ID of the last message that the client received
+        (e.g., from the Last-Event-ID header, or the ID of the config that it
+        loaded). For text clients, the messages after it are queued
+        immediately. Binary messages are not kept, so binary clients get a
+        snapshot if they missed any message.
+        :param resync: whether to queue a snapshot immediately (e.g., for a
+        client that lost its connection, and cannot tell which messages it
+        missed since binary messages have no ID).
+        """
+        queue = asyncio.Queue(maxsize=self.max_size)
+        self.clients[queue] = binary
+        if resync or (binary and last_id is not None and last_id != self._format_id(self._last_id)):
+            queue.put_nowait([self._snapshot(binary)])
+        elif not binary:
+            if last_id is not None:
+                missed = self._missed(last_id)
+                if missed:
+                    queue.put_nowait(missed)
+        return queue
+
+    def unsubscribe(self, queue):
+        binary = self.clients.pop(queue, None)
+        if binary is False and not self._text_clients():
+            # The client may reconnect
+            self._keep_from = self._last_id
+
+    def publish(self, encode, n):
+        """
+        Sends a batch of messages to all clients.
+        :param encode: function that takes `binary` and returns the batch as a
+        list of strings (if False) or bytes (if True). It is called at most once
+        for each kind of client.
+        :param n: number of messages in the batch.
+        """
+        batches = {}
+        connected = self._text_clients()
+        if connected or self._keep_from is not None:
+            batches[False] = self._record(encode(False))
+            if not connected and (not self._replay or self._replay[0][0] > self._keep_from + 1):
+                # Clients that connect now get a snapshot anyway
+                self._keep_from = None
+        else:
+            # The replay buffer must not have gaps
+            self._replay.clear()
+            self._replay_length = 0
+            self._last_id += n
+        for queue, binary in self.clients.items():
+            if queue.full():
+                self._reset(queue, [self._snapshot(binary)])
+                self.resyncs += 1
+            else:
+                if binary not in batches:
+                    batches[binary] = encode(binary)
+                queue.put_nowait(batches[binary])
+
+    def close(self):
+        """
+        Disconnects all clients.
+        """
+        for queue in self.clients:
+            self._reset(queue, None)
+
+    def _record(self, messages):
+        # Numbers text messages and adds them to the replay buffer
+        output = []
+        for message in messages:
+            self._last_id += 1
+            output.append((self._format_id(self._last_id), message))
+            self._replay.append((self._last_id, message))
+            self._replay_length += len(message)
+        while self._replay and (len(self._replay) > self.replay_size
+                                or self._replay_length > self.replay_bytes):
+            self._replay_length -= len(self._replay.popleft()[1])
+        return output
+
+    def _text_clients(self):
+        return any(not binary for binary in self.clients.values())
+
+    def _missed(self, last_id):
+        # Messages after the given ID, or a snapshot if some are missing
+        epoch, _, n = last_id.partition('.')
+        try:
+            n = int(n)
+        except ValueError:
+            n = -1
+        if epoch == self._epoch and n == self._last_id:
+            return []
+        if epoch != self._epoch or not 0 <= n < self._last_id \
+                or not self._replay or self._replay[0][0] > n + 1:
+            return [self._snapshot(False)]
+        return [(self._format_id(i), m) for i, m in self._replay if i > n]
+
+    def _format_id(self, n):
+        return '{}.{}'.format(self._epoch, n)
+
+    def _snapshot(self, binary):
+        if binary:
+            return self.snapshot(True)
+        # The snapshot includes all the messages sent so far
+        return self._format_id(self._last_id), self.snapshot(False)
+
+    @staticmethod
+    def _reset(queue, item):
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(item)
 
 
 class Server:
-    def __init__(self, port=8080, host='0.0.0.0', events_per_second=1):
+    def __init__(self, port=8080, host='0.0.0.0', events_per_second=None,
+                 wire_format='points', encoder=None, websocket=False,
+                 listen=None, authkey=None, log_dir=None, metrics=False):
         """
         Creates the backend server.
         :param port: port on which aiohttp listens for requests.
         :param host: host on which to deploy the aiohttp app.
-        :param events_per_second: how many times per second to check for new SSE
-        event requests.
+        :param events_per_second: maximum number of times per second that new
+        events are sent to the clients. Events received in between are held
+        back and merged, so that each flush sends at most one message per plot.
+        If None, events are sent as soon as they arrive (events that arrive
+        together are still merged).
+        :param wire_format: format used to send data points to the browser, one
+        of 'points', 'columns' or 'base64' (see `pncl.plots.Points.encode`).
+        :param encoder: name of the JSON encoder, one of 'orjson', 'ujson' or
+        'json' (see `pncl.encoders.get_encoder`). If None, the fastest encoder
+        that is installed is used.
+        :param websocket: whether to serve binary messages on the /ws WebSocket
+        endpoint, in addition to SSE on /event. If 'deflate', messages are also
+        compressed with permessage-deflate when the browser supports it (this
+        costs more CPU than it saves bandwidth for most numeric data).
+        :param listen: address on which to accept connections from other
+        producers (see `pncl.transport.SocketTransport`), either a
+        `(host, port)` tuple or the path of a Unix socket. If None, only
+        events from the transport passed to `start()` are received.
+        :param authkey: bytes, secret key that producers must use to connect.
+        :param log_dir: directory in which to keep a persistent log of the
+        events (see `pncl.log.EventLog`). When the server starts, it restores
+        the plots from the log; the plots of the previous run are shown after
+        the new ones. If None, the plots only live in memory.
+        :param metrics: whether to record the counters and timers of each
+        stage (see `pncl.metrics.Metrics`), which are served on /metrics with
+        the gauges of the clients. If False, /metrics only has the gauges.
         """
         # Config
         self.port = port
         self.host = host
         self.events_per_second = events_per_second
+        self.wire_format = wire_format
+        self.encoder = get_encoder(encoder)
+        self.websocket = websocket
+        # Maximum number of messages sent to a WebSocket client before it acks
+        self.websocket_window = 64
+        # Maximum number of points returned by /data for each dataset
+        self.max_range_points = 100000
 
         # Multiprocessing
-        self._p = None
-        self._event_queue = None
-        self._config_queue = None
-        self._config = None
+        self._transport = None
+        self.listen = listen
+        self.authkey = authkey
+        self._listener = None
+        self.log_dir = log_dir
+        self._log = None
+
+        # Plots state and connected clients
+        self._state = State(wire_format, self.encoder)
+        self._namespaces = Namespaces()
+        self._hub = Hub(self._snapshot)
+        self._websockets = set()
+        self._pending = []
+        # Bodies of the responses, compressed once for all clients
+        self._epoch = uuid.uuid4().hex[:8]
+        self._config_body = None
+        self._index_body = None
+        self._static_cache = {}
+        # The static files do not change while the server runs
+        self._static_names = frozenset(os.listdir(STATIC_DIR))
+        self._flush_handle = None
+        self._last_flush = 0
+        self.metrics = Metrics(metrics)
+        self._n_clients = 0
 
         # App
         self._app = web.Application()
         self._app.add_routes([
             web.get('/config', self._get_config),  # Endpoint for getting config
+            web.get('/config/{idx}', self._get_plot),  # Endpoint for getting a plot
+            web.get('/data/{idx}', self._get_data),    # Endpoint for zooming a plot
             web.get('/event', self._event),        # Endpoint for EventSource
+            web.get('/metrics', self._get_metrics),  # Endpoint for Prometheus
             web.get('/', self._index),             # Called by View to get index
-            web.static('/', STATIC_DIR),           # Serves static files (.js, .png, .css, etc)
         ])
+        if self.websocket:
+            self._app.router.add_get('/ws', self._ws)  # Endpoint for WebSocket
+        # Serves static files (.js, .png, .css, etc)
+        self._app.router.add_get('/{name}', self._static)
+        self._app.on_startup.append(self._attach_transport)
+        if self.listen is not None:
+            self._app.on_startup.append(self._start_listener)
+        self._app.on_shutdown.append(self._close_clients)
+
+    def run(self, transport, ready=None):
+        """
+        Runs the backend server in the current process, until it is
+        terminated.
+        :param transport: pncl.transport.Transport object, used to receive the
+        events from Pencil.
+        :param ready: multiprocessing.Event, set once the server accepts
+        connections from browsers (and from producers, if `listen` is given).
+        """
+        self._transport = transport
+        # The server only reads from the transport
+        self._transport.close()
+        if self.log_dir is not None:
+            self._restore()
+        # Unlike web.run_app, the runner lets the server signal that the port
+        # is bound
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(self._app)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, self.host, self.port).start())
+        print('======== Running on http://{}:{} ========'.format(self.host, self.port))
+        if ready is not None:
+            ready.set()
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(runner.cleanup())
+
+    def _restore(self):
+        """
+        Rebuilds the state from the snapshot and the messages in the log.
+        """
+        self._log = EventLog(self.log_dir)
+        snapshot, messages = self._log.load()
+        if snapshot is not None:
+            self._state.config, self._namespaces = snapshot
+        # Replaying creates many small objects, which would trigger the
+        # garbage collector over and over
+        gc.disable()
+        try:
+            events = []
+            for name, seq, batch in messages:
+                events.extend(self._translate(name, seq, batch))
+                if len(events) >= 10000:
+                    self._state.apply_many(events)
+                    events = []
+            self._state.apply_many(events)
+        finally:
+            gc.enable()
+        # The new Pencil starts from an empty grid, before the restored plots
+        self._namespaces.retire(None)
+        self._log.snapshot((self._state.config, self._namespaces))
+
+    async def _attach_transport(self, app):
+        self._transport.attach(asyncio.get_event_loop(), self._on_events)
+
+    async def _start_listener(self, app):
+        if isinstance(self.listen, str) and os.path.exists(self.listen):
+            # Left behind by a server that was terminated
+            os.unlink(self.listen)
+        self._listener = Listener(self.listen, authkey=self.authkey)
+        loop = asyncio.get_event_loop()
+        threading.Thread(target=self._accept, args=(loop,), daemon=True).start()
+
+    def _accept(self, loop):
+        """
+        Accepts connections from producers, and reads each of them in its own
+        thread.
+        """
+        while True:
+            try:
+                conn = self._listener.accept()
+            except AuthenticationError:
+                continue
+            except OSError:
+                # The listener was closed
+                break
+            threading.Thread(target=self._read, args=(conn, loop), daemon=True).start()
+
+    def _read(self, conn, loop):
+        """
+        Reads the messages of a producer, and passes all the messages that are
+        available at once to the event loop.
+        """
+        messages = []
+        try:
+            while True:
+                messages.append(conn.recv())
+                if len(messages) == 1024 or not conn.poll():
+                    loop.call_soon_threadsafe(self._on_messages, messages)
+                    messages = []
+        except (EOFError, OSError):
+            # The producer has disconnected (poll() is also True at the end of
+            # the stream, so some messages may not have been passed yet)
+            conn.close()
+        if messages:
+            loop.call_soon_threadsafe(self._on_messages, messages)
+
+    async def _close_clients(self, app):
+        if self._listener is not None:
+            self._listener.close()
+        if self._log is not None:
+            self._log.snapshot((self._state.config, self._namespaces))
+            self._log.close()
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._hub.close()
+        for ws in list(self._websockets):
+            await ws.close(code=WSCloseCode.GOING_AWAY)
 
-    def _main(self, event_queue, config_queue):
+    def _on_events(self, events):
         """
-        Main runner for the backend.
+        Called by the transport when new events arrive from Pencil. Applies the
+        events to the state and schedules sending them to the clients.
         """
-        self._event_queue = event_queue
-        self._config_queue = config_queue
-        web.run_app(self._app, host=self.host, port=self.port)
+        self._receive([(None, None, events)])
+
+    def _on_messages(self, messages):
+        """
+        Called when new messages arrive from the producers connected to
+        `listen`, as `(name, seq, events)` tuples. The messages are handled
+        like events from Pencil.
+        """
+        self._receive(messages)
+
+    def _translate(self, name, seq, events):
+        """
+        Moves the events of a producer to its own plots (see
+        `pncl.state.Namespaces`). The owner of the server has no name and no
+        sequence numbers.
+        """
+        if name is None:
+            return [self._namespaces.translate(None, event) for event in events]
+        return self._namespaces.receive(name, seq, events)
+
+    def _receive(self, messages):
+        events = []
+        for name, seq, batch in messages:
+            if self._log is not None:
+                # Log the messages as received, they are replayed the same way
+                self._log.append((name, seq, batch))
+            events.extend(self._translate(name, seq, batch))
+        for event in events:
+            if self._pending and (event['type'] == 'remove_plot' or (
+                    event['type'] == 'add_plot' and event['idx'] < len(self._state.config['plots']))):
+                # The pending events refer to the plots before they moved
+                self._flush()
+            self._state.apply(event)
+            self._pending.append(event)
+        self.metrics.count('events_received', len(events))
+        if self._flush_handle is None:
+            loop = asyncio.get_event_loop()
+            delay = 0
+            if self.events_per_second:
+                delay = max(0, self._last_flush + 1 / self.events_per_second - loop.time())
+            self._flush_handle = loop.call_later(delay, self._flush)
+
+    def _flush(self):
+        """
+        Sends all pending events to the connected clients.
+        """
+        start = self.metrics.start()
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._last_flush = asyncio.get_event_loop().time()
+        # The state already includes all pending events, so a client that is
+        # too slow to receive them can resync from a snapshot instead.
+        events = self._coalesce(self._pending)
+        self.metrics.count('events_merged', len(self._pending) - len(events))
+        self.metrics.count('messages_sent', len(events))
+        self._hub.publish(lambda binary: self._encode(events, binary), len(events))
+        self._pending = []
+        if self._log is not None:
+            self._log.flush()
+            if self._log.full():
+                self._log.snapshot((self._state.config, self._namespaces))
+        self.metrics.stop('flush', start)
+
+    def _coalesce(self, events):
+        """
+        Merges the given events into at most one message per plot:
+        - a new_grid supersedes all other events, and is replaced with a
+        snapshot of the state;
+        - removed plots are sent first, followed by a single layout message if
+        the layout changed;
+        - an add_plot or a refresh supersedes all other events for the same
+        plot, and is sent with the current state of the plot;
+        - consecutive pushes to the same plot are concatenated;
+        - consecutive patches to the same plot are merged;
+        - any other combination of events for the same plot is replaced by a
+        refresh.
+        Since all events have already been applied to the state, the state can
+        be used directly for the superseding messages. Plots are only removed,
+        or inserted before other plots, at the start of a batch (see
+        `_receive`), so that the indices of all other events refer to the
+        current state.
+        :param events: list of events, in order of arrival.
+        :return: list of events.
+        """
+        if any(event['type'] == 'new_grid' for event in events):
+            return [{'type': 'new_grid', 'data': self._state.config}]
+
+        output = [event for event in events if event['type'] == 'remove_plot']
+        if any(event['type'] == 'layout' for event in events):
+            output.append({
+                'type': 'layout',
+                'data': {key: self._state.config[key] for key in ('grid', 'height')}
+            })
+
+        merged = {}  # Ordered by first event for each plot
+        for event in events:
+            if event['type'] in ('remove_plot', 'layout'):
+                continue
+            idx = event['idx']
+            previous = merged.get(idx)
+            plot = self._state.config['plots'][idx]
+            if previous is not None and previous['type'] == 'add_plot':
+                # The new plot is sent with its current state
+                pass
+            elif previous is None or event['type'] == 'refresh':
+                merged[idx] = event
+            elif previous['type'] == event['type'] == 'push':
+                merge_push(previous['data'], event['data'], plot.get('max_points'))
+            elif previous['type'] == event['type'] == 'patch':
+                previous['data'] = merge_patches(plot, previous['data'], event['data'])
+            else:
+                # Different kinds of changes, send the whole plot
+                merged[idx] = {'type': 'refresh', 'idx': idx}
+
+        for idx, event in merged.items():
+            if event['type'] == 'add_plot':
+                event = {
+                    'type': 'add_plot',
+                    'idx': idx,
+                    'data': self._state.config['plots'][idx],
+                    'grid': self._state.config['grid']
+                }
+            elif event['type'] == 'refresh':
+                event = {
+                    'type': 'refresh',
+                    'idx': idx,
+                    'data': self._state.config['plots'][idx]
+                }
+            output.append(event)
+        return output
+
+    def _encode(self, events, binary):
+        """
+        Encodes the given events as text (JSON) or binary messages.
+        """
+        start = self.metrics.start()
+        messages = []
+        for event in events:
+            if event['type'] == 'new_grid':
+                messages.append(self._snapshot(binary))
+            elif binary:
+                messages.append(to_binary(event, self.encoder))
+            else:
+                messages.append(to_json(event, self.wire_format, self.encoder))
+        self.metrics.stop('encode', start, 'format="{}"'.format('binary' if binary else 'text'))
+        return messages
+
+    def _snapshot(self, binary=False):
+        """
+        Returns a new_grid message with the whole state.
+        """
+        if binary:
+            return to_binary({'type': 'new_grid', 'data': self._state.config}, self.encoder)
+        return '{{"type": "new_grid", "data": {}}}'.format(self._state.to_json())
+
+    async def _respond(self, request, body, content_type, etag=None, cache_control=None,
+                       headers=None, charset='utf-8'):
+        """
+        Sends a response, compressed with the best content coding that the
+        client accepts. If the client already has the version with the given
+        ETag, replies with 304 Not Modified instead.
+        :param body: `pncl.compression.CompressedBody` object.
+        :param content_type: MIME type of the body.
+        :param etag: quoted ETag of the body, or None. Each content coding of
+        the body gets its own ETag, with the coding as a suffix.
+        :param cache_control: value of the Cache-Control header, or None.
+        :param headers: dictionary of other headers.
+        :param charset: charset of the body, or None for binary files.
+        """
+        headers = dict(headers or {})
+        # The response depends on the codings that the client accepts
+        headers['Vary'] = 'Accept-Encoding'
+        coding = negotiate(request.headers.get('Accept-Encoding', ''))
+        if etag is not None:
+            etag = _coded_etag(etag, coding)
+            headers['ETag'] = etag
+        if cache_control is not None:
+            headers['Cache-Control'] = cache_control
+        if etag is not None and _etag_matches(request.headers.get('If-None-Match'), etag):
+            return web.Response(status=304, headers=headers)
+        if body.is_cached(coding):
+            coding, data = body.get(coding)
+        else:
+            # Compressing a large body would block the event loop
+            loop = asyncio.get_event_loop()
+            coding, data = await loop.run_in_executor(None, body.get, coding)
+        if coding is not None:
+            headers['Content-Encoding'] = coding
+        return web.Response(body=data, content_type=content_type, charset=charset, headers=headers)
 
     async def _index(self, request):
         """
-        Callback for GET on /
+        Callback for GET on /. The page links the static files with their
+        version (e.g., `main.js?v=<hash>`), so that the browser can cache them
+        for as long as the page does not change.
+        """
+        if self._index_body is None:
+            with open(os.path.join(STATIC_DIR, 'index.html'), 'rb') as f:
+                html = f.read().decode('utf-8')
+
+            def versioned(match):
+                name = match.group(3)
+                if name not in self._static_names:
+                    return match.group(0)
+                _, _, etag = self._static_file(name)
+                return '{}="{}{}?v={}"'.format(match.group(1), match.group(2) or '', name, etag.strip('"'))
+
+            html = re.sub(r'(src|href)="(\./|/)?([\w.-]+)"', versioned, html)
+            self._index_body = CompressedBody(html.encode('utf-8'))
+        body = self._index_body
+        return await self._respond(request, body, 'text/html', _etag(body.data), 'no-cache')
+
+    async def _static(self, request):
+        """
+        Callback for GET on the static files. Files requested with the version
+        that the page links to are cached forever by the browser, the others
+        are revalidated with their ETag.
         """
-        return web.FileResponse(os.path.join(STATIC_DIR, 'index.html'))
+        name = request.match_info['name']
+        if name not in self._static_names:
+            raise web.HTTPNotFound()
+        body, content_type, etag = self._static_file(name)
+        if request.query.get('v') == etag.strip('"'):
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'no-cache'
+        charset = 'utf-8' if content_type.startswith('text/') else None
+        return await self._respond(request, body, content_type, etag, cache_control, charset=charset)
+
+    def _static_file(self, name):
+        # Static files are read once, and compressed once for each coding
+        if name not in self._static_cache:
+            with open(os.path.join(STATIC_DIR, name), 'rb') as f:
+                data = f.read()
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            self._static_cache[name] = (CompressedBody(data), content_type, _etag(data))
+        return self._static_cache[name]
 
     async def _get_config(self, request):
         """
-        Calback for GET on /config
+        Calback for GET on /config. The config of each version of the state
+        is compressed once, and has its own ETag.
         """
-        return web.Response(text=self._config)
+        if self._pending:
+            # The config must not include events that were not sent yet
+            self._flush()
+        headers = {
+            # Tells the browser whether it can connect to /ws
+            'X-Pncl-Websocket': '1' if self.websocket else '0',
+            # The ID of the last event included in the config
+            'X-Pncl-Event-Id': self._hub.event_id()
+        }
+        version = self._state.version
+        if self._config_body is None or self._config_body[0] != version:
+            self._config_body = version, CompressedBody(self._state.to_json().encode('utf-8'))
+        etag = '"{}.{}"'.format(self._epoch, version)
+        return await self._respond(request, self._config_body[1], 'text/plain', etag, 'no-cache', headers)
 
-    async def _event(self, request):
+    async def _get_plot(self, request):
         """
-        Callback for SSE GET on /event
+        Callback for GET on /config/{idx}. Returns the config of a single
+        plot. The `start` and `stop` query parameters select a range of
+        points, as in a Python slice (e.g., `?start=-1000` returns the last
+        1000 points), and only that range is read from the log.
         """
-        loop = request.app.loop
-        async with sse_response(request) as resp:
-            while True:
-                while True:
-                    try:
-                        event = self._event_queue.get(block=False)
-                        await resp.send(event)
-                    except:
-                        break
-                try:
-                    new_config = self._config_queue.get(block=False)
-                    if new_config:
-                        self._config = new_config
-                except:
-                    pass
+        try:
+            idx = int(request.match_info['idx'])
+            start, stop = (request.query.get(key) for key in ('start', 'stop'))
+            plot = self._state.get_plot(
+                idx,
+                int(start) if start is not None else None,
+                int(stop) if stop is not None else None
+            )
+        except (ValueError, IndexError):
+            raise web.HTTPNotFound()
+        text = to_json(plot, self.wire_format, self.encoder)
+        return await self._respond(request, CompressedBody(text.encode('utf-8')), 'application/json')
+
+    async def _get_data(self, request):
+        """
+        Callback for GET on /data/{idx}. Returns about `points` representative
+        points of each dataset of a line or scatter plot, between the `xmin`
+        and `xmax` query parameters (see `pncl.state.State.get_range`), in the
+        format of the `data` of a push event. The browser uses it to show the
+        details of a plot when zooming in. Replies with 400 Bad Request for
+        plots that do not have numeric x and y values.
+        """
+        try:
+            idx = int(request.match_info['idx'])
+            x_min, x_max = (request.query.get(key) for key in ('xmin', 'xmax'))
+            data = self._state.get_range(
+                idx,
+                float(x_min) if x_min is not None else None,
+                float(x_max) if x_max is not None else None,
+                min(max(int(request.query.get('points', 1000)), 2), self.max_range_points)
+            )
+        except IndexError:
+            raise web.HTTPNotFound()
+        except ValueError as e:
+            # Invalid parameters, or a plot without numeric x and y values
+            raise web.HTTPBadRequest(text=str(e))
+        text = to_json(data, self.wire_format, self.encoder)
+        return await self._respond(request, CompressedBody(text.encode('utf-8')), 'application/json')
 
-                data = json.dumps('NOP')
-                await resp.send(data)
-                await asyncio.sleep(1 / self.events_per_second, loop=loop)
+    def _client_labels(self, transport):
+        # Labels of the metrics of a new client
+        self._n_clients += 1
+        return 'client="{}",transport="{}"'.format(self._n_clients, transport)
 
-    def start(self, event_queue, config_queue):
+    async def _get_metrics(self, request):
         """
-        Starts the backend server.
-        :param event_queue: multiprocessing.Manager.Queue object
-        :param config_queue: multiprocessing.Manager.Queue object
+        Callback for GET on /metrics. Returns the metrics of the server in the
+        Prometheus text format, or as JSON with `?format=json` (see
+        `pncl.metrics.Metrics`). Besides the metrics recorded when `metrics`
+        is True, it always has the gauges of the connected clients and of
+        their queues.
         """
-        self._p = Process(target=self._main, args=(event_queue, config_queue))
-        self._p.start()
+        metrics = Metrics()
+        metrics.counters = dict(self.metrics.counters)
+        metrics.timers = dict(self.metrics.timers)
+        metrics.count('client_resyncs', self._hub.resyncs)
+        for binary, transport in ((False, 'sse'), (True, 'ws')):
+            depths = [queue.qsize() for queue, b in self._hub.clients.items() if b == binary]
+            labels = 'transport="{}"'.format(transport)
+            metrics.set('clients', len(depths), labels)
+            # Batches waiting to be sent, in total and for the slowest client
+            metrics.set('queued_batches', sum(depths), labels)
+            metrics.set('max_queued_batches', max(depths, default=0), labels)
+        metrics.set('pending_events', len(self._pending))
+        metrics.set('plots', len(self._state.config['plots']))
+        if request.query.get('format') == 'json':
+            return web.json_response(metrics.to_dict())
+        return web.Response(text=metrics.to_prometheus(), content_type='text/plain',
+                            headers={'Cache-Control': 'no-store'})
 
-    def stop(self):
+    async def _event(self, request):
         """
-        Kills the backend server.
+        Callback for SSE GET on /event. Each message has an ID, and a client
+        that reconnects with the Last-Event-ID header (or the `last_id` query
+        parameter, e.g., with the ID of the config that it loaded) first
+        receives the messages that it missed. A client that cannot tell which
+        messages it missed (e.g., after its WebSocket closed) connects with the
+        `resync` query parameter, and first receives a snapshot.
         """
-        print("Shutting down Pencil backend")
-        self._p.terminate()
+        if self._pending:
+            # A snapshot sent to resync the client must match the IDs
+            self._flush()
+        last_id = request.headers.get('Last-Event-ID', request.query.get('last_id'))
+        # The EventSource reconnects to the same URL, with the Last-Event-ID
+        resync = last_id is None and 'resync' in request.query
+        queue = self._hub.subscribe(last_id=last_id, resync=resync)
+        labels = self._client_labels('sse')
+        resp = EventSourceResponse()
+        try:
+            await resp.prepare(request)
+            async with resp:
+                while True:
+                    messages = await queue.get()
+                    if messages is None:
+                        break
+                    for event_id, data in messages:
+                        start = self.metrics.start()
+                        await resp.send(data, id=event_id)
+                        self.metrics.stop('send', start, labels)
+                        self.metrics.count('bytes_sent', len(data), 'transport="sse"')
+        except ConnectionResetError:
+            # The client has disconnected
+            pass
+        finally:
+            self._hub.unsubscribe(queue)
+            self.metrics.remove(labels)
+        return resp
 
-    def get_endpoint(self, name=None):
+    async def _ws(self, request):
         """
-        Returns full http path for the given endpoint.
-        :param name: string (if None, returns path for /)
+        Callback for WebSocket GET on /ws. Messages are sent as binary frames
+        (see `pncl.utils.to_binary`), compressed with permessage-deflate if
+        enabled and supported by the browser. The browser acks each message once it has applied
+        it, and at most `websocket_window` messages can be waiting for an ack:
+        if the browser falls behind, its queue fills up and it is resynced like
+        a slow SSE client. The browser passes the ID of the config that it
+        loaded in the `last_id` query parameter, and first receives a snapshot
+        if messages were sent since. A browser that reconnects after losing its
+        socket sets the `resync` query parameter, and also receives a snapshot.
         """
-        return 'http://{}:{}/{}'.format(self.host, self.port, name if name else '')
+        ws = web.WebSocketResponse(compress=self.websocket == 'deflate')
+        await ws.prepare(request)
+        if self._pending:
+            # A snapshot sent to the client must not miss the pending events
+            self._flush()
+        queue = self._hub.subscribe(binary=True, last_id=request.query.get('last_id'),
+                                    resync='resync' in request.query)
+        window = asyncio.Semaphore(self.websocket_window)
+        labels = self._client_labels('ws')
+        sender = asyncio.ensure_future(self._ws_send(ws, queue, window, labels))
+        self._websockets.add(ws)
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT and msg.data == 'ack':
+                    window.release()
+        finally:
+            sender.cancel()
+            self._websockets.discard(ws)
+            self._hub.unsubscribe(queue)
+            self.metrics.remove(labels)
+        return ws
+
+    async def _ws_send(self, ws, queue, window, labels):
+        try:
+            while True:
+                messages = await queue.get()
+                if messages is None:
+                    break
+                for data in messages:
+                    await window.acquire()
+                    start = self.metrics.start()
+                    await ws.send_bytes(data)
+                    self.metrics.stop('send', start, labels)
+                    self.metrics.count('bytes_sent', len(data), 'transport="ws"')
+            await ws.close()
+        except ConnectionResetError:
+            # The client has disconnected
+            pass
+
+
+def _etag(data):
+    """
+    Returns a strong ETag for the given bytes.
+    """
+    return '"{}"'.format(hashlib.sha1(data).hexdigest()[:16])
+
+
+def _coded_etag(etag, coding):
+    """
+    Returns the ETag of a content coding of a body (strong ETags must differ
+    between the codings, since their bytes differ).
+    :param etag: quoted ETag of the body.
+    :param coding: one of `pncl.compression.CODINGS`, or None.
+    """
+    return etag if coding is None else '{}-{}"'.format(etag[:-1], coding)
+
+
+def _etag_matches(if_none_match, etag):
+    """
+    Returns True if the If-None-Match header of a request matches the given
+    ETag, with the weak comparison that the header requires.
+    :param if_none_match: value of the header, or None.
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(','))
+    return any((tag[2:] if tag.startswith('W/') else tag) == etag for tag in tags)
@@ -0,0 +1,433 @@
+import weakref
+
+import numpy as np
+
+from pncl.decimation import MinMaxPyramid
+from pncl.plots import Points, RingBuffer
+from pncl.utils import to_json
+
+
+class State:
+    def __init__(self, wire_format='points', encoder=None):
+        """
+        Authoritative copy of the plots shown in the browser, kept by the
+        backend server. The state is built by applying the same events that are
+        sent to the browser, and every change increments `version`.
+        The JSON config served on /config is only rendered when requested, and
+        is cached until the next change.
+        :param wire_format: format used to encode the data points in JSON (see
+        `pncl.plots.Points.encode`).
+        :param encoder: `pncl.encoders.Encoder` used to render the JSON config.
+        If None, the fastest encoder that is installed is used.
+        """
+        self.wire_format = wire_format
+        self.encoder = encoder
+        self.version = 0
+        self.config = {
+            'grid': [],
+            'height': 300,
+            'plots': []
+        }
+        self._json = None
+        self._json_version = None
+        # Min/max pyramids of the datasets that were queried with get_range()
+        self._pyramids = weakref.WeakKeyDictionary()
+
+    def apply(self, event):
+        """
+        Updates the state with the given event.
+        :param event: dictionary, as created by Pencil.
+        """
+        if event['type'] == 'new_grid':
+            self.config = event['data']
+            for plot in self.config['plots']:
+                _use_rings(plot)
+        elif event['type'] == 'refresh':
+            self.config['plots'][event['idx']] = _use_rings(event['data'])
+        elif event['type'] == 'push':
+            plot = self.config['plots'][event['idx']]
+            if 'replace' in event['data'] or plot.get('max_points') is not None:
+                # Points are removed, not only appended
+                self._drop_pyramids(plot)
+            merge_push(plot['data'], event['data'], plot.get('max_points'))
+        elif event['type'] == 'patch':
+            self._drop_pyramids(self.config['plots'][event['idx']])
+            apply_patch(self.config['plots'][event['idx']], event['data'])
+        elif event['type'] == 'add_plot':
+            self.config['plots'].insert(event['idx'], _use_rings(event['data']))
+            self.config['grid'] = event['grid']
+        elif event['type'] == 'remove_plot':
+            del self.config['plots'][event['idx']]
+            self.config['grid'] = event['grid']
+        elif event['type'] == 'layout':
+            self.config.update(event['data'])
+        else:
+            return
+        self.version += 1
+
+    def apply_many(self, events):
+        """
+        Updates the state with many events at once (e.g., when replaying a
+        log). Consecutive pushes to the same plot are concatenated and applied
+        as one, which is much faster than applying them one by one.
+        :param events: list of events.
+        """
+        pushes = {}
+        for event in events:
+            if event['type'] == 'push' and 'replace' not in event['data']:
+                pushes.setdefault(event['idx'], []).append(event['data'])
+            else:
+                # The other events may depend on the pushed points
+                self._apply_pushes(pushes)
+                self.apply(event)
+        self._apply_pushes(pushes)
+
+    def _apply_pushes(self, pushes):
+        for idx, data in pushes.items():
+            self.apply({'type': 'push', 'idx': idx, 'data': concat_pushes(data)})
+        pushes.clear()
+
+    def get_plot(self, idx, start=None, stop=None):
+        """
+        Returns the config of a plot with only the points between `start` and
+        `stop` (as in a Python slice). The points are sliced without copying
+        the other points, so memory-mapped data is only read for the range.
+        :param idx: index of the plot.
+        """
+        plot = self.config['plots'][idx]
+        key = slice(start, stop)
+        data = dict(plot['data'])
+        if data['labels'] is not None:
+            data['labels'] = data['labels'][key]
+        data['datasets'] = []
+        for dataset in plot['data']['datasets']:
+            n = len(dataset['data'])
+            # Slice the data and any other per-point list (e.g., colors)
+            data['datasets'].append({
+                k: _slice(v, key) if _is_column(k, v, n) else v
+                for k, v in dataset.items()
+            })
+        output = dict(plot)
+        output['data'] = data
+        return output
+
+    def get_range(self, idx, x_min=None, x_max=None, n=1000):
+        """
+        Returns about `n` representative points of each dataset of a plot, for
+        the range of x between `x_min` and `x_max` (see
+        `pncl.decimation.MinMaxPyramid.query`), in the format of the `data` of
+        a push event. The pyramid of each dataset is built the first time that
+        the plot is queried, and then updated with the points pushed since the
+        previous query.
+        :param idx: index of the plot. Only plots with x and y values (line and
+        scatter plots) are supported.
+        """
+        output = {
+            'labels': None,
+            'datasets': []
+        }
+        plot = self.config['plots'][idx]
+        for dataset in plot['data']['datasets']:
+            points = dataset['data']
+            if not isinstance(points, Points) or plot['data']['labels'] is not None:
+                raise ValueError('Only line and scatter plots support ranges.')
+            if points not in self._pyramids:
+                self._pyramids[points] = MinMaxPyramid()
+            x, y = points.x.array(), points.y.array()
+            if x.dtype.kind not in 'biuf' or y.dtype.kind not in 'biuf':
+                # E.g., string labels or None values pushed to a line plot
+                raise ValueError('Only numeric values support ranges.')
+            sel = self._pyramids[points].query(x, y, x_min, x_max, n)
+            output['datasets'].append({'data': points.take(sel)})
+        return output
+
+    def _drop_pyramids(self, plot):
+        for dataset in plot['data']['datasets']:
+            if isinstance(dataset['data'], Points):
+                self._pyramids.pop(dataset['data'], None)
+
+    def to_json(self):
+        """
+        Returns the JSON config for the current version of the state.
+        """
+        if self._json_version != self.version:
+            self._json = to_json(self.config, self.wire_format, self.encoder)
+            self._json_version = self.version
+        return self._json
+
+
+class Namespaces:
+    def __init__(self):
+        """
+        Maps the plots of many producers (Pencil instances) to a single
+        dashboard. Each producer numbers its plots from zero and computes its
+        own grid, as if it were alone: the plots of each producer are placed
+        after those of the producers that connected before it, and the grid of
+        the dashboard is made of the rows of all the producers, in the same
+        order. The owner of the server is the producer named None, and is
+        always first.
+        Producers number their messages, and messages are translated in that
+        order (out-of-order messages are held back, and duplicates dropped).
+        """
+        self.names = [None]
+        self.counts = {None: 0}
+        self.grids = {None: []}
+        self._next = {}
+        self._held = {}
+        self._retired = 0
+
+    def receive(self, name, seq, events):
+        """
+        Translates a message from a producer to events for the dashboard.
+        :param name: name of the producer.
+        :param seq: sequence number of the message. A producer starts from 0
+        when it connects, which replaces the plots of a previous producer with
+        the same name.
+        :param events: list of events, as created by Pencil.
+        :return: list of events, in the order in which they must be applied
+        (empty if the message is held back).
+        """
+        output = []
+        if seq == 0:
+            output.extend(self.reset(name))
+        elif seq < self._next.get(name, 0):
+            return output
+        self._held.setdefault(name, {})[seq] = events
+        held = self._held[name]
+        while self._next.get(name, 0) in held:
+            for event in held.pop(self._next[name]):
+                output.append(self.translate(name, event))
+            self._next[name] += 1
+        return output
+
+    def reset(self, name):
+        """
+        Removes all the plots of a producer.
+        :return: list of remove_plot events.
+        """
+        self._next[name] = 0
+        self._held[name] = {}
+        events = []
+        for idx in reversed(range(self.counts.get(name, 0))):
+            # The rows of the producer are removed with its last plot
+            grid = self.grids[name] if idx else []
+            events.append(self.translate(name, {'type': 'remove_plot', 'idx': idx, 'grid': grid}))
+        if self.grids.get(name):
+            events.append(self.translate(name, {'type': 'layout', 'data': {'grid': []}}))
+        return events
+
+    def retire(self, name):
+        """
+        Moves the plots of a producer to a new namespace, which no producer
+        uses, right after its own. The producer starts again with no plots,
+        while the old plots keep their place in the dashboard (e.g., the plots
+        of a previous run restored from a log).
+        """
+        if not self.counts.get(name) and not self.grids.get(name):
+            return
+        retired = ('retired', self._retired)
+        self._retired += 1
+        self.names.insert(self.names.index(name) + 1, retired)
+        self.counts[retired], self.counts[name] = self.counts[name], 0
+        self.grids[retired], self.grids[name] = self.grids[name], []
+        self._next.pop(name, None)
+        self._held.pop(name, None)
+
+    def translate(self, name, event):
+        """
+        Converts the plot indices and grid of an event from the namespace of a
+        producer to the dashboard (the event is modified in place).
+        :return: the event.
+        """
+        if name not in self.counts:
+            self.names.append(name)
+            self.counts[name] = 0
+            self.grids[name] = []
+        if event['type'] == 'add_plot':
+            self.counts[name] += 1
+        elif event['type'] == 'remove_plot':
+            self.counts[name] -= 1
+        if 'grid' in event:
+            self.grids[name] = event['grid']
+            event['grid'] = self.grid()
+        elif event['type'] == 'layout':
+            self.grids[name] = event['data']['grid']
+            data = {'grid': self.grid()}
+            if name is None and 'height' in event['data']:
+                # Only the owner can change the height of the rows
+                data['height'] = event['data']['height']
+            event['data'] = data
+        if 'idx' in event:
+            event['idx'] += self.offset(name)
+        return event
+
+    def offset(self, name):
+        """
+        Returns the index of the first plot of a producer in the dashboard.
+        """
+        return sum(self.counts[n] for n in self.names[:self.names.index(name)])
+
+    def grid(self):
+        """
+        Returns the grid of the dashboard.
+        """
+        return [cols for name in self.names for cols in self.grids[name]]
+
+
+def merge_push(target, data, max_points=None):
+    """
+    Appends the points of a push event to `target` in place.
+    :param target: dictionary with the same structure as the `data` of a
+    Chart.js config or of a push event (i.e., with keys `labels` and
+    `datasets`).
+    :param data: the `data` of a push event. If it has a `replace` key, that
+    many points are removed from the end of each dataset before appending.
+    :param max_points: if given, only the last `max_points` points are kept.
+    """
+    replace = data.get('replace', 0)
+    removed = replace
+    if target['labels'] is not None:
+        _extend(target['labels'], data['labels'], max_points)
+    for dataset, points in zip(target['datasets'], data['datasets']):
+        for key, values in points.items():
+            if isinstance(dataset[key], np.ndarray):
+                # Values taken from a plot (e.g., a radar push) cannot grow
+                dataset[key] = dataset[key].tolist()
+            removed = min(replace, len(dataset[key]))
+            del dataset[key][len(dataset[key]) - removed:]
+            _extend(dataset[key], values, max_points)
+    if removed < replace:
+        # Target is also a push event, which must replace the remaining points
+        target['replace'] = target.get('replace', 0) + replace - removed
+
+
+def concat_pushes(data):
+    """
+    Concatenates the data of many push events to the same plot, none of which
+    has a `replace` key.
+    :param data: list of the `data` of push events.
+    :return: the `data` of a single push event.
+    """
+    if len(data) == 1:
+        return data[0]
+    output = {
+        'labels': None,
+        'datasets': []
+    }
+    if data[0]['labels'] is not None:
+        output['labels'] = [label for d in data for label in d['labels']]
+    for i, dataset in enumerate(data[0]['datasets']):
+        output['datasets'].append({
+            key: _concat([d['datasets'][i][key] for d in data]) for key in dataset
+        })
+    return output
+
+
+def _concat(values):
+    if isinstance(values[0], Points):
+        return Points(np.concatenate([v.x.array() for v in values]),
+                      np.concatenate([v.y.array() for v in values]))
+    if isinstance(values[0], np.ndarray):
+        return np.concatenate(values)
+    return [value for v in values for value in v]
+
+
+def _extend(target, values, max_points):
+    # Ring buffers drop the oldest values by themselves
+    target.extend(values)
+    if max_points is not None and len(target) > max_points:
+        del target[:len(target) - max_points]
+
+
+def _use_rings(plot):
+    """
+    Stores the per-point values of a plot with a maximum number of points in
+    ring buffers (in place), so that pushing to a full plot costs the same as
+    pushing to a plot that still grows.
+    :return: the plot.
+    """
+    capacity = plot.get('max_points')
+    if capacity is None:
+        return plot
+    data = plot['data']
+    if data['labels'] is not None:
+        data['labels'] = RingBuffer(capacity, data['labels'])
+    for dataset in data['datasets']:
+        n = len(dataset['data'])
+        for key, values in dataset.items():
+            if isinstance(values, Points):
+                dataset[key] = Points(values.x.array(), values.y.array(), capacity)
+            elif _is_column(key, values, n):
+                dataset[key] = RingBuffer(capacity, values)
+    return plot
+
+
+def _is_column(key, values, n):
+    # Whether a value of a dataset has one item per point (e.g., the data, or
+    # the colors of the slices of a pie chart)
+    return key == 'data' or (isinstance(values, (list, RingBuffer)) and len(values) == n)
+
+
+def apply_patch(plot, data):
+    """
+    Applies the changes of a patch event to a plot in place.
+    :param plot: Chart.js config of the plot.
+    :param data: the `data` of a patch event.
+    """
+    if data['labels'] is not None:
+        _assign(plot['data']['labels'], data['labels']['idx'], data['labels']['values'])
+    for dataset, changes in zip(plot['data']['datasets'], data['datasets']):
+        for key, values in changes.items():
+            if key != 'idx':
+                _assign(dataset[key], changes['idx'], values)
+    if 'options' in data:
+        plot['options'] = data['options']
+
+
+def merge_patches(plot, first, second):
+    """
+    Merges the data of two patch events for the same plot. Both patches must
+    have already been applied to the plot, from which the new values are read.
+    :param plot: Chart.js config of the plot.
+    :param first: the `data` of the first patch event.
+    :param second: the `data` of the second patch event.
+    :return: the `data` of a patch event with the changes of both.
+    """
+    output = {
+        'labels': None,
+        'datasets': []
+    }
+    labels = [p['labels']['idx'] for p in (first, second) if p['labels'] is not None]
+    if labels:
+        idx = np.union1d(*labels) if len(labels) == 2 else labels[0]
+        output['labels'] = {'idx': idx, 'values': _take(plot['data']['labels'], idx)}
+    for dataset, a, b in zip(plot['data']['datasets'], first['datasets'], second['datasets']):
+        idx = np.union1d(a['idx'], b['idx']).astype(int)
+        changes = {key: _take(dataset[key], idx) for key in a if key != 'idx'}
+        changes['idx'] = idx
+        output['datasets'].append(changes)
+    if 'options' in first or 'options' in second:
+        output['options'] = plot['options']
+    return output
+
+
+def _assign(target, idx, values):
+    if isinstance(target, list):
+        if isinstance(values, np.ndarray):
+            values = values.tolist()
+        for i, value in zip(idx, values):
+            target[i] = value
+    else:
+        target[idx] = values
+
+
+def _slice(values, key):
+    if isinstance(values, (list, np.ndarray)):
+        return values[key]
+    return values.take(key)
+
+
+def _take(values, idx):
+    if isinstance(values, list):
+        return [values[i] for i in idx]
+    return values.take(idx)
@@ -1,26 +1,26 @@
 let charts = [];
 
+let layout = {grid: [], height: 300};
+
 function renderGrid(plots, grid) {
     // Create charts
     for (let idx = 0; idx < plots.length; idx++) {
-        let ij = idxToCoords(idx, grid);
-        let i = ij[0];
-        let j = ij[1];
-        let ctx = document.getElementById(`canvas-${i}-${j}`).getContext('2d');
-        let chart = new Chart(ctx, plots[idx]);
-        charts.push(chart);
+        addChart(idx, plots[idx], grid);
     }
 }
 
 
-function createCanvasGrid(grid, colHeight) {
+function createCanvasGrid(grid, colHeight, canvases) {
+    // Existing canvases (if any) are moved to the first cells of the grid
+    layout = {grid: grid, height: colHeight};
+    canvases = canvases ? canvases.slice() : [];
     for (let i = 0; i < grid.length; i++) {
-        createRow(i, grid[i], colHeight + "px");
+        createRow(i, grid[i], colHeight + "px", canvases);
     }
 }
 
 
-function createRow(rowIdx, cols, colHeight) {
+function createRow(rowIdx, cols, colHeight, canvases) {
     // Add Bootstrap row
     let row = document.createElement("div");
     row.className = 'row';
@@ -33,15 +33,23 @@ function createRow(rowIdx, cols, colHeight) {
         let div = document.createElement("div");
         div.className = 'plot col-sm';
         div.id = `plot-${rowIdx}-${col}`;
+        row.appendChild(div);
 
         // Add canvas
-        div.innerHTML = `
-            <canvas id="canvas-${rowIdx}-${col}" style="height: ${colHeight};"></canvas>
-        `;
-        row.appendChild(div);
+        let canvas = canvases.shift();
+        if (canvas == null) {
+            canvas = document.createElement("canvas");
+            canvas.style.height = colHeight;
+        }
+        canvas.id = `canvas-${rowIdx}-${col}`;
+        div.appendChild(canvas);
 
         // Save images on click
-        $(`#canvas-${rowIdx}-${col}`).click(function() {
+        $(canvas).off('click').click(function() {
+            if (this.dragged) {
+                // The chart was panned, not clicked
+                return;
+            }
             let link = document.createElement("a");
             link.setAttribute('download', $(this).attr('id') + '.png');
             link.setAttribute('href', $(this)[0].toDataURL("image/png").replace("image/png", "image/octet-stream"));
@@ -51,6 +59,135 @@ function createRow(rowIdx, cols, colHeight) {
 }
 
 
+function moveCanvases(grid, colHeight, insertIdx) {
+    // Re-arranges the grid, keeping the existing charts
+    const canvases = charts.map(chart => chart.canvas);
+    if (insertIdx !== undefined) {
+        // Leave an empty cell for a new chart
+        canvases.splice(insertIdx, 0, null);
+    }
+    removeRows();
+    createCanvasGrid(grid, colHeight, canvases);
+    for (let chartIdx = 0; chartIdx < charts.length; chartIdx++) {
+        charts[chartIdx].resize();
+    }
+}
+
+
+function addChart(idx, plot, grid) {
+    decodeDatasets(plot.data.datasets);
+    let ij = idxToCoords(idx, grid);
+    let ctx = document.getElementById(`canvas-${ij[0]}-${ij[1]}`).getContext('2d');
+    let chart = new Chart(ctx, plot);
+    charts.splice(idx, 0, chart);
+    if (chart.config.type === 'line' || chart.config.type === 'scatter') {
+        enableZoom(chart);
+    }
+}
+
+
+function enableZoom(chart) {
+    // The x axis of the chart zooms with the mouse wheel and pans by dragging,
+    // and zooming out to the whole series goes back to the original view.
+    // While zoomed, the chart shows the points in view at the resolution of
+    // the canvas, requested from the server, and keeps the whole series aside
+    // in chart.fullData (where new points are pushed)
+    const canvas = chart.canvas;
+    let dragX = null;
+    canvas.addEventListener('wheel', function(event) {
+        event.preventDefault();
+        const scale = xScale(chart);
+        const x = scale.getValueForPixel(event.offsetX);
+        const factor = event.deltaY < 0 ? 0.8 : 1.25;
+        setView(chart, x - (x - scale.min) * factor, x + (scale.max - x) * factor);
+    });
+    canvas.addEventListener('mousedown', function(event) {
+        dragX = event.offsetX;
+        canvas.dragged = false;
+    });
+    canvas.addEventListener('mousemove', function(event) {
+        if (dragX === null || chart.fullData == null) {
+            return;
+        }
+        const scale = xScale(chart);
+        const shift = scale.getValueForPixel(dragX) - scale.getValueForPixel(event.offsetX);
+        dragX = event.offsetX;
+        canvas.dragged = true;
+        setView(chart, scale.min + shift, scale.max + shift);
+    });
+    for (let type of ['mouseup', 'mouseleave']) {
+        canvas.addEventListener(type, function() {
+            dragX = null;
+        });
+    }
+}
+
+
+function xScale(chart) {
+    return chart.scales[chart.options.scales.xAxes[0].id];
+}
+
+
+function setView(chart, xMin, xMax) {
+    if (chart.fullData == null) {
+        const scale = xScale(chart);
+        chart.fullRange = [scale.min, scale.max];
+        chart.fullData = chart.data.datasets.map(dataset => ({data: dataset.data}));
+    }
+    if (xMin <= chart.fullRange[0] && xMax >= chart.fullRange[1]) {
+        resetView(chart);
+        return;
+    }
+    const ticks = chart.options.scales.xAxes[0].ticks;
+    ticks.min = xMin;
+    ticks.max = xMax;
+    chart.update(0);
+    requestView(chart);
+}
+
+
+function resetView(chart) {
+    const ticks = chart.options.scales.xAxes[0].ticks;
+    delete ticks.min;
+    delete ticks.max;
+    for (let i = 0; i < chart.fullData.length; i++) {
+        chart.data.datasets[i].data = chart.fullData[i].data;
+    }
+    chart.fullData = null;
+    chart.update(0);
+}
+
+
+function requestView(chart) {
+    // Requests the points in view at most every 100 ms
+    if (chart.viewTimer != null) {
+        return;
+    }
+    chart.viewTimer = setTimeout(function() {
+        chart.viewTimer = null;
+        if (chart.fullData == null) {
+            return;
+        }
+        const idx = charts.indexOf(chart);
+        const ticks = chart.options.scales.xAxes[0].ticks;
+        const view = [ticks.min, ticks.max];
+        const query = {xmin: view[0], xmax: view[1], points: 2 * Math.ceil(chart.chartArea.right - chart.chartArea.left)};
+        $.getJSON(`/data/${idx}`, query, function(data) {
+            const ticks = chart.options.scales.xAxes[0].ticks;
+            if (chart.fullData == null || charts.indexOf(chart) !== idx || ticks.min !== view[0] || ticks.max !== view[1]) {
+                // The view changed in the meantime
+                return;
+            }
+            decodeDatasets(data.datasets);
+            for (let i = 0; i < data.datasets.length; i++) {
+                chart.data.datasets[i].data = data.datasets[i].data;
+            }
+            chart.update(0);
+        });
+    }, 100);
+}
+
+
 /*  */
 function clearGrid() {
     // Destroy all Chart objects and clear list
@@ -58,11 +195,15 @@ function clearGrid() {
         charts[chartIdx].destroy();
     }
     charts.length = 0;
+    removeRows();
+}
+
 
+function removeRows() {
     // Remove all divs
-    let divs = document.getElementsByClassName('plot');
-    while (divs[0]) {
-        divs[0].parentElement.parentElement.removeChild(divs[0].parentElement);
+    let wrapper = document.getElementById('wrapper');
+    while (wrapper.firstChild) {
+        wrapper.removeChild(wrapper.firstChild);
     }
 }
 
@@ -82,6 +223,93 @@ function idxToCoords(idx, grid) {
 }
 
 
+function decodeColumn(column) {
+    // Columns are either plain arrays, typed arrays (from binary messages) or
+    // base64 strings of little-endian floats
+    if (Array.isArray(column) || ArrayBuffer.isView(column)) {
+        return column;
+    }
+    const binary = atob(column.base64);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    if (column.dtype === 'float32') {
+        return new Float32Array(bytes.buffer);
+    }
+    return new Float64Array(bytes.buffer);
+}
+
+
+function decodeBinary(buffer) {
+    // Binary messages have a JSON header (with its length in the first 4
+    // bytes), followed by the raw columns that the header refers to
+    const headerLength = new DataView(buffer).getUint32(0, true);
+    const header = new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength));
+    const start = 4 + headerLength;
+    return JSON.parse(header, function(key, value) {
+        if (value != null && value.dtype != null && value.offset != null) {
+            const offset = start + value.offset;
+            if (value.dtype === 'float32') {
+                return new Float32Array(buffer, offset, value.length);
+            }
+            return new Float64Array(buffer, offset, value.length);
+        }
+        return value;
+    });
+}
+
+
+function decodePoints(data) {
+    // Chart.js needs a list of {x, y} points, which the 'columns' and 'base64'
+    // wire formats send as two columns
+    if (Array.isArray(data)) {
+        return data;
+    }
+    const x = decodeColumn(data.x);
+    const y = decodeColumn(data.y);
+    let points = new Array(y.length);
+    for (let i = 0; i < y.length; i++) {
+        points[i] = {x: x[i], y: y[i]};
+    }
+    return points;
+}
+
+
+function decodeDatasets(datasets) {
+    for (let i = 0; i < datasets.length; i++) {
+        if (datasets[i].data != null) {
+            datasets[i].data = decodePoints(datasets[i].data);
+        }
+    }
+}
+
+
+function extend(array, values, maxPoints) {
+    // Appends values in place (spreading large arrays can overflow the stack)
+    for (let i = 0; i < values.length; i++) {
+        array.push(values[i]);
+    }
+    // Drop the oldest values if the plot has a rolling window
+    if (maxPoints != null && array.length > maxPoints) {
+        array.splice(0, array.length - maxPoints);
+    }
+}
+
+
+function sameGrid(a, b) {
+    return a.length === b.length && a.every((cols, i) => cols === b[i]);
+}
+
+
+function assign(array, indices, values) {
+    // Replaces the values at the given indices in place
+    for (let i = 0; i < indices.length; i++) {
+        array[indices[i]] = values[i];
+    }
+}
+
+
 function log(arg) {
     console.log(arg);
 }
@@ -97,24 +325,27 @@ Chart.plugins.register({
   }
 });
 
+let useWebsocket = false;
+let lastEventId = null;
 $.ajax({
     type: 'GET',
     url: '/config',
     async: false,
-    success: function(data) {
+    success: function(data, status, xhr) {
         let eventJSON = JSON.parse(data);
         clearGrid();
         const grid = eventJSON.grid;
         const colHeight = eventJSON.height;
         createCanvasGrid(grid, colHeight);
         renderGrid(eventJSON.plots, grid);
+        useWebsocket = xhr.getResponseHeader('X-Pncl-Websocket') === '1' && 'WebSocket' in window;
+        lastEventId = xhr.getResponseHeader('X-Pncl-Event-Id');
     }
 });
 
-let source = new EventSource("/event");
-source.onmessage = function(event) {
+
+function handleEvent(eventJSON) {
     let idx;
-    let eventJSON = JSON.parse(event.data);
     if (eventJSON.type === 'new_grid') {
         log(eventJSON.type);
         clearGrid();
@@ -125,23 +356,136 @@ source.onmessage = function(event) {
     } else if (eventJSON.type === 'refresh') {
         log(eventJSON.type);
         idx = eventJSON.idx;
+        decodeDatasets(eventJSON.data.data.datasets);
+        // The new options reset the zoom
+        charts[idx].fullData = null;
         Object.assign(charts[idx].config, eventJSON.data);
         Object.assign(charts[idx].options, eventJSON.data.options);
         charts[idx].update();
     } else if (eventJSON.type === 'push') {
         log(eventJSON.type);
         idx = eventJSON.idx;
+        const maxPoints = charts[idx].config.max_points;
         if (charts[idx].data.labels != null) {
-            charts[idx].data.labels.push(eventJSON.data.label);
+            extend(charts[idx].data.labels, eventJSON.data.labels, maxPoints);
         }
+        const replace = eventJSON.data.replace || 0;
+        // Zoomed charts keep the whole series aside
+        const datasets = charts[idx].fullData || charts[idx].data.datasets;
+        decodeDatasets(eventJSON.data.datasets);
         for (let i = 0; i < eventJSON.data.datasets.length; i++) {
              for (let key in eventJSON.data.datasets[i]){
-                charts[idx].data.datasets[i][key].push(eventJSON.data.datasets[i][key]);
+                let array = datasets[i][key];
+                // Decimated plots replace the last points
+                array.splice(array.length - replace, replace);
+                extend(array, eventJSON.data.datasets[i][key], maxPoints);
             }
         }
+        if (charts[idx].fullData != null) {
+            requestView(charts[idx]);
+        }
+        charts[idx].update();
+    } else if (eventJSON.type === 'add_plot') {
+        log(eventJSON.type);
+        if (eventJSON.idx < charts.length) {
+            // The following charts move forward by one cell
+            moveCanvases(eventJSON.grid, layout.height, eventJSON.idx);
+        } else if (!sameGrid(eventJSON.grid, layout.grid)) {
+            moveCanvases(eventJSON.grid, layout.height);
+        }
+        addChart(eventJSON.idx, eventJSON.data, eventJSON.grid);
+    } else if (eventJSON.type === 'remove_plot') {
+        log(eventJSON.type);
+        let chart = charts.splice(eventJSON.idx, 1)[0];
+        chart.destroy();
+        chart.canvas.remove();
+        moveCanvases(eventJSON.grid, layout.height);
+    } else if (eventJSON.type === 'layout') {
+        log(eventJSON.type);
+        moveCanvases(eventJSON.data.grid, eventJSON.data.height);
+    } else if (eventJSON.type === 'patch') {
+        log(eventJSON.type);
+        idx = eventJSON.idx;
+        const patch = eventJSON.data;
+        if (patch.labels != null) {
+            assign(charts[idx].data.labels, patch.labels.idx, patch.labels.values);
+        }
+        const datasets = charts[idx].fullData || charts[idx].data.datasets;
+        decodeDatasets(patch.datasets);
+        for (let i = 0; i < patch.datasets.length; i++) {
+            for (let key in patch.datasets[i]) {
+                if (key !== 'idx') {
+                    assign(datasets[i][key], patch.datasets[i].idx, patch.datasets[i][key]);
+                }
+            }
+        }
+        if (charts[idx].fullData != null) {
+            requestView(charts[idx]);
+        }
+        if (patch.options != null) {
+            charts[idx].config.options = patch.options;
+            Object.assign(charts[idx].options, patch.options);
+        }
         charts[idx].update();
     }
     else {
         log('No events');
     }
-};
+}
+
+
+function connectSSE(resync) {
+    // The server sends the events after the config that was loaded, and the
+    // EventSource asks for the events that it missed when it reconnects
+    let query = lastEventId != null ? `?last_id=${encodeURIComponent(lastEventId)}` : '';
+    if (resync) {
+        // The page missed events that it cannot name, so it starts over from a
+        // snapshot of the server's state
+        query = '?resync=1';
+    }
+    let source = new EventSource(`/event${query}`);
+    source.onmessage = function(event) {
+        handleEvent(JSON.parse(event.data));
+    };
+}
+
+
+function connectWebsocket(resync) {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    // The server sends the events after the config that was loaded, or a
+    // snapshot if it cannot tell which ones the page missed
+    let query = lastEventId != null ? `?last_id=${encodeURIComponent(lastEventId)}` : '';
+    if (resync) {
+        query = '?resync=1';
+    }
+    let ws = new WebSocket(`${protocol}//${window.location.host}/ws${query}`);
+    ws.binaryType = 'arraybuffer';
+    let opened = false;
+    ws.onopen = function() {
+        opened = true;
+    };
+    ws.onmessage = function(event) {
+        handleEvent(decodeBinary(event.data));
+        // Lets the server send the next message
+        ws.send('ack');
+    };
+    ws.onclose = function() {
+        if (opened) {
+            // The connection dropped: reconnect, and resync from a snapshot
+            log('WebSocket closed, reconnecting');
+            setTimeout(function() { connectWebsocket(true); }, 1000);
+        } else {
+            // Binary messages have no IDs, so after a WebSocket the page
+            // cannot ask for the events that it missed
+            log('WebSocket not available, using SSE');
+            connectSSE(resync);
+        }
+    };
+}
+
+
+if (useWebsocket) {
+    connectWebsocket(false);
+} else {
+    connectSSE(false);
+}
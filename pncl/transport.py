@@ -0,0 +1,343 @@
+import collections
+import multiprocessing
+import os
+import socket
+import threading
+import traceback
+from multiprocessing.connection import Client
+
+
+class Transport:
+    def __init__(self):
+        """
+        Base class for the channels that carry events from Pencil to the
+        backend server. Events are always sent in batches (lists), so that many
+        events can be transmitted with a single message.
+        """
+        pass
+
+    def send(self, event):
+        """
+        Sends a single event to the server.
+        :param event: dictionary, as created by Pencil.
+        """
+        self.send_many([event])
+
+    def send_many(self, events):
+        """
+        Sends a batch of events to the server with a single message.
+        :param events: list of dictionaries.
+        """
+        raise NotImplementedError
+
+    def recv_many(self):
+        """
+        Called by the server. Returns all the events that can be read without
+        blocking, in the order in which they were sent.
+        """
+        raise NotImplementedError
+
+    def attach(self, loop, callback):
+        """
+        Called by the server. Makes the event loop call `callback` with a list
+        of events as soon as new events are available.
+        :param loop: asyncio event loop of the server.
+        :param callback: function that takes a list of events.
+        """
+        raise NotImplementedError
+
+    def flush(self, timeout=None):
+        """
+        Waits until all the events passed to `send_many` have been sent.
+        :param timeout: maximum number of seconds to wait (None to wait
+        indefinitely).
+        :return: True if all events were sent, False if the timeout expired.
+        """
+        return True
+
+    def close(self):
+        """
+        Closes the sending side of the transport.
+        """
+        pass
+
+    def close_receiver(self):
+        """
+        Called by Pencil once the server process has started. Closes the
+        receiving side of the transport in Pencil's process, if the server
+        has its own copy of it.
+        """
+        pass
+
+
+class PipeTransport(Transport):
+    def __init__(self):
+        """
+        Default transport, based on a one-way `multiprocessing.Pipe`. Messages
+        are written directly to the OS pipe that connects Pencil to the server
+        process, without going through a third process.
+        """
+        super().__init__()
+        self._reader, self._writer = multiprocessing.Pipe(duplex=False)
+        self._closed = False
+
+    def send_many(self, events):
+        self._writer.send(events)
+
+    def recv_many(self):
+        events = []
+        try:
+            while self._reader.poll():
+                events.extend(self._reader.recv())
+        except EOFError:
+            self._closed = True
+        return events
+
+    def attach(self, loop, callback):
+        def on_readable():
+            events = self.recv_many()
+            if self._closed:
+                # All senders are gone, stop watching the pipe
+                loop.remove_reader(self._reader.fileno())
+            if events:
+                callback(events)
+
+        loop.add_reader(self._reader.fileno(), on_readable)
+
+    def close(self):
+        self._writer.close()
+
+    def close_receiver(self):
+        # Once the server is the only reader, sending raises BrokenPipeError if
+        # the server exits, instead of blocking when the pipe is full
+        self._reader.close()
+
+
+class ManagerTransport(Transport):
+    def __init__(self):
+        """
+        Transport based on a `multiprocessing.Manager` queue. Every operation is
+        a round trip to the manager process, so this is much slower than
+        `PipeTransport`, but the queue can be shared with any process that has
+        access to the manager.
+        """
+        super().__init__()
+        self._manager = multiprocessing.Manager()
+        self._queue = self._manager.Queue()
+
+    def send_many(self, events):
+        self._queue.put(events)
+
+    def recv_many(self):
+        events = []
+        while True:
+            try:
+                events.extend(self._queue.get(block=False))
+            except:
+                break
+        return events
+
+    def attach(self, loop, callback):
+        # Manager queues cannot be watched by the event loop, so a thread does
+        # blocking reads and hands the events over to the loop.
+        def read():
+            while True:
+                try:
+                    events = self._queue.get()
+                except (EOFError, OSError):
+                    break
+                loop.call_soon_threadsafe(callback, events + self.recv_many())
+
+        threading.Thread(target=read, daemon=True).start()
+
+
+class BackgroundTransport(Transport):
+    # Events that can be dropped when the buffer is full. Other events change
+    # the structure of the plots and are always sent.
+    droppable = ('push',)
+    # Events that change the indices of the plots
+    structural = ('new_grid', 'add_plot', 'remove_plot', 'layout')
+
+    def __init__(self, transport, max_size=None, policy='block', coalesce=True, on_drop=None):
+        """
+        Wraps another transport, so that sending events never waits for the
+        server: events are added to an in-process buffer, and a daemon thread
+        sends everything that has accumulated in the buffer as a single batch
+        (pickling and writing to the pipe happen on that thread).
+        :param transport: Transport object used to send the events.
+        :param max_size: maximum number of events in the buffer. If None, the
+        buffer is unbounded.
+        :param policy: what to do when the buffer is full. If 'block', senders
+        wait until there is space in the buffer. If 'drop', new push events are
+        dropped (and counted in `dropped`), while all other events are always
+        added to the buffer. Pushes that replace points already sent (e.g., to
+        decimated plots) are never dropped.
+        :param coalesce: if True, a push to a plot that already has a push
+        waiting in the buffer is appended to it, instead of being added as a
+        new event (as long as no other event for the same plot, or event that
+        changes the grid, was added in between). Merged pushes never count
+        towards `max_size`, and are counted in `merged`.
+        :param on_drop: function called with each dropped event, in the thread
+        that sent it (e.g., to refresh the plot in full with its next update,
+        since the server is missing some of its points).
+        """
+        super().__init__()
+        if policy not in ('block', 'drop'):
+            raise ValueError('policy must be \'block\' or \'drop\'.')
+        self.transport = transport
+        self.max_size = max_size
+        self.policy = policy
+        self.coalesce = coalesce
+        self.on_drop = on_drop
+        self.dropped = 0
+        # Number of pushes appended to a push already in the buffer
+        self.merged = 0
+        self._events = collections.deque()
+        # Pushes in the buffer that can be extended, by plot index
+        self._pushes = {}
+        self._sending = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def send_many(self, events):
+        with self._cond:
+            if self.coalesce:
+                events = self._merge(events)
+            if self.max_size is not None and events:
+                if self.policy == 'drop':
+                    events = self._drop(events)
+                else:
+                    self._cond.wait_for(lambda: len(self._events) < self.max_size)
+            self._events.extend(events)
+            if self.coalesce:
+                self._track(events)
+            self._cond.notify_all()
+
+    def recv_many(self):
+        return self.transport.recv_many()
+
+    def attach(self, loop, callback):
+        self.transport.attach(loop, callback)
+
+    def __len__(self):
+        """
+        Number of events waiting in the buffer.
+        """
+        return len(self._events)
+
+    def full(self):
+        """
+        Returns True if the buffer is full.
+        """
+        return self.max_size is not None and len(self._events) >= self.max_size
+
+    def wait_for_space(self, timeout=None):
+        """
+        Waits until the buffer is not full.
+        :param timeout: maximum number of seconds to wait (None to wait
+        indefinitely).
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: not self.full(), timeout)
+
+    def flush(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._events and not self._sending, timeout)
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.transport.close()
+
+    def _merge(self, events):
+        # Appends pushes to the pushes already in the buffer, where possible
+        from pncl.state import merge_push  # Imports numpy, like the plots
+        output = []
+        for event in events:
+            previous = self._pushes.get(event.get('idx'))
+            if event['type'] == 'push' and previous is not None and not output:
+                merge_push(previous['data'], event['data'])
+                self.merged += 1
+            else:
+                output.append(event)
+        return output
+
+    def _track(self, events):
+        for event in events:
+            if event['type'] in self.structural:
+                self._pushes.clear()
+            elif event['type'] == 'push':
+                self._pushes[event['idx']] = event
+            else:
+                self._pushes.pop(event['idx'], None)
+
+    def _drop(self, events):
+        output = []
+        for event in events:
+            if len(self._events) + len(output) >= self.max_size and self._droppable(event):
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(event)
+            else:
+                output.append(event)
+        return output
+
+    def _droppable(self, event):
+        # The browser cannot apply a push that replaces points after missing
+        # the push that sent them
+        return event['type'] in self.droppable and 'replace' not in event['data']
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._events or self._closed)
+                if not self._events:
+                    break
+                batch = list(self._events)
+                self._events.clear()
+                self._pushes.clear()
+                self._sending = True
+                self._cond.notify_all()
+            try:
+                self.transport.send_many(batch)
+            except OSError:
+                # The server is gone, the events cannot be delivered
+                pass
+            except Exception:
+                # Keep sending the following events
+                traceback.print_exc()
+            with self._cond:
+                self._sending = False
+                self._cond.notify_all()
+
+
+class SocketTransport(Transport):
+    def __init__(self, address, name=None, authkey=None):
+        """
+        Transport that sends events to a server owned by another process, which
+        accepts connections on `address` (see `Pencil.connect`). Each batch of
+        events is sent as a message `(name, seq, events)`, where `seq` counts
+        the messages sent on this connection from zero.
+        :param address: `(host, port)` tuple, or path of a Unix socket.
+        :param name: name of the producer. If None, the host name and the
+        process id are used.
+        :param authkey: bytes, secret key of the server.
+        """
+        super().__init__()
+        if name is None:
+            name = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.name = name
+        self._conn = Client(address, authkey=authkey)
+        self._seq = 0
+
+    def send_many(self, events):
+        self._conn.send((self.name, self._seq, events))
+        self._seq += 1
+
+    def close(self):
+        self._conn.close()
@@ -1,5 +1,10 @@
+import base64
+import struct
+
 import numpy as np
 
+from pncl.encoders import get_encoder, to_bytes
+
 COLORS = [
     (75, 192, 192),   # Light blue
     (240, 139, 75),   # Orange
@@ -35,18 +40,77 @@ class Color:
 
 
 def check_args(*args):
-    output = list(args)
-    for i in range(len(output)):
-        if isinstance(output[i], list):
+    for arg in args:
+        if isinstance(arg, list):
+            pass
+        elif isinstance(arg, np.ndarray) and arg.ndim == 1:
             pass
-        elif isinstance(output[i], np.ndarray):
-            output[i] = output[i].tolist()
         else:
             raise TypeError('Data must be either a list or a rank 1 np.ndarray.')
 
-    return output
+    return list(args)
 
 
 def lists_to_points(x, y):
     output = [{'x': x[i], 'y': y[i]} for i in range(len(x))]
     return output
+
+
+def pack(array):
+    """
+    Packs a numeric np.array as a base64 string of little-endian floats (see
+    `pncl.encoders.to_bytes`). Non-numeric arrays are returned as lists.
+    :return: dictionary with keys `dtype` and `base64`, or list.
+    """
+    if array.dtype.kind not in 'biuf':
+        return array.tolist()
+    dtype, data = to_bytes(array)
+    return {
+        'dtype': dtype,
+        'base64': base64.b64encode(data).decode('ascii')
+    }
+
+
+# Default encoder, created on first use
+_encoder = None
+
+
+def _default_encoder():
+    global _encoder
+    if _encoder is None:
+        _encoder = get_encoder()
+    return _encoder
+
+
+def to_json(obj, wire_format='points', encoder=None):
+    """
+    Serializes the given object to JSON, converting Numpy scalars and arrays to
+    Python types. Objects with an `encode(wire_format)` method (e.g.,
+    `pncl.plots.Points`) are serialized with the given wire format.
+    :param encoder: `pncl.encoders.Encoder` object. If None, the fastest encoder
+    that is installed is used.
+    """
+    if encoder is None:
+        encoder = _default_encoder()
+    return encoder.dumps(obj, wire_format)
+
+
+def to_binary(obj, encoder=None):
+    """
+    Serializes the given object to a binary message, in which the columns of
+    `pncl.plots.Points` are stored as raw little-endian floats instead of JSON.
+    The message contains:
+    - the length of the JSON header, as a 4-byte little-endian integer;
+    - the JSON header, padded with spaces to a multiple of 8 bytes;
+    - the bytes of the columns, each padded to a multiple of 8 bytes.
+    In the header, each column is replaced by a reference to its bytes (see
+    `pncl.encoders.Binary.write`).
+    :param encoder: `pncl.encoders.Encoder` object. If None, the fastest encoder
+    that is installed is used.
+    """
+    buffers = []
+    if encoder is None:
+        encoder = _default_encoder()
+    header = encoder.dumps(obj, 'binary', buffers).encode('utf-8')
+    header += b' ' * (-(len(header) + 4) % 8)
+    return b''.join([struct.pack('<I', len(header)), header] + buffers)
@@ -14,6 +14,9 @@ setup(
                       'aiohttp-sse',
                       'numpy',
                       'requests'],
+    extras_require={
+        'fast': ['orjson']
+    },
     url='https://github.com/danielegrattarola/pncl',
     license='MIT',
     author='Daniele Grattarola',